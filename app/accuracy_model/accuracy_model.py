@@ -3,6 +3,7 @@ import math
 import operator
 
 from parameters import log_reg_past_20_tail1m as params
+from prediction_table import PredictionTable
 
 # TODO(david): Find out what this actually is
 PROBABILITY_FIRST_PROBLEM_CORRECT = 0.8
@@ -18,6 +19,9 @@ EWMA_SEED = 0.9
 MAX_HISTORY_KEPT = 20
 MAX_HISTORY_BIT_MASK = (1 << MAX_HISTORY_KEPT) - 1
 
+# Compiled once per instance; see prediction_table.py
+PREDICTION_TABLE = PredictionTable(params, MAX_HISTORY_KEPT, EWMA_SEED)
+
 def bit_count(num):
     # TODO(david): This uses Kerninghan's method, which would not be very quick
     #     for dense 1s. Use numpy or some library.
@@ -110,6 +114,18 @@ class AccuracyModel(object):
             self.update_to_new_version()
 
         # We don't try to predict the first problem (no user-exercise history)
+        if self.total_done == 0:
+            return PROBABILITY_FIRST_PROBLEM_CORRECT
+
+        return PREDICTION_TABLE.predict(self.answer_history, self.total_done)
+
+    def predict_arithmetic(self):
+        """
+        Same as predict(), but computes every feature from scratch instead of
+        reading them out of PREDICTION_TABLE. Kept as the reference
+        implementation for tests and benchmarks.
+        """
+
         if self.total_done == 0:
             return PROBABILITY_FIRST_PROBLEM_CORRECT
 
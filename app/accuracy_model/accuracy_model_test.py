@@ -7,6 +7,8 @@ flaky.
 import unittest
 
 from accuracy_model import AccuracyModel
+from progress_normalizer import InvFnExponentialNormalizer
+import batch
 
 class TestSequenceFunctions(unittest.TestCase):
 
@@ -98,5 +100,48 @@ class TestSequenceFunctions(unittest.TestCase):
             self.assertTrue(self.is_struggling('110' * i),
                             msg="Should be struggling on %s" % ('110' * i))
 
+    def test_prediction_table_matches_arithmetic(self):
+        def assert_matches(answer_history, total_done):
+            model = AccuracyModel()
+            model.answer_history = answer_history
+            model.total_done = total_done
+            self.assertAlmostEqual(model.predict(), model.predict_arithmetic(),
+                                   places=12)
+
+        # Every state with a short history...
+        for total_done in range(12):
+            for answer_history in range(1 << total_done):
+                assert_matches(answer_history, total_done)
+
+        # ...and a deterministic spread over the full 20-bit history
+        for answer_history in range(0, 1 << 20, 997):
+            assert_matches(answer_history, 20)
+
+        # Bits above total_done are ignored, as in the arithmetic path
+        assert_matches(0xFFFFF, 3)
+
+    def test_batch_matches_single(self):
+        sequences = ['', '1', '0', '000', '111', '1' * 30, '0' * 30,
+                     '1101111110111', '10' * 12, '110' * 7, '0001111']
+        models = [self.model_from_str(seq) for seq in sequences]
+        normalizer = InvFnExponentialNormalizer(
+                accuracy_model=AccuracyModel().update([False] * 3),
+                proficiency_threshold=0.94)
+
+        answer_histories, totals_done = batch.pack_states(models)
+        predictions, totals_correct = batch.predict_many(answer_histories, totals_done)
+        normalized = batch.normalize_many(normalizer, predictions)
+        struggling = batch.struggling_many(totals_done, predictions,
+                param=1.8, minimum_accuracy=0.94, minimum_attempts=5)
+
+        for i, model in enumerate(models):
+            self.assertAlmostEqual(predictions[i], model.predict(), places=12)
+            self.assertEqual(totals_correct[i], model.total_correct())
+            self.assertAlmostEqual(normalized[i],
+                                   normalizer.normalize(model.predict()),
+                                   places=12)
+            self.assertEqual(struggling[i], model.is_struggling(
+                    param=1.8, minimum_accuracy=0.94, minimum_attempts=5))
+
 if __name__ == '__main__':
     unittest.main()
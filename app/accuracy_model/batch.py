@@ -0,0 +1,91 @@
+"""
+Batch evaluation of many accuracy model states at once.
+
+Coach reports need predictions, progress and struggling flags for every
+student x exercise cell. Going through AccuracyModel and
+InvFnExponentialNormalizer one cell at a time pays for attribute lookups,
+method calls and version checks per cell; these functions instead take the
+states packed into parallel integer arrays (see pack_states) and make a
+single pass over them with the prediction tables bound to locals.
+"""
+
+import array
+import math
+from itertools import izip
+
+from accuracy_model import PREDICTION_TABLE, PROBABILITY_FIRST_PROBLEM_CORRECT
+from prediction_table import CHUNK_BITS, CHUNK_MASK
+
+
+def pack_states(accuracy_models):
+    """ Packs AccuracyModels into (answer_histories, totals_done) arrays. """
+    answer_histories = array.array('L')
+    totals_done = array.array('B')
+
+    for model in accuracy_models:
+        if model.version != model.CURRENT_VERSION:
+            model.update_to_new_version()
+        answer_histories.append(model.answer_history)
+        totals_done.append(model.total_done)
+
+    return answer_histories, totals_done
+
+
+def predict_many(answer_histories, totals_done):
+    """ Returns (predictions, totals_correct) arrays for the packed states.
+
+    predictions[i] is what AccuracyModel.predict() returns for state i and
+    totals_correct[i] what AccuracyModel.total_correct() returns.
+    """
+    table = PREDICTION_TABLE
+    base, row_size = table.base, table.row_size
+    low_ewma, high_ewma = table.low_ewma, table.high_ewma
+    popcount, trailing_ones = table.popcount, table.trailing_ones
+    history_masks = table.history_masks
+    streak_weight = table.params.CURRENT_STREAK
+    exp = math.exp
+
+    predictions = array.array('d', [PROBABILITY_FIRST_PROBLEM_CORRECT]) * len(totals_done)
+    totals_correct = array.array('B', [0]) * len(totals_done)
+
+    for i, (history, total_done) in enumerate(izip(answer_histories, totals_done)):
+        if not total_done:
+            continue
+
+        history &= history_masks[total_done]
+        low = history & CHUNK_MASK
+        high = history >> CHUNK_BITS
+
+        streak = trailing_ones[low]
+        if streak == CHUNK_BITS:
+            streak += trailing_ones[high]
+
+        correct = popcount[low] + popcount[high]
+        totals_correct[i] = correct
+
+        z = (base[total_done * row_size + correct] +
+             low_ewma[low] + high_ewma[high] + streak_weight * streak)
+        predictions[i] = 1.0 / (1.0 + exp(-z))
+
+    return predictions, totals_correct
+
+
+def normalize_many(normalizer, predictions):
+    """ Applies InvFnExponentialNormalizer.normalize() to every prediction. """
+    A, B, exp = normalizer.A, normalizer.B, math.exp
+
+    normalized = array.array('d', [0.0]) * len(predictions)
+    for i, prediction in enumerate(predictions):
+        value = A * exp(B * prediction)
+        normalized[i] = 0.0 if value < 0.0 else (1.0 if value > 1.0 else value)
+
+    return normalized
+
+
+def struggling_many(totals_done, predictions, param, minimum_accuracy,
+                    minimum_attempts):
+    """ Returns a list of AccuracyModel.is_struggling() flags. """
+    return [attempts >= minimum_attempts and
+            prediction < minimum_accuracy and
+            (attempts ** param) * (minimum_accuracy - prediction) > 20.0
+            for attempts, prediction in izip(totals_done, predictions)]
@@ -0,0 +1,117 @@
+"""
+Precomputed lookup tables for AccuracyModel.predict().
+
+The logistic regression in AccuracyModel only looks at the last
+MAX_HISTORY_KEPT answers and at total_done (capped at MAX_HISTORY_KEPT), so
+every term of its dot product can be read out of small tables instead of
+being recomputed bit-by-bit:
+
+    - Both EWMAs are linear in the answer bits: bit i (0 being the most
+      recent answer) always contributes weight * (1 - weight) ** i, and the
+      seed contributes EWMA_SEED * (1 - weight) ** total_done. The per-bit
+      contributions of each 10-bit chunk of the history are summed up front.
+    - The streak and the number correct are trailing-ones and popcounts of
+      the same chunks.
+    - The log_num_done, log_num_missed, percent_correct, seed and intercept
+      terms only depend on (total_done, total_correct).
+
+A dense table over every (answer_history, total_done) state would hold
+2 ** (MAX_HISTORY_KEPT + 1) floats (16MB as doubles), which is too much to
+keep on every instance, so the history is split into chunks and prediction
+becomes a handful of array lookups plus one math.exp.
+"""
+
+import array
+import math
+
+CHUNK_BITS = 10
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+
+# Weights of the two exponential moving averages used as features.
+EWMA_3_WEIGHT = 0.333
+EWMA_10_WEIGHT = 0.1
+
+
+class PredictionTable(object):
+    """ Compiled form of a logistic regression parameter module.
+
+    Built once per parameter module (see accuracy_model.py) and shared by
+    every AccuracyModel on the instance.
+    """
+
+    def __init__(self, params, max_history, ewma_seed):
+        assert max_history <= 2 * CHUNK_BITS, \
+            "PredictionTable only supports up to %s bits of history" % (
+                2 * CHUNK_BITS)
+
+        self.params = params
+        self.max_history = max_history
+
+        # Contribution of history bit i to the EWMA part of the dot product
+        bit_weights = [
+            params.EWMA_3 * EWMA_3_WEIGHT * (1 - EWMA_3_WEIGHT) ** i +
+            params.EWMA_10 * EWMA_10_WEIGHT * (1 - EWMA_10_WEIGHT) ** i
+            for i in xrange(2 * CHUNK_BITS)]
+
+        self.low_ewma = PredictionTable._chunk_sums(bit_weights[:CHUNK_BITS])
+        self.high_ewma = PredictionTable._chunk_sums(bit_weights[CHUNK_BITS:])
+
+        self.popcount = array.array('B', [0] * CHUNK_SIZE)
+        self.trailing_ones = array.array('B', [0] * CHUNK_SIZE)
+        for chunk in xrange(1, CHUNK_SIZE):
+            self.popcount[chunk] = self.popcount[chunk & (chunk - 1)] + 1
+            if chunk & 1:
+                self.trailing_ones[chunk] = self.trailing_ones[chunk >> 1] + 1
+
+        self.history_masks = [(1 << n) - 1 for n in xrange(max_history + 1)]
+
+        # Everything that only depends on total_done and total_correct,
+        # indexed by total_done * (max_history + 1) + total_correct
+        self.row_size = max_history + 1
+        self.base = array.array('d', [0.0] * (self.row_size * self.row_size))
+        for total_done in xrange(1, max_history + 1):
+            seed_term = (
+                params.EWMA_3 * ewma_seed * (1 - EWMA_3_WEIGHT) ** total_done +
+                params.EWMA_10 * ewma_seed * (1 - EWMA_10_WEIGHT) ** total_done)
+            log_num_done = math.log(total_done)
+
+            for total_correct in xrange(total_done + 1):
+                log_num_missed = math.log(total_done - total_correct + 1)
+                percent_correct = float(total_correct) / total_done
+
+                self.base[total_done * self.row_size + total_correct] = (
+                    params.INTERCEPT + seed_term +
+                    params.LOG_NUM_DONE * log_num_done +
+                    params.LOG_NUM_MISSED * log_num_missed +
+                    params.PERCENT_CORRECT * percent_correct)
+
+    @staticmethod
+    def _chunk_sums(bit_weights):
+        sums = array.array('d', [0.0] * CHUNK_SIZE)
+        for chunk in xrange(1, CHUNK_SIZE):
+            lowest_bit = chunk & -chunk
+            sums[chunk] = (sums[chunk ^ lowest_bit] +
+                           bit_weights[lowest_bit.bit_length() - 1])
+        return sums
+
+    def predict(self, answer_history, total_done):
+        """ Returns P(next problem correct) for a state with total_done >= 1.
+
+        Equivalent to AccuracyModel.predict_arithmetic() up to floating point
+        rounding.
+        """
+        history = answer_history & self.history_masks[total_done]
+        low = history & CHUNK_MASK
+        high = history >> CHUNK_BITS
+
+        streak = self.trailing_ones[low]
+        if streak == CHUNK_BITS:
+            streak += self.trailing_ones[high]
+
+        z = (self.base[total_done * self.row_size +
+                       self.popcount[low] + self.popcount[high]] +
+             self.low_ewma[low] + self.high_ewma[high] +
+             self.params.CURRENT_STREAK * streak)
+
+        return 1.0 / (1.0 + math.exp(-z))
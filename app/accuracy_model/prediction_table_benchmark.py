@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Compares AccuracyModel.predict() (prediction table lookups) against
+AccuracyModel.predict_arithmetic() (features recomputed from scratch) and
+batch.predict_many() over the same states packed into arrays.
+
+Usage: python prediction_table_benchmark.py [--all]
+
+By default every state with total_done < 16 is timed together with a strided
+sample of the full 20-bit histories. --all times all 2 ** 21 - 1 states,
+which takes a few minutes on the arithmetic path.
+"""
+
+import sys
+import time
+
+from accuracy_model import AccuracyModel, MAX_HISTORY_KEPT
+import batch
+
+
+def states(exhaustive):
+    max_exhaustive = MAX_HISTORY_KEPT if exhaustive else 16
+    for total_done in xrange(min(max_exhaustive, MAX_HISTORY_KEPT + 1)):
+        for answer_history in xrange(1 << total_done):
+            yield answer_history, total_done
+
+    step = 1 if exhaustive else 61
+    for total_done in xrange(max_exhaustive, MAX_HISTORY_KEPT + 1):
+        for answer_history in xrange(0, 1 << total_done, step):
+            yield answer_history, total_done
+
+
+def time_predict(models, fxn_name):
+    start = time.time()
+    for model in models:
+        getattr(model, fxn_name)()
+    return time.time() - start
+
+
+def main(exhaustive):
+    models = []
+    for answer_history, total_done in states(exhaustive):
+        model = AccuracyModel()
+        model.answer_history = answer_history
+        model.total_done = total_done
+        models.append(model)
+
+    max_error = max(abs(model.predict() - model.predict_arithmetic())
+                    for model in models)
+
+    table_secs = time_predict(models, "predict")
+    arithmetic_secs = time_predict(models, "predict_arithmetic")
+
+    answer_histories, totals_done = batch.pack_states(models)
+    start = time.time()
+    batch.predict_many(answer_histories, totals_done)
+    batch_secs = time.time() - start
+
+    print "states:              %d" % len(models)
+    print "max abs difference:  %.3g" % max_error
+    print "arithmetic:          %.3fs (%.2f us/predict)" % (
+        arithmetic_secs, 1e6 * arithmetic_secs / len(models))
+    print "prediction table:    %.3fs (%.2f us/predict)" % (
+        table_secs, 1e6 * table_secs / len(models))
+    print "batch.predict_many:  %.3fs (%.2f us/predict)" % (
+        batch_secs, 1e6 * batch_secs / len(models))
+    print "speedup:             %.1fx (table), %.1fx (batch)" % (
+        arithmetic_secs / table_secs, arithmetic_secs / batch_secs)
+
+
+if __name__ == '__main__':
+    main("--all" in sys.argv[1:])
@@ -1,4 +1,5 @@
 import hashlib
+import urllib
 import zlib
 from base64 import b64encode, b64decode
 from pickle import dumps, loads
@@ -14,7 +15,7 @@ import api.jsonify as apijsonify
 from app import App
 import datetime
 from layer_cache import layer_cache_check_set_return, Layers,\
-    DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS
+    DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS, UncachedResult
     
 
 def has_flask_request_context():
@@ -90,7 +91,9 @@ def jsonify(func):
 
         camel_cased= (has_flask_request_context() and
                       flask.request.values.get("casing") == "camel")
-        return obj if isinstance(obj, basestring) else apijsonify.jsonify(obj, camel_cased=camel_cased)
+        pretty = (has_flask_request_context() and
+                  flask.request.values.get("format") == "pretty")
+        return obj if isinstance(obj, basestring) else apijsonify.jsonify(obj, camel_cased=camel_cased, pretty=pretty)
     return jsonified
 
 def jsonp(func):
@@ -204,3 +207,108 @@ def cache_with_key_fxn_and_param(
         return wrapper
     return decorator
 
+# Query parameters that never change a response. "_" is the cache buster
+# jQuery adds to JSONP requests.
+RESPONSE_CACHE_IGNORED_PARAMS = frozenset(["_"])
+
+def cached_response(version_fxn,
+                    expiration=DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS,
+                    layer=Layers.Memcache | Layers.InAppMemory):
+    """ Caches a GET handler's whole response, gzipped, with its ETag.
+
+    The cache key is made of the request path, version_fxn's result and
+    every query parameter (so "casing" and "callback" each get their own
+    entry). version_fxn is called with the handler's arguments and should
+    return something that changes whenever the content does, e.g. the topic
+    tree version. If it returns None the response isn't cached.
+
+    The ETag is computed once, when the response is cached, so an
+    If-None-Match request is answered with a 304 straight from the cache,
+    without running the handler. Clients that accept gzip get the cached
+    bytes as they are. Only 200 responses are cached.
+
+    This takes the place of @etag and of @compress/@decompress around
+    layer_cache, and should go above @jsonp and @jsonify.
+    """
+    def cached_response_wrapper(func):
+        @wraps(func)
+        def cached_response_enabled(*args, **kwargs):
+            version = version_fxn(*args, **kwargs)
+            if version is None:
+                return func(*args, **kwargs)
+
+            def render_response():
+                result = func(*args, **kwargs)
+                if not isinstance(result, current_app.response_class):
+                    result = current_app.response_class(result)
+
+                if result.status_code != 200:
+                    return UncachedResult(result)
+
+                body = result.data
+                return (hashlib.md5(body).hexdigest(), result.mimetype,
+                        gzip_compress(body))
+            render_response.__name__ = func.__name__
+
+            cached = layer_cache_check_set_return(
+                    render_response,
+                    lambda: response_cache_key(version),
+                    expiration,
+                    layer,
+                    False, # persist_across_app_versions
+                    None, # permanent_key_fxn
+                    True) # bigdata
+            if isinstance(cached, current_app.response_class):
+                return cached
+
+            body_hash, mimetype, gzipped = cached
+            identity_etag = "\"%s\"" % body_hash
+            gzip_etag = "\"%s-gzip\"" % body_hash
+
+            accepts_gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+            headers = {
+                "ETag": gzip_etag if accepts_gzip else identity_etag,
+                "Vary": "Accept-Encoding",
+            }
+
+            if etag_matches(request.headers.get("If-None-Match"),
+                            (identity_etag, gzip_etag)):
+                return current_app.response_class(status=304, headers=headers)
+
+            if accepts_gzip:
+                headers["Content-Encoding"] = "gzip"
+                body = gzipped
+            else:
+                body = gzip_decompress(gzipped)
+
+            return current_app.response_class(body, mimetype=mimetype, headers=headers)
+        return cached_response_enabled
+    return cached_response_wrapper
+
+def response_cache_key(version):
+    params = sorted((key, value.encode("utf-8"))
+                    for key, value in request.args.iteritems(multi=True)
+                    if key not in RESPONSE_CACHE_IGNORED_PARAMS)
+    return "api_response:%s:%s:%s" % (request.path.encode("utf-8"), version,
+                                      urllib.urlencode(params))
+
+def etag_matches(if_none_match, etags):
+    if not if_none_match:
+        return False
+
+    for client_etag in if_none_match.split(","):
+        client_etag = client_etag.strip()
+        if client_etag.startswith("W/"):
+            client_etag = client_etag[2:]
+        if client_etag == "*" or client_etag in etags:
+            return True
+    return False
+
+def gzip_compress(data):
+    # wbits of 16 + MAX_WBITS writes a gzip header and trailer, so the
+    # result can be served with Content-Encoding: gzip as it is
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def gzip_decompress(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+import zlib
+
+from api import api_app
+from api.decorators import cached_response, jsonify, jsonp
+import layer_cache
+import testutil
+
+
+class CachedResponseTest(testutil.GAEModelTestCase):
+    def setUp(self):
+        super(CachedResponseTest, self).setUp()
+        layer_cache.cachepy.flush()
+        self.calls = 0
+        self.version = "v1"
+
+        @cached_response(lambda: self.version)
+        @jsonp
+        @jsonify
+        def library():
+            self.calls += 1
+            return {"topic_title": "Algebra", "calls": self.calls}
+
+        self.library = library
+
+    def get(self, query_string="", headers=None):
+        with api_app.test_request_context("/api/v1/library",
+                                          query_string=query_string,
+                                          headers=headers or {}):
+            return self.library()
+
+    def test_handler_runs_once_per_version_and_params(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(self.get().data, first.data)
+        self.assertEqual(self.calls, 1)
+
+        self.get("casing=camel")
+        self.get("callback=cb")
+        self.get("callback=cb&_=12345")
+        self.assertEqual(self.calls, 3)
+
+        self.version = "v2"
+        self.get()
+        self.assertEqual(self.calls, 4)
+
+    def test_if_none_match_is_answered_from_the_cache(self):
+        etag = self.get().headers["ETag"]
+
+        response = self.get(headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.calls, 1)
+
+        response = self.get(headers={"If-None-Match": '"stale"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_gzip_bytes_are_served_directly(self):
+        plain = self.get()
+        gzipped = self.get(headers={"Accept-Encoding": "gzip, deflate"})
+
+        self.assertEqual(gzipped.headers["Content-Encoding"], "gzip")
+        self.assertEqual(zlib.decompress(gzipped.data, 16 + zlib.MAX_WBITS),
+                         plain.data)
+        self.assertNotEqual(gzipped.headers["ETag"], plain.headers["ETag"])
+
+        # Either representation's ETag validates the other
+        response = self.get(headers={"If-None-Match": plain.headers["ETag"],
+                                     "Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 304)
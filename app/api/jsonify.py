@@ -1,6 +1,7 @@
 # Based on http://appengine-cookbook.appspot.com/recipe/extended-jsonify-function-for-dbmodel,
 # with modifications for flask and performance.
 
+import inspect
 import json
 from google.appengine.ext import db
 from datetime import datetime
@@ -10,13 +11,10 @@ SIMPLE_TYPES = (int, long, float, bool, basestring)
 def dumps(obj, camel_cased=False):
     if isinstance(obj, SIMPLE_TYPES):
         return obj
-    elif obj == None:
+    elif obj is None:
         return None
     elif isinstance(obj, list):
-        items = []
-        for item in obj:
-            items.append(dumps(item, camel_cased))
-        return items
+        return [dumps(item, camel_cased) for item in obj]
     elif isinstance(obj, datetime):
         return obj.strftime("%Y-%m-%dT%H:%M:%SZ")
     elif isinstance(obj, dict):
@@ -24,41 +22,110 @@ def dumps(obj, camel_cased=False):
         for key in obj:
             value = dumps(obj[key], camel_cased)
             if camel_cased:
-                properties[camel_casify(key)] = value
+                properties[camel_cased_key(key)] = value
             else:
                 properties[key] = value
         return properties
 
-    properties = dict();
-    if isinstance(obj, db.Model):
-        properties['kind'] = obj.kind()
+    return serializer_for(obj.__class__).serialize(obj, camel_cased)
 
-    serialize_blacklist = []
-    if hasattr(obj, "_serialize_blacklist"):
-        serialize_blacklist = obj._serialize_blacklist
+class Serializer(object):
+    """ Serializes instances of one class the way dumps always has: every
+    visible attribute in dir(obj) (or the class's _serialize_whitelist) is
+    included unless its value is a function, method or db.Query.
 
-    serialize_list = dir(obj)
-    if hasattr(obj, "_serialize_whitelist"):
-        serialize_list = obj._serialize_whitelist
+    Walking dir(obj) for every instance was slow, so the attributes are
+    sorted out once per class. Methods, reverse references and other
+    attributes that can never produce a visible value are dropped up front,
+    leaving only the names worth a getattr. Attributes set on an instance
+    (like Topic.children) don't show up in the class, so without a whitelist
+    the instance's __dict__ is checked too.
+    """
+
+    def __init__(self, cls):
+        self.kind = None
+        if issubclass(cls, db.Model):
+            self.kind = cls.kind()
+
+        self.blacklist = frozenset(getattr(cls, "_serialize_blacklist", []))
+
+        self.whitelisted = hasattr(cls, "_serialize_whitelist")
+        if self.whitelisted:
+            names = cls._serialize_whitelist
+        else:
+            names = dir(cls)
 
-    for property in serialize_list:
-        if is_visible_property(property, serialize_blacklist):
+        self.names = [name for name in names
+                      if is_visible_property(name, self.blacklist) and
+                         (self.whitelisted or not is_hidden_attribute(cls, name))]
+        self.class_names = frozenset(self.names)
+
+        # dumps used to read attributes with obj.__getattribute__, which
+        # old-style instances don't have, so they always came out as str(obj)
+        self.old_style = not isinstance(cls, type)
+
+    def serialize(self, obj, camel_cased):
+        if self.old_style:
+            return str(obj)
+
+        properties = {}
+        if self.kind is not None:
+            properties['kind'] = self.kind
+
+        names = self.names
+        if not self.whitelisted:
+            instance_dict = getattr(obj, "__dict__", None)
+            if instance_dict:
+                extra_names = [name for name in instance_dict
+                               if name not in self.class_names and
+                                  is_visible_property(name, self.blacklist)]
+                if extra_names:
+                    names = names + extra_names
+
+        for property in names:
             try:
-                value = obj.__getattribute__(property)
-                valueClass = str(value.__class__)
-                if is_visible_class_name(valueClass):
+                value = getattr(obj, property)
+                if is_visible_class(value.__class__):
                     value = dumps(value, camel_cased)
                     if camel_cased:
-                        properties[camel_casify(property)] = value
+                        properties[camel_cased_key(property)] = value
                     else:
                         properties[property] = value
-            except:
+            except Exception:
                 continue
 
-    if len(properties) == 0:
-        return str(obj)
-    else:
-        return properties
+        if len(properties) == 0:
+            return str(obj)
+        else:
+            return properties
+
+# Serializer by class
+SERIALIZERS = {}
+def serializer_for(cls):
+    serializer = SERIALIZERS.get(cls)
+    if serializer is None:
+        serializer = SERIALIZERS[cls] = Serializer(cls)
+    return serializer
+
+# Methods of builtin types, as seen on the type (e.g. list.append)
+METHOD_DESCRIPTOR_TYPES = (type(list.append), type(list.__add__))
+
+def is_hidden_attribute(cls, name):
+    """ True if name's value on any instance of cls is a function, method or
+    db.Query, judging by the class attribute itself. Instance attributes can
+    shadow non-data descriptors like methods, but those are picked up from
+    the instance's __dict__. """
+    try:
+        attribute = getattr(cls, name)
+    except Exception:
+        # e.g. a descriptor that only works on instances
+        return False
+
+    return (inspect.isfunction(attribute) or
+            inspect.ismethod(attribute) or
+            inspect.isbuiltin(attribute) or
+            isinstance(attribute, METHOD_DESCRIPTOR_TYPES) or
+            isinstance(attribute, db._ReverseReferenceProperty))
 
 UNDERSCORE_RE = re.compile("_([a-z])")
 def camel_case_replacer(match):
@@ -68,6 +135,14 @@ def camel_case_replacer(match):
 def camel_casify(str):
     return re.sub(UNDERSCORE_RE, camel_case_replacer, str)
 
+CAMEL_CASED_KEYS = {}
+def camel_cased_key(key):
+    """ camel_casify, memoized since the same keys come up over and over """
+    camel_cased = CAMEL_CASED_KEYS.get(key)
+    if camel_cased is None:
+        camel_cased = CAMEL_CASED_KEYS[key] = camel_casify(key)
+    return camel_cased
+
 def is_visible_property(property, serialize_blacklist):
     return property[0] != '_' and not property.startswith("INDEX_") and not property in serialize_blacklist
 
@@ -79,6 +154,13 @@ def is_visible_class_name(class_name):
                 ('db.Query' in class_name)
             )
 
+VISIBLE_CLASSES = {}
+def is_visible_class(cls):
+    visible = VISIBLE_CLASSES.get(cls)
+    if visible is None:
+        visible = VISIBLE_CLASSES[cls] = is_visible_class_name(str(cls))
+    return visible
+
 class JSONModelEncoder(json.JSONEncoder):
     def default(self, o):
         """ Turns objects into serializable dicts for the default encoder """
@@ -93,24 +175,35 @@ class JSONModelEncoderCamelCased(json.JSONEncoder):
         obj = dumps(obj, camel_cased=True)
         return super(self.__class__, self).encode(obj)
 
-def jsonify(data, camel_cased=False):
-    """jsonify data in a standard (human friendly) way. If a db.Model
-    entity is passed in it will be encoded as a dict.
+def jsonify(data, camel_cased=False, pretty=False):
+    """jsonify data in a compact way. If a db.Model entity is passed in it
+    will be encoded as a dict.
 
     If the current request being served is being served via Flask, and
     has a parameter "casing" with the value "camel", properties in the resulting
     output will be converted to use camelCase instead of the regular Pythonic
     underscore convention.
+
+    pretty gives the old human friendly output, indented and with sorted
+    keys.
     """
 
     if camel_cased:
         encoder = JSONModelEncoderCamelCased
     else:
         encoder = JSONModelEncoder
+
+    if pretty:
+        return json.dumps(data,
+                                skipkeys=True,
+                                sort_keys=True,
+                                ensure_ascii=True,
+                                indent=4,
+                                cls=encoder)
+
     return json.dumps(data,
                             skipkeys=True,
-                            sort_keys=True,
                             ensure_ascii=True,
-                            indent=4,
+                            separators=(',', ':'),
                             cls=encoder)
 
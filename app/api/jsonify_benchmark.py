@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+Compares the previous api.jsonify (walking dir(obj) for every instance and
+pretty-printing) against the current one (per-class serializers, compact
+output) on the payloads of /api/v1/topictree and /api/v1/user/exercises.
+
+The topic tree is built the way Topic.make_tree leaves it: Topic entities
+with their Video, Exercise and Topic children set on .children. The user
+exercises are built the way user_exercises_all builds them for a user with
+no UserExercises yet. Entities live in the testbed datastore stub.
+
+Usage: python jsonify_benchmark.py [NUM_TOPICS] [REPEATS]
+
+The App Engine SDK has to be importable (e.g. on PYTHONPATH).
+"""
+
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.ext import db
+from google.appengine.ext import testbed
+
+from datetime import datetime
+
+import models
+from api import jsonify as apijsonify
+
+
+# The previous implementation, kept here for comparison
+SIMPLE_TYPES = (int, long, float, bool, basestring)
+def legacy_dumps(obj, camel_cased=False):
+    if isinstance(obj, SIMPLE_TYPES):
+        return obj
+    elif obj == None:
+        return None
+    elif isinstance(obj, list):
+        return [legacy_dumps(item, camel_cased) for item in obj]
+    elif isinstance(obj, datetime):
+        return obj.strftime("%Y-%m-%dT%H:%M:%SZ")
+    elif isinstance(obj, dict):
+        properties = {}
+        for key in obj:
+            value = legacy_dumps(obj[key], camel_cased)
+            properties[legacy_camel_casify(key) if camel_cased else key] = value
+        return properties
+
+    properties = dict()
+    if isinstance(obj, db.Model):
+        properties['kind'] = obj.kind()
+
+    serialize_blacklist = getattr(obj, "_serialize_blacklist", [])
+    serialize_list = getattr(obj, "_serialize_whitelist", dir(obj))
+
+    for property in serialize_list:
+        if apijsonify.is_visible_property(property, serialize_blacklist):
+            try:
+                value = obj.__getattribute__(property)
+                if apijsonify.is_visible_class_name(str(value.__class__)):
+                    value = legacy_dumps(value, camel_cased)
+                    properties[legacy_camel_casify(property) if camel_cased else property] = value
+            except:
+                continue
+
+    if len(properties) == 0:
+        return str(obj)
+    else:
+        return properties
+
+def legacy_camel_casify(name):
+    return re.sub(apijsonify.UNDERSCORE_RE, apijsonify.camel_case_replacer, name)
+
+class LegacyEncoder(json.JSONEncoder):
+    def default(self, o):
+        return legacy_dumps(o)
+
+def legacy_jsonify(data):
+    return json.dumps(data, skipkeys=True, sort_keys=True, ensure_ascii=True,
+                      indent=4, cls=LegacyEncoder)
+
+
+def topic_tree(num_topics):
+    version = models.TopicVersion(number=1, default=True)
+    version.put()
+
+    def topic(i):
+        return models.Topic(id="topic-%d" % i, title="Topic %d" % i,
+                            standalone_title="Standalone topic %d" % i,
+                            description="Description of topic %d" % i,
+                            version=version, tags=["tag-%d" % i])
+
+    root = topic(0)
+    topics = [topic(i) for i in xrange(1, num_topics)]
+    db.put([root] + topics)
+
+    root.children = topics
+    for i, child in enumerate(topics):
+        videos = [models.Video(youtube_id="yt%d_%d" % (i, j),
+                               readable_id="video-%d-%d" % (i, j),
+                               title="Video %d %d" % (i, j),
+                               description="A video about %d and %d" % (i, j),
+                               keywords="video, %d, %d" % (i, j),
+                               duration=600, views=1000)
+                  for j in xrange(8)]
+        exercises = [models.Exercise(name="exercise_%d_%d" % (i, j),
+                                     display_name="Exercise %d %d" % (i, j),
+                                     live=True)
+                     for j in xrange(2)]
+        db.put(videos + exercises)
+        child.children = videos + exercises
+
+    return root
+
+
+def user_exercises():
+    student = models.UserData.pre_phantom()
+    user_exercise_graph = models.UserExerciseGraph.get(student)
+
+    results = []
+    for exercise in models.Exercise.all().fetch(10000):
+        user_exercise = models.UserExercise()
+        user_exercise.exercise = exercise.name
+        user_exercise.user = student.user
+        user_exercise.exercise_model = exercise
+        user_exercise._user_data = student
+        user_exercise._user_exercise_graph = user_exercise_graph
+        results.append(user_exercise)
+    return results
+
+
+def measure(fxn, data, repeats):
+    start = time.time()
+    for _ in xrange(repeats):
+        output = fxn(data)
+    return (time.time() - start) / repeats, len(output)
+
+
+def main(num_topics, repeats):
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    tb.init_user_stub()
+
+    payloads = [("/api/v1/topictree", topic_tree(num_topics)),
+                ("/api/v1/user/exercises", user_exercises())]
+
+    print "topics: %d, repeats: %d" % (num_topics, repeats)
+    print "%-24s %-9s %10s %10s" % ("endpoint", "jsonify", "ms", "KB")
+    for endpoint, data in payloads:
+        if legacy_jsonify(data) != apijsonify.jsonify(data, pretty=True):
+            print "%s: pretty output differs from the legacy output!" % endpoint
+
+        for name, fxn in [
+                ("legacy", legacy_jsonify),
+                ("pretty", lambda data: apijsonify.jsonify(data, pretty=True)),
+                ("compact", apijsonify.jsonify),
+                ("camel", lambda data: apijsonify.jsonify(data, camel_cased=True))]:
+            secs, size = measure(fxn, data, repeats)
+            print "%-24s %-9s %10.1f %10.1f" % (endpoint, name, 1000 * secs, size / 1024.0)
+
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 5)
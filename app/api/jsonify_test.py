@@ -1,7 +1,34 @@
 """ Unit tests for jsonify functionality """
 
 import unittest
-from jsonify import camel_casify, JSONModelEncoder, JSONModelEncoderCamelCased
+from jsonify import camel_casify, dumps, jsonify, JSONModelEncoder, JSONModelEncoderCamelCased
+
+class Lesson(object):
+    _serialize_blacklist = ["secret"]
+
+    LEVEL = 1
+
+    def __init__(self):
+        self.lesson_title = "Fractions"
+        self.secret = "hidden"
+
+    @property
+    def url_path(self):
+        return "/fractions"
+
+    @property
+    def broken(self):
+        raise ValueError("not serialized")
+
+    def method(self):
+        pass
+
+    @staticmethod
+    def static_method():
+        pass
+
+class WhitelistedLesson(Lesson):
+    _serialize_whitelist = ["lesson_title", "method"]
 
 class JsonifyTest(unittest.TestCase):
     def setUp(self):
@@ -30,5 +57,21 @@ class JsonifyTest(unittest.TestCase):
                 '{"oneTwo": ["buckle", "shoe"], "threeFour": {"knock": "door"}, "fivesix": "pickup sticks"}',
                 JSONModelEncoderCamelCased().encode(self.o))
 
+    def test_object_serialization(self):
+        lesson = Lesson()
+        lesson.children = [WhitelistedLesson()]
+
+        self.assertEqual({
+                "LEVEL": 1,
+                "lessonTitle": "Fractions",
+                "urlPath": "/fractions",
+                "children": [{"lessonTitle": "Fractions"}],
+            }, dumps(lesson, camel_cased=True))
+
+    def test_compact_and_pretty_output(self):
+        self.assertEqual('{"a":[1,2]}', jsonify({"a": [1, 2]}))
+        self.assertEqual('{\n    "a": 1, \n    "b": 2\n}',
+                         jsonify({"b": 2, "a": 1}, pretty=True))
+
 if __name__ == '__main__':
     unittest.main()
@@ -6,6 +6,7 @@ import request_cache
 from app import App
 from gae_mini_profiler import profiler
 from gae_bingo import middleware
+from gandalf.middleware import GandalfWSGIMiddleware
 
 # While not referenced directly, these imports have necessary side-effects.
 # (e.g. Paths are mapped to the API request handlers with the "route" wrapper)
@@ -19,6 +20,7 @@ def real_main():
     wsgi_app = request_cache.RequestCacheMiddleware(api_app)
     wsgi_app = profiler.ProfilerWSGIMiddleware(wsgi_app)
     wsgi_app = middleware.GAEBingoWSGIMiddleware(wsgi_app)
+    wsgi_app = GandalfWSGIMiddleware(wsgi_app)
 
     if App.is_dev_server:
         try:
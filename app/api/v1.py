@@ -8,6 +8,7 @@ from flask import request, current_app, Response
 
 import models
 import layer_cache
+import user_util
 import templatetags # Must be imported to register template tags
 from avatars import util_avatars
 from badges import badges, util_badges, models_badges, profile_badges
@@ -18,7 +19,7 @@ from models import StudentList
 from phantom_users.phantom_util import api_create_phantom
 import notifications
 from gae_bingo.gae_bingo import bingo
-from autocomplete import video_title_dicts, topic_title_dicts, url_title_dicts, exercise_title_dicts
+from autocomplete import autocomplete_index
 from goals.models import (GoalList, Goal, GoalObjective,
     GoalObjectiveAnyExerciseProficiency, GoalObjectiveAnyVideo)
 import profiles.util_profile as util_profile
@@ -29,7 +30,7 @@ from app import App
 
 from api import route
 from api.decorators import jsonify, jsonp, pickle, compress, decompress, etag,\
-    cacheable, cache_with_key_fxn_and_param
+    cacheable, cache_with_key_fxn_and_param, cached_response
 from api.auth.decorators import oauth_required, oauth_optional, admin_required, developer_required
 from api.auth.auth_util import unauthorized_response
 from api.api_util import api_error_response, api_invalid_param_response, api_unauthorized_response
@@ -141,11 +142,8 @@ def get_user_data_from_json(json, key):
 @route("/api/v1/topicversion/<version_id>/topics/with_content", methods=["GET"])
 @route("/api/v1/topics/with_content", methods=["GET"])
 @route("/api/v1/playlists", methods=["GET"]) # missing "url" and "youtube_id" properties that they had before
+@cached_response(lambda version_id = None: "%s_%s" % (version_id, models.Setting.topic_tree_version()))
 @jsonp
-@cache_with_key_fxn_and_param(
-    "casing",
-    lambda version_id = None: "api_content_topics_%s_%s" % (version_id, models.Setting.topic_tree_version()),
-    layer=layer_cache.Layers.Memcache)
 @jsonify
 def content_topics(version_id = None):
     version = models.TopicVersion.get_by_id(version_id)
@@ -154,13 +152,8 @@ def content_topics(version_id = None):
 # private api call used only by ajax homepage ... can remove once we remake the homepage with the topic tree
 @route("/api/v1/topics/library/compact", methods=["GET"])
 @cacheable(caching_age=(60 * 60 * 24 * 60))
-@etag(lambda: models.Setting.topic_tree_version())
+@cached_response(lambda: models.Setting.topic_tree_version())
 @jsonp
-@decompress # We compress and decompress around layer_cache so memcache never has any trouble storing the large amount of library data.
-@layer_cache.cache_with_key_fxn(
-    lambda: "api_topics_library_compact_%s" % models.Setting.topic_tree_version(),
-    layer=layer_cache.Layers.Memcache)
-@compress
 @jsonify
 def topics_library_compact():
     topics = models.Topic.get_filled_content_topics(types = ["Video", "Url"])
@@ -270,15 +263,10 @@ def topic_progress(topic_id):
 
 @route("/api/v1/topicversion/<version_id>/topictree", methods=["GET"])
 @route("/api/v1/topictree", methods=["GET"])
-@etag(lambda version_id = None: version_id) 
+@cached_response(lambda version_id = None: "%s_%s" % (version_id,
+        models.Setting.topic_tree_version())
+        if version_id is None or version_id == "default" else None)
 @jsonp
-@decompress 
-@layer_cache.cache_with_key_fxn(
-    (lambda version_id = None: "api_topictree_%s_%s" % (version_id, 
-        models.Setting.topic_tree_version())        
-        if version_id is None or version_id == "default" else None),
-    layer=layer_cache.Layers.Memcache)
-@compress
 @jsonify
 def topictree(version_id = None):
     version = models.TopicVersion.get_by_id(version_id)
@@ -639,14 +627,8 @@ def save_url(url_id = None, version_id=None):
             changeable_props)
 
 @route("/api/v1/playlists/library", methods=["GET"])
-@etag(lambda: models.Setting.topic_tree_version())
+@cached_response(lambda: models.Setting.topic_tree_version())
 @jsonp
-@decompress # We compress and decompress around layer_cache so memcache never has any trouble storing the large amount of library data.
-@cache_with_key_fxn_and_param(
-    "casing",
-    lambda: "api_library_%s" % models.Setting.topic_tree_version(),
-    layer=layer_cache.Layers.Memcache)
-@compress
 @jsonify
 def playlists_library():
     tree = models.Topic.get_by_id("root").make_tree()
@@ -713,6 +695,8 @@ def playlists_library_list():
     return topics_list
     
 @route("/api/v1/exercises", methods=["GET"])
+@cached_response(lambda: "%s_%s" % (models.Setting.cached_exercises_date(),
+        user_util.is_current_user_developer()))
 @jsonp
 @jsonify
 def get_exercises():
@@ -1420,10 +1404,6 @@ def get_students_exercise_progress_summary():
     list_students = sorted(list_students, key=lambda student: student.nickname)
     user_exercise_graphs = models.UserExerciseGraph.get(list_students)
 
-    student_review_exercise_names = []
-    for user_exercise_graph in user_exercise_graphs:
-        student_review_exercise_names.append(user_exercise_graph.review_exercise_names())
-
     exercises = models.Exercise.get_all_use_cache()
     exercise_data = []
     
@@ -1436,13 +1416,12 @@ def get_students_exercise_progress_summary():
             'not-started': [],
         }
 
-        for (student, user_exercise_graph, review_exercise_names) in izip(
-                list_students, user_exercise_graphs,
-                student_review_exercise_names):
+        for (student, user_exercise_graph) in izip(
+                list_students, user_exercise_graphs):
             graph_dict = user_exercise_graph.graph_dict(exercise.name)
 
             if graph_dict['proficient']:
-                if exercise.name in review_exercise_names:
+                if user_exercise_graph.is_reviewing(exercise.name):
                     status = 'review'
                 else:
                     status = 'proficient'
@@ -2085,23 +2064,10 @@ def autocomplete():
 
         max_results_per_type = 10
 
-        filterer = lambda item: query in item['title'].lower()
-        exercise_results = filter(filterer, exercise_title_dicts())
-        video_results = filter(filterer, video_title_dicts())
-        url_results = filter(filterer, url_title_dicts())
-        topic_results = filter(filterer, topic_title_dicts())
-        topic_results.extend({
-            "title": topic.standalone_title,
-            "key": str(topic.key()),
-            "relative_url": topic.relative_url,
-            "id": topic.id}
-            for topic in models.Topic.get_super_topics() if query in topic.title.lower()
-        )
-
-        sorter = lambda v: v['title'].lower().index(query)
-        exercise_results = sorted(exercise_results, key=sorter)[:max_results_per_type]
-        video_results = sorted(video_results+url_results, key=sorter)[:max_results_per_type]
-        topic_results = sorted(topic_results, key=sorter)[:max_results_per_type]
+        results = autocomplete_index().search(query, max_results_per_type)
+        exercise_results = results["exercises"]
+        video_results = results["videos"]
+        topic_results = results["topics"]
 
     return {
         "query": query,
@@ -10,6 +10,16 @@ remoteapi_CUSTOM_ENVIRONMENT_AUTHENTICATION = (
 
 appstats_CALC_RPC_COSTS = True
 
+def gae_mini_profiler_cache_stats():
+    import cachepy
+    if not cachepy.ACTIVE:
+        return None
+    return cachepy.stats()
+
+def gae_mini_profiler_cache_key_stats():
+    import cache_key_stats
+    return cache_key_stats.request_stats()
+
 def webapp_add_wsgi_middleware(app):
     from google.appengine.ext.appstats import recording
     app = recording.appstats_wsgi_middleware(app)
@@ -1,5 +1,124 @@
+"""
+Title dicts for autocomplete, and an in-memory index over them.
+
+AutocompleteIndex normalizes every title once (lowercased, accents and
+Hebrew niqqud stripped, Hebrew final letters folded) and keeps a posting list
+for each of its 2- and 3-character substrings, ordered by where that
+substring first appears in the title. A 2 or 3 character query is answered by
+slicing one posting list; a longer query only checks the titles in the
+shortest posting list among its trigrams. Either way the catalog is never
+scanned per query.
+
+One index is built per topic tree version (and exercise cache date) and kept
+in instance memory.
+"""
+
+import array
+import heapq
+
+import cachepy
 import layer_cache
 from models import Video, Url, Topic, Setting, TopicVersion, Exercise
+from search.text import normalize
+
+class AutocompleteIndex(object):
+    """ Substring index over named sections of (title, result) pairs.
+
+    search() returns, per section, the results whose normalized title
+    contains the normalized query, ordered by where the query first appears
+    in the title and then by the order the results were given in.
+    """
+
+    # Shortest query that can match; grams of these lengths are indexed
+    MIN_QUERY_LENGTH = 2
+    MAX_GRAM_LENGTH = 3
+
+    POSTING_ITEMSIZE = array.array("i").itemsize
+
+    def __init__(self, sections):
+        """ sections maps a section name to a list of (title, result) """
+        self.sections = {}
+        self.size = 0
+        for name, items in sections.iteritems():
+            self.sections[name] = self._build_section(items)
+
+    def _build_section(self, items):
+        texts = []
+        results = []
+        postings = {}
+
+        # Postings are collected as pos << doc_bits | doc, which sort
+        # by position and then by doc
+        doc_bits = max(len(items), 1).bit_length()
+        doc_mask = (1 << doc_bits) - 1
+
+        for doc, (title, result) in enumerate(items):
+            text = normalize(title or u"")
+            texts.append(text)
+            results.append(result)
+
+            # Walking backwards leaves each gram's first position
+            first = {}
+            for length in xrange(self.MIN_QUERY_LENGTH, self.MAX_GRAM_LENGTH + 1):
+                for pos in xrange(len(text) - length, -1, -1):
+                    first[text[pos:pos + length]] = pos << doc_bits | doc
+
+            for gram, posting in first.iteritems():
+                if gram in postings:
+                    postings[gram].append(posting)
+                else:
+                    postings[gram] = [posting]
+
+        for gram, posting in postings.iteritems():
+            posting.sort()
+            postings[gram] = array.array("i", [p & doc_mask for p in posting])
+            self.size += 64 + 2 * len(gram) + self.POSTING_ITEMSIZE * len(posting)
+
+        self.size += sum(64 + 2 * len(text) for text in texts)
+        return texts, results, postings
+
+    def search(self, query, limit=None):
+        """ Returns a dict of section name -> up to limit matching results """
+        query = normalize(query)
+        return dict((name, self._search_section(section, query, limit))
+                    for name, section in self.sections.iteritems())
+
+    def _search_section(self, section, query, limit):
+        texts, results, postings = section
+
+        if len(query) < self.MIN_QUERY_LENGTH:
+            return []
+
+        if len(query) <= self.MAX_GRAM_LENGTH:
+            # The posting list is already in result order
+            docs = postings.get(query, ())[:limit]
+            return [results[doc] for doc in docs]
+
+        # Only titles containing every trigram of the query can match, so
+        # checking those containing its rarest trigram is enough
+        candidates = None
+        for pos in xrange(len(query) - self.MAX_GRAM_LENGTH + 1):
+            posting = postings.get(query[pos:pos + self.MAX_GRAM_LENGTH])
+            if not posting:
+                return []
+            if candidates is None or len(posting) < len(candidates):
+                candidates = posting
+
+        matches = []
+        for doc in candidates:
+            pos = texts[doc].find(query)
+            if pos >= 0:
+                matches.append((pos, doc))
+
+        if limit is None:
+            matches.sort()
+        else:
+            matches = heapq.nsmallest(limit, matches)
+        return [results[doc] for pos, doc in matches]
+
+# Size indexes without pickling them
+cachepy.register_sizer(AutocompleteIndex, lambda index: index.size)
+
 
 @layer_cache.cache_with_key_fxn(lambda:
     "exercise_title_dicts_%s" % Setting.cached_exercises_date())
@@ -59,3 +178,30 @@ def topic_title_dicts(version_number=None):
         "id": topic.id
     } for topic in Topic.get_content_topics(version=version)]
 
+
+@layer_cache.cache_with_key_fxn(lambda:
+    "autocomplete_index_%s_%s" % (
+    Setting.topic_tree_version(), Setting.cached_exercises_date()),
+    layer=layer_cache.Layers.InAppMemory)
+def autocomplete_index():
+    """ The AutocompleteIndex of the current topic tree, with "exercises",
+    "videos" (videos and urls) and "topics" (content and super topics)
+    sections. """
+    def items(title_dicts):
+        return [(title_dict["title"], title_dict) for title_dict in title_dicts]
+
+    topics = items(topic_title_dicts())
+    # Super topics are matched on their title but shown with their
+    # standalone title
+    topics.extend((topic.title, {
+        "title": topic.standalone_title,
+        "key": str(topic.key()),
+        "relative_url": topic.relative_url,
+        "id": topic.id
+    }) for topic in Topic.get_super_topics())
+
+    return AutocompleteIndex({
+        "exercises": items(exercise_title_dicts()),
+        "videos": items(video_title_dicts()) + items(url_title_dicts()),
+        "topics": topics,
+    })
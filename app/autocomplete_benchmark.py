@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares the previous /api/v1/autocomplete lookup (filtering every title dict
+with `query in title.lower()` and sorting the matches) against
+autocomplete.AutocompleteIndex on a synthetic catalog.
+
+Every prefix of a few search phrases is looked up, the way the search box
+asks for one query per keystroke.
+
+Usage: python autocomplete_benchmark.py [NUM_ITEMS] [REPEATS]
+
+The App Engine SDK has to be importable (e.g. on PYTHONPATH).
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+import autocomplete
+
+WORDS = (u"adding subtracting multiplying dividing fractions decimals "
+         u"integers exponents radicals linear quadratic equations "
+         u"inequalities functions graphing slope intercept polynomials "
+         u"factoring trigonometry sine cosine derivatives integrals limits "
+         u"probability statistics mean median variance vectors matrices "
+         u"chemistry atoms bonds physics motion energy biology cells "
+         u"history economics introduction example word problems").split()
+
+HEBREW_WORDS = (u"שברים חיבור חיסור כפל חילוק משוואות "
+                u"פונקציות גאומטריה הסתברות מבוא דוגמה").split()
+
+PHRASES = [u"quadratic equations", u"adding fractions", u"example 3",
+           u"משוואות", u"probability"]
+
+MAX_RESULTS_PER_TYPE = 10
+
+
+def catalog(num_items):
+    rand = random.Random(42)
+
+    def title(i):
+        words = WORDS if i % 10 else HEBREW_WORDS
+        return u"%s %d" % (u" ".join(rand.choice(words)
+                                     for _ in xrange(rand.randint(2, 5))),
+                           rand.randint(1, 9))
+
+    def title_dict(kind, i):
+        return {
+            "title": title(i),
+            "key": "%s-key-%d" % (kind, i),
+            "relative_url": "/%s/%d" % (kind, i),
+            "id": "%s-%d" % (kind, i),
+        }
+
+    num_exercises = num_items / 10
+    num_topics = num_items / 20
+    num_videos = num_items - num_exercises - num_topics
+    return {
+        "exercises": [title_dict("exercise", i) for i in xrange(num_exercises)],
+        "videos": [title_dict("video", i) for i in xrange(num_videos)],
+        "topics": [title_dict("topic", i) for i in xrange(num_topics)],
+    }
+
+
+def legacy_search(sections, query, limit):
+    query = query.lower()
+    filterer = lambda item: query in item['title'].lower()
+    sorter = lambda v: v['title'].lower().index(query)
+    return dict((name, sorted(filter(filterer, items), key=sorter)[:limit])
+                for name, items in sections.iteritems())
+
+
+def queries():
+    for phrase in PHRASES:
+        for length in xrange(2, len(phrase) + 1):
+            yield phrase[:length]
+
+
+def measure(fxn, repeats):
+    timings = []
+    for _ in xrange(repeats):
+        for query in queries():
+            start = time.time()
+            fxn(query)
+            timings.append(time.time() - start)
+    timings.sort()
+    return (1000 * sum(timings) / len(timings),
+            1000 * timings[int(0.99 * (len(timings) - 1))])
+
+
+def main(num_items, repeats):
+    sections = catalog(num_items)
+
+    start = time.time()
+    index = autocomplete.AutocompleteIndex(dict(
+        (name, [(item["title"], item) for item in items])
+        for name, items in sections.iteritems()))
+    build_secs = time.time() - start
+
+    for query in queries():
+        expected = legacy_search(sections, query, MAX_RESULTS_PER_TYPE)
+        if index.search(query, MAX_RESULTS_PER_TYPE) != expected:
+            print "%s: index results differ from the legacy results!" % query.encode("utf-8")
+
+    print "items: %d, queries: %d, repeats: %d" % (
+        num_items, len(list(queries())), repeats)
+    print "index built in %.0f ms, about %.1f MB" % (
+        1000 * build_secs, index.size / (1024.0 * 1024))
+    print "%-8s %12s %12s" % ("lookup", "mean ms", "p99 ms")
+    for name, fxn in [
+            ("legacy", lambda query: legacy_search(sections, query, MAX_RESULTS_PER_TYPE)),
+            ("index", lambda query: index.search(query, MAX_RESULTS_PER_TYPE))]:
+        print "%-8s %12.3f %12.3f" % ((name,) + measure(fxn, repeats))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 5)
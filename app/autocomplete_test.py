@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import autocomplete
+import testutil
+
+
+def index_of(*titles):
+    return autocomplete.AutocompleteIndex({
+        "videos": [(title, {"title": title}) for title in titles],
+    })
+
+
+def search(index, query, limit=None):
+    return [result["title"] for result in index.search(query, limit)["videos"]]
+
+
+class AutocompleteIndexTest(testutil.GAEModelTestCase):
+    def test_results_are_ordered_by_match_position_then_given_order(self):
+        index = index_of(u"Adding fractions", u"Fractions",
+                         u"Multiplying fractions", u"Intro to fractions",
+                         u"Decimals")
+
+        self.assertEqual(search(index, u"fr"),
+                         [u"Fractions", u"Adding fractions",
+                          u"Intro to fractions", u"Multiplying fractions"])
+        self.assertEqual(search(index, u"FRACTION", limit=2),
+                         [u"Fractions", u"Adding fractions"])
+        self.assertEqual(search(index, u"ing frac"),
+                         [u"Adding fractions", u"Multiplying fractions"])
+        self.assertEqual(search(index, u"decimal fractions"), [])
+        self.assertEqual(search(index, u"f"), [])
+
+    def test_matches_anywhere_in_a_title(self):
+        index = index_of(u"Pythagorean theorem", u"Proof of the theorem")
+        self.assertEqual(search(index, u"theorem"),
+                         [u"Pythagorean theorem", u"Proof of the theorem"])
+        self.assertEqual(search(index, u"gorean the"), [u"Pythagorean theorem"])
+        self.assertEqual(search(index, u"theorems"), [])
+
+    def test_accents_whitespace_and_case_are_normalized(self):
+        index = index_of(u"Th\xe9or\xe8me  de   Pythagore")
+        self.assertEqual(search(index, u"THEOREME DE"),
+                         [u"Th\xe9or\xe8me  de   Pythagore"])
+
+    def test_hebrew_niqqud_and_final_letters(self):
+        shalom = u"שָׁלוֹם עוֹלָם"
+        index = index_of(shalom, u"חשבון")
+
+        self.assertEqual(search(index, u"שלום"), [shalom])
+        self.assertEqual(search(index, u"שלומ"), [shalom])
+        self.assertEqual(search(index, u"ם ע"), [shalom])
+        self.assertEqual(search(index, u"חשבונ"), [u"חשבון"])
+
+    def test_sections_are_searched_separately(self):
+        index = autocomplete.AutocompleteIndex({
+            "exercises": [(u"Addition 1", "exercise")],
+            "videos": [(u"Basic addition", "video")],
+            "topics": [],
+        })
+        self.assertEqual(index.search(u"addition"), {
+            "exercises": ["exercise"],
+            "videos": ["video"],
+            "topics": [],
+        })
@@ -418,3 +418,23 @@ def update_with_user_topic(user_data, user_topic, include_other_badges = False,
 
     return awarded
 
+# Award this user any earned Topic-context badges for each of the provided
+# UserTopics, checking the no-context badges at most once.
+def update_with_user_topics(user_data, user_topics, include_other_badges = False, action_cache = None):
+    possible_badges = [badge for badge in badges_with_context_type(badges.BadgeContextType.TOPIC)
+                       if not badge.is_manually_awarded()]
+    action_cache = action_cache or last_action_cache.LastActionCache.get_for_user_data(user_data)
+
+    awarded = False
+    for user_topic in user_topics:
+        for badge in possible_badges:
+            if not badge.is_already_owned_by(user_data=user_data, user_topic=user_topic):
+                if badge.is_satisfied_by(user_data=user_data, user_topic=user_topic, action_cache=action_cache):
+                    badge.award_to(user_data=user_data, user_topic=user_topic)
+                    awarded = True
+
+    if include_other_badges:
+        awarded = update_with_no_context(user_data, action_cache=action_cache) or awarded
+
+    return awarded
+
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Compares the old big_memcache format (an uncompressed pickle split into up
+to 32 chunks, all 32 of which are requested on every get) against the
+current one (a manifest plus compressed chunks) on a synthetic payload the
+size and shape of Topic.get_all_topics. Reports stored bytes, chunk count,
+wall time and memcache RPCs for a set and a get, using the App Engine
+testbed stubs.
+
+Usage: python big_memcache_benchmark.py [NUM_TOPICS]
+
+The App Engine SDK has to be importable (e.g. on PYTHONPATH).
+"""
+
+import collections
+import cPickle
+import random
+import sys
+import time
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.ext import testbed
+
+import layer_cache
+
+RPC_COUNTS = collections.Counter()
+
+
+def count_rpc(service, call, request, response):
+    RPC_COUNTS[service] += 1
+
+
+def legacy_set(key, value, chunksize=950000, **kw):
+    serialized = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+    values = {}
+    for i, offset in enumerate(xrange(0, len(serialized), chunksize)):
+        values[str(i)] = serialized[offset:offset + chunksize]
+    return not memcache.set_multi(values, key_prefix=key, **kw)
+
+
+def legacy_get(key, **kw):
+    result = memcache.get_multi([str(i) for i in xrange(32)], key_prefix=key, **kw).items()
+    result.sort()
+    serialized = ''.join([v for (k, v) in result if v is not None])
+    if serialized:
+        return cPickle.loads(serialized)
+
+
+def topic_tree(num_topics, seed=0):
+    """ Dicts shaped like the Topic entities get_all_topics caches """
+    rand = random.Random(seed)
+    words = ["%x" % rand.getrandbits(24) for _ in xrange(2000)]
+    sentence = lambda n: " ".join(rand.choice(words) for _ in xrange(n))
+
+    topics = []
+    for i in xrange(num_topics):
+        topics.append({
+            "key": "agpzfmtoYW4tYWNhZGVteXILCxIFVG9waWMY%08d" % i,
+            "id": "topic-%d" % i,
+            "title": sentence(4),
+            "standalone_title": sentence(6),
+            "description": sentence(rand.randint(5, 40)),
+            "extended_slug": "/".join(sentence(1) for _ in xrange(3)),
+            "tags": [sentence(1) for _ in xrange(rand.randint(0, 5))],
+            "hide": rand.random() < 0.1,
+            "child_keys": ["agpzfmtoYW4tYWNhZGVteXILCxIFVmlkZW8Y%08d" % rand.randint(0, 10 ** 8)
+                           for _ in xrange(rand.randint(1, 40))],
+            "ancestor_keys": ["agpzfmtoYW4tYWNhZGVteXILCxIFVG9waWMY%08d" % rand.randint(0, num_topics)
+                              for _ in xrange(rand.randint(1, 4))],
+        })
+    return topics
+
+
+def measure(set_fxn, get_fxn, value):
+    memcache.flush_all()
+
+    RPC_COUNTS.clear()
+    start = time.time()
+    set_fxn("benchmark_topics", value)
+    set_secs, set_rpcs = time.time() - start, RPC_COUNTS["memcache"]
+
+    RPC_COUNTS.clear()
+    start = time.time()
+    assert get_fxn("benchmark_topics") == value
+    get_secs, get_rpcs = time.time() - start, RPC_COUNTS["memcache"]
+
+    stats = memcache.get_stats()
+    return stats["bytes"], stats["items"], set_secs, set_rpcs, get_secs, get_rpcs
+
+
+def main(num_topics):
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_memcache_stub()
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append("count_rpc", count_rpc)
+
+    value = topic_tree(num_topics)
+    pickled_size = len(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+    print "topics: %d, pickled: %.2f MB" % (num_topics, pickled_size / 2.0 ** 20)
+
+    print "%-8s %10s %7s %9s %9s %9s %9s" % (
+        "format", "stored MB", "items", "set ms", "set rpcs", "get ms", "get rpcs")
+    for name, set_fxn, get_fxn in [
+            ("legacy", legacy_set, legacy_get),
+            ("current", layer_cache.big_memcache_set, layer_cache.big_memcache_get)]:
+        try:
+            stored, items, set_secs, set_rpcs, get_secs, get_rpcs = measure(
+                set_fxn, get_fxn, value)
+        except Exception, e:
+            print "%-8s failed: %s" % (name, e)
+            continue
+        print "%-8s %10.2f %7d %9.1f %9d %9.1f %9d" % (
+            name, stored / 2.0 ** 20, items, 1000 * set_secs, set_rpcs,
+            1000 * get_secs, get_rpcs)
+
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3000)
@@ -0,0 +1,225 @@
+"""
+Per-key-family counters for layer_cache and request_cache.
+
+Every cached function is a key family, named after the function. For each
+family we count hits per layer, misses, cache busts, recomputes with their
+total latency and, for layer_cache, the pickled size of a sample of
+recomputed values.
+
+Counters are kept for the current request (shown by gae_mini_profiler) and
+merged into an instance-wide total at the end of every request. Once every
+FLUSH_INTERVAL_SECS an instance hands its totals to a task, which adds them
+to one of NUM_SHARDS CacheKeyStatsShard entities for the day. Reading a
+day's stats merges its shards.
+
+Recording a hit or miss is a couple of dict operations, so it's cheap enough
+for request_cache's hot paths.
+"""
+
+import cPickle
+import datetime
+import logging
+import random
+import time
+
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+import object_property
+
+FLUSH_INTERVAL_SECS = 60
+NUM_SHARDS = 20
+
+# Fraction of recomputed values whose pickled size is measured, since
+# pickling a big value again isn't free
+SIZE_SAMPLE_RATE = 0.1
+
+# Name of the layer request_cache hits are counted under
+REQUEST_LAYER = "Request"
+
+# family -> counters for the current request
+REQUEST_STATS = {}
+
+# family -> counters merged from finished requests, not yet flushed
+INSTANCE_STATS = {}
+
+# Family names by cached function, so they're only built once
+FAMILIES = {}
+
+last_flush = time.time()
+
+
+def family(target):
+    name = FAMILIES.get(target)
+    if name is None:
+        name = FAMILIES[target] = "%s.%s" % (target.__module__, target.__name__)
+    return name
+
+
+def new_counters():
+    return {
+        "hits": {},
+        "misses": 0,
+        "busts": 0,
+        "recomputes": 0,
+        "recompute_secs": 0.0,
+        "sized": 0,
+        "bytes": 0,
+    }
+
+
+def counters(family_name):
+    family_counters = REQUEST_STATS.get(family_name)
+    if family_counters is None:
+        family_counters = REQUEST_STATS[family_name] = new_counters()
+    return family_counters
+
+
+def record_hit(family_name, layer_name, count=1):
+    hits = counters(family_name)["hits"]
+    hits[layer_name] = hits.get(layer_name, 0) + count
+
+
+def record_miss(family_name, count=1):
+    counters(family_name)["misses"] += count
+
+
+def record_bust(family_name):
+    counters(family_name)["busts"] += 1
+
+
+def record_recompute(family_name, secs, value=None):
+    """ Records a recompute of a family's value, which took secs. If value
+    is given, its pickled size is sometimes recorded too. """
+    family_counters = counters(family_name)
+    family_counters["recomputes"] += 1
+    family_counters["recompute_secs"] += secs
+
+    if value is not None and random.random() < SIZE_SAMPLE_RATE:
+        try:
+            size = len(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+        except Exception:
+            return
+        family_counters["sized"] += 1
+        family_counters["bytes"] += size
+
+
+def merge(into, stats):
+    """ Adds every family's counters in stats to into """
+    for family_name, family_counters in stats.iteritems():
+        total = into.get(family_name)
+        if total is None:
+            total = into[family_name] = new_counters()
+
+        for name, value in family_counters.iteritems():
+            if name == "hits":
+                for layer_name, count in value.iteritems():
+                    total["hits"][layer_name] = total["hits"].get(layer_name, 0) + count
+            else:
+                total[name] += value
+
+    return into
+
+
+def summarize(stats):
+    """ Returns a list of per-family summaries of stats, most costly first.
+
+    A family's cost is its mean recompute latency times its miss rate, i.e.
+    the recompute time an average lookup pays.
+    """
+    summaries = []
+    for family_name, family_counters in stats.iteritems():
+        hits = sum(family_counters["hits"].itervalues())
+        misses = family_counters["misses"]
+        lookups = hits + misses
+        recomputes = family_counters["recomputes"]
+
+        miss_rate = float(misses) / lookups if lookups else 0.0
+        recompute_ms = (1000.0 * family_counters["recompute_secs"] / recomputes
+                        if recomputes else 0.0)
+        mean_bytes = (family_counters["bytes"] / family_counters["sized"]
+                      if family_counters["sized"] else None)
+
+        summaries.append({
+            "family": family_name,
+            "hits": hits,
+            "layer_hits": sorted(family_counters["hits"].items()),
+            "misses": misses,
+            "busts": family_counters["busts"],
+            "recomputes": recomputes,
+            "miss_rate": miss_rate,
+            "recompute_ms": recompute_ms,
+            "mean_bytes": mean_bytes,
+            "cost_ms": recompute_ms * miss_rate,
+        })
+
+    summaries.sort(key=lambda summary: summary["cost_ms"], reverse=True)
+    return summaries
+
+
+def request_stats():
+    """ Summaries of the current request's counters, for the profiler """
+    return summarize(REQUEST_STATS)
+
+
+def start_request():
+    REQUEST_STATS.clear()
+
+
+def end_request():
+    """ Folds the finished request's counters into the instance's totals,
+    and flushes those if it's been FLUSH_INTERVAL_SECS since the last flush.
+    """
+    global last_flush
+
+    if not REQUEST_STATS:
+        return
+
+    merge(INSTANCE_STATS, REQUEST_STATS)
+
+    if time.time() - last_flush < FLUSH_INTERVAL_SECS:
+        return
+    last_flush = time.time()
+
+    stats = dict(INSTANCE_STATS)
+    INSTANCE_STATS.clear()
+    try:
+        deferred.defer(commit_stats, datetime.date.today(), stats)
+    except Exception, e:
+        # Stats are best effort; never fail a request over them
+        logging.warning("Dropping cache key stats: %s" % e)
+
+
+def commit_stats(day, stats):
+    """ Adds stats to a random one of the day's shards """
+    shard_key = CacheKeyStatsShard.key_for(day, random.randrange(NUM_SHARDS))
+
+    def txn():
+        shard = db.get(shard_key)
+        if shard is None:
+            shard = CacheKeyStatsShard(key=shard_key, day=day, stats={})
+        shard.stats = merge(shard.stats or {}, stats)
+        shard.put()
+
+    db.run_in_transaction(txn)
+
+
+def get_daily_stats(day):
+    """ Returns the merged counters of all of day's shards """
+    keys = [CacheKeyStatsShard.key_for(day, i) for i in xrange(NUM_SHARDS)]
+
+    stats = {}
+    for shard in db.get(keys):
+        if shard and shard.stats:
+            merge(stats, shard.stats)
+    return stats
+
+
+class CacheKeyStatsShard(db.Model):
+    """ One shard of a day's cache key family counters. """
+    day = db.DateProperty()
+    stats = object_property.UnvalidatedObjectProperty()
+
+    @staticmethod
+    def key_for(day, shard):
+        return db.Key.from_path("CacheKeyStatsShard", "%s:%d" % (day.isoformat(), shard))
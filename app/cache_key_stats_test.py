@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import datetime
+
+import cache_key_stats
+import layer_cache
+import request_cache
+import testutil
+
+
+def cheap():
+    return "cheap"
+
+
+class CacheKeyStatsTest(testutil.GAEModelTestCase):
+    def setUp(self):
+        super(CacheKeyStatsTest, self).setUp()
+        cache_key_stats.start_request()
+        cache_key_stats.INSTANCE_STATS.clear()
+        request_cache.flush()
+        layer_cache.cachepy.flush()
+
+    def stats_for(self, fxn):
+        return cache_key_stats.REQUEST_STATS[cache_key_stats.family(fxn)]
+
+    def test_request_cache_hits_and_misses(self):
+        cached = request_cache.cache()(cheap)
+        cached()
+        cached()
+        cached(bust_cache=True)
+
+        stats = self.stats_for(cheap)
+        self.assertEqual(stats["hits"], {cache_key_stats.REQUEST_LAYER: 1})
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["busts"], 1)
+        self.assertEqual(stats["recomputes"], 2)
+
+    def test_layer_cache_hits_by_layer(self):
+        @layer_cache.cache_with_key_fxn(lambda: "cache_key_stats_test_key")
+        def expensive():
+            return "expensive"
+
+        expensive()
+        expensive()
+        layer_cache.cachepy.flush()
+        expensive()
+
+        stats = cache_key_stats.REQUEST_STATS["cache_key_stats_test.expensive"]
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["recomputes"], 1)
+        self.assertEqual(stats["hits"], {"InAppMemory": 1, "Memcache": 1})
+
+    def test_summaries_are_ranked_by_cost(self):
+        stats = {
+            "often_missed": dict(cache_key_stats.new_counters(),
+                                 hits={"Memcache": 1}, misses=1,
+                                 recomputes=1, recompute_secs=0.1),
+            "slow_but_hot": dict(cache_key_stats.new_counters(),
+                                 hits={"Memcache": 999}, misses=1,
+                                 recomputes=1, recompute_secs=10.0),
+            "never_missed": dict(cache_key_stats.new_counters(),
+                                 hits={"InAppMemory": 5}),
+        }
+
+        summaries = cache_key_stats.summarize(stats)
+        self.assertEqual([summary["family"] for summary in summaries],
+                         ["often_missed", "slow_but_hot", "never_missed"])
+        self.assertAlmostEqual(summaries[0]["cost_ms"], 50.0)
+
+    def test_flushed_stats_merge_across_shards(self):
+        day = datetime.date(2012, 6, 1)
+        counters = dict(cache_key_stats.new_counters(),
+                        hits={"Memcache": 2}, misses=1)
+
+        for _ in xrange(5):
+            cache_key_stats.commit_stats(day, {"family": dict(counters)})
+
+        stats = cache_key_stats.get_daily_stats(day)
+        self.assertEqual(stats["family"]["hits"], {"Memcache": 10})
+        self.assertEqual(stats["family"]["misses"], 5)
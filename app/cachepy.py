@@ -15,16 +15,28 @@ Not everything are upsides. You can not use it on every case because:
 - The only way to be sure you have flushed all the GAE instances caches is doing a code upload, no code change required. 
 - The memory available depends on each GAE instance and your app. I've been able to set a 60 millions characters string which
   is like 57 MB at least. You can cache somethings but not everything. 
+
+The cache is bounded by MAX_BYTES. Every value is sized when it's set (see
+register_sizer), and the least recently used entries are evicted to make
+room. Expired entries are dropped when they're read and by a sweep that
+runs every SWEEP_INTERVAL_SECS.
 """
 
+import collections
+import cPickle
 import time
 import logging
 import os
+import sys
 
-CACHE = {}
+""" Entries, least recently used first: key -> (value, expiry, size) """
+CACHE = collections.OrderedDict()
 STATS_HITS = 0
 STATS_MISSES = 0
 STATS_KEYS_COUNT = 0
+STATS_EVICTIONS = 0
+STATS_EXPIRATIONS = 0
+STATS_BYTES = 0
 
 """ Flag to deactivate it on local environment. """
 ACTIVE = False if os.environ.get('SERVER_SOFTWARE').startswith('Devel') else True
@@ -37,31 +49,77 @@ DEFAULT_CACHING_TIME = None
 
 URL_KEY = 'URL_%s'
 
+"""
+Approximate number of bytes the cache may hold before least recently used
+entries are evicted. Values bigger than MAX_ITEM_FRACTION of it aren't cached
+at all, so one huge value can't flush everything else.
+"""
+MAX_BYTES = 48 * 1024 * 1024
+MAX_ITEM_FRACTION = 0.25
+
+""" How often set() and get() look for expired entries to drop. """
+SWEEP_INTERVAL_SECS = 60
+LAST_SWEEP = time.time()
+
+"""
+Sizers estimate how many bytes a value takes up, by type. Anything without
+a registered sizer is measured by its pickled length.
+"""
+SIZERS = {}
+
 """
 Curious thing: A dictionary in the global scope can be referenced and changed inside a function without using the global statement,
 but it can not be redefined.
 """
 
+def register_sizer( value_type, sizer ):
+    """ Registers sizer(value) -> approximate bytes for values of exactly value_type """
+    SIZERS[value_type] = sizer
+
+register_sizer( str, len )
+register_sizer( unicode, lambda value: 2 * len( value ) )
+
+def size_of( value ):
+    sizer = SIZERS.get( type( value ) )
+    if sizer is not None:
+        return sizer( value )
+    try:
+        return len( cPickle.dumps( value, cPickle.HIGHEST_PROTOCOL ) )
+    except Exception:
+        return sys.getsizeof( value )
+
+def set_max_bytes( max_bytes ):
+    """ Changes the byte budget, evicting entries if it shrank """
+    global MAX_BYTES
+    MAX_BYTES = max_bytes
+    _evict( 0 )
+
 def get( key ):
     """ Gets the data associated to the key or a None """
     if ACTIVE is False:
         return None
         
-    global CACHE, STATS_MISSES, STATS_HITS
-        
+    global CACHE, STATS_MISSES, STATS_HITS, STATS_EXPIRATIONS
+
+    current_timestamp = time.time()
+    _maybe_sweep( current_timestamp )
+
     """ Return a key stored in the python instance cache or a None if it has expired or it doesn't exist """
-    if key not in CACHE:
+    entry = CACHE.pop( key, None )
+    if entry is None:
         STATS_MISSES += 1
         return None
     
-    value, expiry = CACHE[key]
-    current_timestamp = time.time()
+    value, expiry, size = entry
     if expiry == None or current_timestamp < expiry:
         STATS_HITS += 1
+        # Re-inserting moves the key to the most recently used end
+        CACHE[key] = entry
         return value
     else:
         STATS_MISSES += 1
-        delete( key )
+        STATS_EXPIRATIONS += 1
+        _forget( size )
         return None
 
 def set( key, value, expiry = DEFAULT_CACHING_TIME ):
@@ -72,27 +130,71 @@ def set( key, value, expiry = DEFAULT_CACHING_TIME ):
     if ACTIVE is False:
         return None
     
-    global CACHE, STATS_KEYS_COUNT
-    if key not in CACHE:
-        STATS_KEYS_COUNT += 1
+    global CACHE, STATS_KEYS_COUNT, STATS_BYTES
+    current_timestamp = time.time()
+    _maybe_sweep( current_timestamp )
+
+    delete( key )
+
+    size = size_of( value )
+    if size > MAX_BYTES * MAX_ITEM_FRACTION:
+        logging.info( "%s not caching key '%s' of %d bytes" % ( __name__, key, size ) )
+        return None
+
     if expiry != None:
-        expiry = time.time() + int( expiry )
-    
+        expiry = current_timestamp + int( expiry )
+
+    _evict( size )
+
     try:
-        CACHE[key] = ( value, expiry )
+        CACHE[key] = ( value, expiry, size )
+        STATS_KEYS_COUNT += 1
+        STATS_BYTES += size
     except MemoryError:
         """ It doesn't seems to catch the exception, something in the GAE's python runtime probably """
         logging.info( "%s memory error setting key '%s'" % ( __name__, key ) )
+        _evict( MAX_BYTES // 2 )
  
 def delete( key ):
     """ 
     Deletes the key stored in the cache of the current instance, not all the instances.
     There's no reason to use it except for debugging when developing, use expiry when setting a value instead.
     """
-    global CACHE, STATS_KEYS_COUNT
-    if key in CACHE:
-        STATS_KEYS_COUNT -= 1
-        del CACHE[key]
+    global CACHE
+    entry = CACHE.pop( key, None )
+    if entry is not None:
+        _forget( entry[2] )
+
+def _forget( size ):
+    """ Updates the counters for an entry that was just removed from CACHE """
+    global STATS_KEYS_COUNT, STATS_BYTES
+    STATS_KEYS_COUNT -= 1
+    STATS_BYTES -= size
+
+def _evict( incoming_size ):
+    """ Evicts least recently used entries until incoming_size more bytes fit """
+    global CACHE, STATS_EVICTIONS
+    while CACHE and STATS_BYTES + incoming_size > MAX_BYTES:
+        key, entry = CACHE.popitem( last=False )
+        STATS_EVICTIONS += 1
+        _forget( entry[2] )
+
+def _maybe_sweep( current_timestamp ):
+    if current_timestamp - LAST_SWEEP >= SWEEP_INTERVAL_SECS:
+        sweep( current_timestamp )
+
+def sweep( current_timestamp = None ):
+    """ Drops every expired entry. Returns the number of entries dropped. """
+    global CACHE, LAST_SWEEP, STATS_EXPIRATIONS
+    current_timestamp = current_timestamp or time.time()
+    LAST_SWEEP = current_timestamp
+
+    expired = [key for key, ( value, expiry, size ) in CACHE.iteritems()
+               if expiry != None and expiry <= current_timestamp]
+    for key in expired:
+        _forget( CACHE.pop( key )[2] )
+    STATS_EXPIRATIONS += len( expired )
+    return len( expired )
 
 def dump():
     """
@@ -107,9 +209,10 @@ def flush():
     Resets the cache of the current instance, not all the instances.
     There's no reason to use it except for debugging when developing.
     """
-    global CACHE, STATS_KEYS_COUNT
-    CACHE = {}
+    global CACHE, STATS_KEYS_COUNT, STATS_BYTES
+    CACHE = collections.OrderedDict()
     STATS_KEYS_COUNT = 0
+    STATS_BYTES = 0
     
 def stats():
     """ Return the hits and misses stats, the number of keys and the cache memory address of the current instance, not all the instances."""
@@ -119,6 +222,10 @@ def stats():
             'hits': STATS_HITS,
             'misses': STATS_MISSES ,
             'keys_count': STATS_KEYS_COUNT,
+            'evictions': STATS_EVICTIONS,
+            'expirations': STATS_EXPIRATIONS,
+            'bytes': STATS_BYTES,
+            'max_bytes': MAX_BYTES,
             }
     
 def cacheit( keyformat, expiry=DEFAULT_CACHING_TIME ):
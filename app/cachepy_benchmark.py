@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Measures cachepy's LRU eviction under a synthetic layer_cache workload:
+keys are read with a Zipf-like popularity, values have log-normally
+distributed sizes and a miss is followed by a set, as in layer_cache.
+
+The LRU hit rate is compared against FIFO and random eviction with the same
+byte budget, for a few budgets given as fractions of the total working set.
+
+Usage: python cachepy_benchmark.py [NUM_KEYS] [NUM_READS]
+"""
+
+import bisect
+import collections
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("SERVER_SOFTWARE", "Benchmark")
+
+import cachepy
+cachepy.ACTIVE = True
+
+
+def synthetic_workload(num_keys, num_reads, seed=0):
+    rand = random.Random(seed)
+
+    sizes = [int(min(2 ** 20, rand.lognormvariate(8, 1.5))) + 1
+             for _ in xrange(num_keys)]
+
+    # P(key i) proportional to 1 / (i + 1) ** 1.1
+    weights = [1.0 / (i + 1) ** 1.1 for i in xrange(num_keys)]
+    cumulative = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+
+    reads = [bisect.bisect_left(cumulative, rand.random() * total)
+             for _ in xrange(num_reads)]
+
+    return sizes, reads
+
+
+def run_cachepy(sizes, reads, max_bytes):
+    cachepy.flush()
+    cachepy.set_max_bytes(max_bytes)
+    values = ["x" * size for size in sizes]
+
+    hits = 0
+    start = time.time()
+    for key in reads:
+        if cachepy.get(key) is None:
+            cachepy.set(key, values[key])
+        else:
+            hits += 1
+    return hits, time.time() - start
+
+
+def run_simulated(sizes, reads, max_bytes, policy, seed=0):
+    """ FIFO or random eviction with the same size accounting as cachepy """
+    rand = random.Random(seed)
+    cache = collections.OrderedDict()
+    used = 0
+    hits = 0
+
+    for key in reads:
+        if key in cache:
+            hits += 1
+            continue
+
+        size = sizes[key]
+        if size > max_bytes * cachepy.MAX_ITEM_FRACTION:
+            continue
+
+        while cache and used + size > max_bytes:
+            if policy == "fifo":
+                evicted, evicted_size = cache.popitem(last=False)
+            else:
+                evicted = rand.choice(cache.keys())
+                evicted_size = cache.pop(evicted)
+            used -= evicted_size
+
+        cache[key] = size
+        used += size
+
+    return hits
+
+
+def main(num_keys, num_reads):
+    sizes, reads = synthetic_workload(num_keys, num_reads)
+    working_set = sum(sizes[key] for key in set(reads))
+
+    print "keys: %d, reads: %d, working set: %.1f MB" % (
+        num_keys, num_reads, working_set / 2.0 ** 20)
+    print "%8s %10s %10s %10s %14s" % (
+        "budget", "lru", "fifo", "random", "lru us/read")
+
+    for fraction in (0.05, 0.1, 0.25, 0.5):
+        max_bytes = int(working_set * fraction)
+        lru_hits, lru_secs = run_cachepy(sizes, reads, max_bytes)
+        fifo_hits = run_simulated(sizes, reads, max_bytes, "fifo")
+        random_hits = run_simulated(sizes, reads, max_bytes, "random")
+
+        print "%7d%% %9.1f%% %9.1f%% %9.1f%% %14.2f" % (
+            100 * fraction,
+            100.0 * lru_hits / num_reads,
+            100.0 * fifo_hits / num_reads,
+            100.0 * random_hits / num_reads,
+            1e6 * lru_secs / num_reads)
+
+    print "cachepy stats after the last run: %s" % cachepy.stats()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 200000)
@@ -230,6 +230,8 @@ class AddStudentToList(RequestHandler):
         student_data.student_lists.append(student_list.key())
         student_data.put()
 
+        student_list.prewarm_user_exercise_caches()
+
 class RemoveStudentFromList(RequestHandler):
     @RequestHandler.exceptions_to_http(400)
     def post(self):
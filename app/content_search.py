@@ -0,0 +1,79 @@
+"""
+In-memory full text search over the topic tree, an alternative to
+search.Searchable.full_text_search's datastore index queries.
+
+One search.inverted_index.InvertedIndex is built per topic tree version (and
+exercise cache date) over its content topics, live videos and exercises. The
+serialized index is kept in the Blobstore layer, so it's built once per
+version rather than once per instance, and every instance keeps the loaded
+index in memory.
+"""
+
+from google.appengine.ext import db
+
+import cachepy
+import layer_cache
+from models import Exercise, Setting, Topic, TopicVersion, Video
+from search.inverted_index import InvertedIndex
+
+# Field weights: a word in a title counts as much as three in a description
+TITLE_WEIGHT = 3
+KEYWORDS_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+def documents(version=None):
+    """ Yields the (key, kind, title, fields) of everything searchable in
+    version, or the default version if None. """
+    for topic in Topic.get_content_topics(version=version):
+        yield (str(topic.key()), "Topic", topic.standalone_title, [
+            (topic.standalone_title, TITLE_WEIGHT),
+            (topic.description, DESCRIPTION_WEIGHT),
+        ])
+
+    for video in Video.get_all_live(version=version):
+        if video is None:
+            continue
+        yield (str(video.key()), "Video", video.title, [
+            (video.title, TITLE_WEIGHT),
+            (video.keywords, KEYWORDS_WEIGHT),
+            (video.description, DESCRIPTION_WEIGHT),
+        ])
+
+    # Never Exercise.get_all_use_cache(), which includes exercises that
+    # aren't live yet for developers: the index is shared by everyone
+    for exercise in Exercise._get_all_use_cache_safe():
+        if exercise.summative:
+            continue
+        yield (str(exercise.key()), "Exercise", exercise.display_name, [
+            (exercise.display_name, TITLE_WEIGHT),
+            (exercise.description, DESCRIPTION_WEIGHT),
+        ])
+
+@layer_cache.cache_with_key_fxn(lambda version_number=None:
+    "content_search_index_%s_%s" % (
+    version_number or Setting.topic_tree_version(),
+    Setting.cached_exercises_date()),
+    layer=layer_cache.Layers.Blobstore)
+def serialized_index(version_number=None):
+    if version_number:
+        version = TopicVersion.get_by_number(version_number)
+    else:
+        version = None
+
+    return InvertedIndex.build(documents(version)).dumps()
+
+@layer_cache.cache_with_key_fxn(lambda:
+    "content_search_index_loaded_%s_%s" % (
+    Setting.topic_tree_version(), Setting.cached_exercises_date()),
+    layer=layer_cache.Layers.InAppMemory)
+def search_index():
+    return InvertedIndex.loads(serialized_index())
+
+# Size indexes without pickling them
+cachepy.register_sizer(InvertedIndex, lambda index: index.size)
+
+def full_text_search(phrase, limit=10, kind=None):
+    """ Like search.Searchable.full_text_search, returns a list of
+    (key, title) of the entities best matching phrase, of kind if given. """
+    return [(db.Key(key), title)
+            for key, title in search_index().search(phrase, limit, kind)]
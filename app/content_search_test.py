@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+from mock import patch
+
+import content_search
+import testutil
+
+
+class FakeExercise(object):
+    def __init__(self, name, live):
+        self.name = name
+        self.display_name = name
+        self.description = "About %s" % name
+        self.live = live
+        self.summative = False
+
+    def key(self):
+        return "Exercise:%s" % self.name
+
+
+class ContentSearchTest(testutil.GAEModelTestCase):
+    def test_unreleased_exercises_are_never_indexed(self):
+        exercises = [FakeExercise("addition_1", True),
+                     FakeExercise("unreleased", False)]
+
+        # Even when a developer's request builds the shared index
+        with patch("models.Exercise._get_all_use_cache_unsafe",
+                   staticmethod(lambda: exercises)), \
+                patch("models.Topic.get_content_topics",
+                      staticmethod(lambda version=None: [])), \
+                patch("models.Video.get_all_live",
+                      staticmethod(lambda version=None: [])), \
+                patch("user_util.is_current_user_developer", lambda: True):
+            keys = [key for key, kind, title, fields in content_search.documents()]
+
+        self.assertEqual(keys, ["Exercise:addition_1"])
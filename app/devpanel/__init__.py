@@ -1,3 +1,4 @@
+import datetime
 import os, logging
 
 from google.appengine.ext import db, deferred
@@ -6,6 +7,7 @@ import util
 from app import App
 from models import UserData
 from common_core.models import CommonCoreMap
+import cache_key_stats
 import request_handler
 import user_util
 import itertools, functools
@@ -358,3 +360,21 @@ class ManageCommonCore(request_handler.RequestHandler):
 
         self.redirect("/devadmin")
         return
+
+class CacheStats(request_handler.RequestHandler):
+
+    @user_util.developer_only
+    def get(self):
+        today = datetime.date.today()
+        day = self.request_date("day", "%Y-%m-%d",
+                default=datetime.datetime.combine(today, datetime.time())).date()
+
+        template_values = {
+            "selected_id": "cachestats",
+            "day": day,
+            "previous_day": day - datetime.timedelta(days=1),
+            "next_day": day + datetime.timedelta(days=1) if day < today else None,
+            "families": cache_key_stats.summarize(cache_key_stats.get_daily_stats(day)),
+        }
+
+        self.render_jinja2_template("devpanel/cachestats.html", template_values)
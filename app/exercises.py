@@ -589,7 +589,8 @@ def attempt_problem(user_data, user_exercise, problem_number, attempt_number,
         if attempt_number == 1:
             user_exercise.schedule_review(completed)
 
-        user_exercise_graph = models.UserExerciseGraph.get_and_update(user_data, user_exercise)
+        user_exercise_graph = models.UserExerciseGraph.get_and_update(
+                user_data, user_exercise, old_graph)
 
         goals_updated = GoalList.update_goals(user_data,
             lambda goal: goal.just_did_exercise(user_data, user_exercise,
@@ -604,11 +605,10 @@ def attempt_problem(user_data, user_exercise, problem_number, attempt_number,
         # Bulk put
         db.put([user_data, user_exercise, user_exercise_graph.cache])
 
-        # Defer the put of ProblemLog for now, as we think it might be causing hot tablets
-        # and want to shift it off to an automatically-retrying task queue.
+        # Buffer the put of ProblemLog for now, as we think it might be causing hot tablets
+        # and want to shift it off to an automatically-retrying, batched task queue.
         # http://ikaisays.com/2011/01/25/app-engine-datastore-tip-monotonically-increasing-values-are-bad/
-        deferred.defer(models.commit_problem_log, problem_log,
-                       _queue="problem-log-queue")
+        models.PROBLEM_LOG_BUFFER.add(problem_log)
 
         if user_data is not None and user_data.coaches:
             # Making a separate queue for the log summaries so we can clearly see how much they are getting used
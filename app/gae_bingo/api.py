@@ -5,10 +5,9 @@ from google.appengine.ext.webapp import RequestHandler
 
 from .gae_bingo import choose_alternative, delete_experiment, resume_experiment, modulo_choose
 from .cache import BingoCache
-from .stats import describe_result_in_words
+from .results import get_experiment_results
 from .config import can_control_experiments, retrieve_identity
 from .jsonify import jsonify
-from .plots import get_experiment_timeline_data
 from .identity import identity
 
 class Experiments(RequestHandler):
@@ -96,15 +95,19 @@ class ExperimentConversions(RequestHandler):
             alternative.is_short_circuited = (not experiment.live) and (experiment.short_circuit_content == alternative.content)
             alternative.load_latest_counts()
 
+        # Statistics as of the latest snapshot, precomputed by LogSnapshotToDatastore
+        results = get_experiment_results(experiment, alternatives)
+
         context = {
                 "canonical_name": experiment.canonical_name,
                 "live": experiment.live,
                 "total_participants": reduce(lambda a, b: a + b, map(lambda alternative: alternative.participants, alternatives)),
                 "total_conversions": reduce(lambda a, b: a + b, map(lambda alternative: alternative.conversions, alternatives)),
                 "alternatives": alternatives,
-                "significance_test_results": describe_result_in_words(alternatives),
+                "significance_test_results": results["description"],
+                "significance_test_time": results["time_computed"],
                 "y_axis_title": experiment.y_axis_title,
-                "timeline_series": get_experiment_timeline_data(experiment),
+                "timeline_series": results["timeline_series"],
         }
 
         self.response.headers["Content-Type"] = "application/json"
@@ -1,3 +1,4 @@
+import copy_reg
 import logging
 import pickle
 import hashlib
@@ -8,7 +9,8 @@ from google.appengine.api import memcache
 from google.appengine.datastore import entity_pb
 from google.appengine.ext.webapp import RequestHandler
 
-from .models import _GAEBingoExperiment, _GAEBingoAlternative, _GAEBingoIdentityRecord, _GAEBingoSnapshotLog
+from .models import _GAEBingoExperiment, _GAEBingoAlternative, _GAEBingoIdentityRecord, _GAEBingoSnapshotLog, _GAEBingoExperimentResults
+from .results import store_experiment_results
 from identity import identity
 
 # gae_bingo relies on the deferred library,
@@ -25,9 +27,15 @@ from identity import identity
 # NOTE: this request caching will need a bit of a touchup once Python 2.7 is released for GAE and concurrent requests are enabled.
 REQUEST_CACHE = {}
 
+# Alternative numbers chosen during the current request, by
+# (experiment name, identity). Cleared along with REQUEST_CACHE.
+CHOSEN_ALTERNATIVES = {}
+MAX_CHOSEN_ALTERNATIVES = 1000
+
 def flush_request_cache():
     global REQUEST_CACHE
     REQUEST_CACHE = {}
+    CHOSEN_ALTERNATIVES.clear()
 
 def init_request_cache_from_memcache():
     global REQUEST_CACHE
@@ -105,13 +113,20 @@ class BingoCache(object):
 
         # Log current data on live experiments to the datastore
         log_entries = []
+        live_experiments = []
 
         for experiment_name in self.experiments:
             experiment_model = self.get_experiment(experiment_name)
             if experiment_model and experiment_model.live:
                 log_entries += self.log_experiment_snapshot(experiment_model)
+                live_experiments.append(experiment_model)
 
         db.put(log_entries)
+
+        # Now that the snapshot's in, precompute live experiments' statistics
+        # so the dashboard only has to read them
+        store_experiment_results([(experiment_model, self.get_alternatives(experiment_model.name))
+                                  for experiment_model in live_experiments])
             
     def log_experiment_snapshot(self, experiment_model):
 
@@ -120,7 +135,8 @@ class BingoCache(object):
         alternative_models = self.get_alternatives(experiment_model.name)
         for alternative_model in alternative_models:
             # When logging, we want to store the most recent value we've got
-            log_entry = _GAEBingoSnapshotLog(parent=experiment_model, alternative_number=alternative_model.number, conversions=alternative_model.latest_conversions_count(), participants=alternative_model.latest_participants_count())
+            alternative_model.load_latest_counts()
+            log_entry = _GAEBingoSnapshotLog(parent=experiment_model, alternative_number=alternative_model.number, conversions=alternative_model.conversions, participants=alternative_model.participants)
             log_entries.append(log_entry)
 
         return log_entries
@@ -202,6 +218,7 @@ class BingoCache(object):
 
         # First delete from datastore
         experiment.delete()
+        db.delete(db.Key.from_path("_GAEBingoExperimentResults", _GAEBingoExperimentResults.key_for_experiment_name(experiment.name)))
 
         for alternative in self.get_alternatives(experiment.name):
             alternative.reset_counts()
@@ -259,9 +276,22 @@ class BingoCache(object):
     def get_experiment_names_by_canonical_name(self, canonical_name):
         return self.experiment_names_by_canonical_name.get(canonical_name) or []
 
+# Identities whose BingoIdentityCache changed are queued for persistence in
+# NUM_IDENTITY_BUCKETS memcache buckets. Each bucket is append-only: a writer
+# claims the next slot with memcache.incr on the bucket's counter and stores
+# its identity under that slot's own key, so concurrent writers never
+# overwrite each other's entries. Whoever claims the last slot of a batch of
+# IDENTITY_BUCKET_BATCH_SIZE kicks off a task to persist the batch, and the
+# periodic cron job persists whatever is left over in partial batches.
+NUM_IDENTITY_BUCKETS = 51
+IDENTITY_BUCKET_BATCH_SIZE = 50
+
 class BingoIdentityCache(object):
 
-    MEMCACHE_KEY = "_gae_bingo_identity_cache:%s"
+    # Bumped along with STATE_VERSION, so instances still running an older
+    # version never read a state they can't unpickle out of memcache
+    MEMCACHE_KEY = "_gae_bingo_identity_cache_v2:%s"
+    STATE_VERSION = "v2"
 
     @staticmethod
     def key_for_identity(ident):
@@ -284,51 +314,75 @@ class BingoIdentityCache(object):
         # No longer dirty
         self.dirty = False
 
-        memcache.set(BingoIdentityCache.key_for_identity(ident), self)
-
-        # Always fire off a task queue to persist bingo identity cache
-        # since there's no cron job persisting these objects like BingoCache.
-        self.persist_to_datastore(ident)
+        # Always queue the bingo identity cache for persistence since there's
+        # no cron job persisting these objects like BingoCache. Claiming a
+        # bucket slot first lets the cache and the slot be set together.
+        bucket, slot = BingoIdentityCache.claim_bucket_slot(ident)
 
-    def persist_to_datastore(self, ident):
+        mapping = {BingoIdentityCache.key_for_identity(ident): self}
+        if slot:
+            mapping[BingoIdentityCache.key_for_bucket_slot(bucket, slot)] = ident
+        memcache.set_multi(mapping)
 
-        # Add the memcache value to a memcache bucket which
-        # will be persisted to the datastore when it overflows
-        # or when the periodic cron job is run
-        sig = hashlib.md5(str(ident)).hexdigest()
-        sig_num = int(sig, base=16)
-        bucket = sig_num % 51
-        key = "_gae_bingo_identity_bucket:%s" % bucket
+        if slot and slot % IDENTITY_BUCKET_BATCH_SIZE == 0:
+            # This bucket's got a full batch of identities waiting for
+            # persistent storage, so go ahead and kick off a deferred task to
+            # store them in case it'll be a while before the cron job runs.
+            deferred.defer(persist_identity_bucket, bucket, slot - IDENTITY_BUCKET_BATCH_SIZE + 1, slot)
 
-        list_identities = memcache.get(key) or []
-        list_identities.append(ident)
-
-        if len(list_identities) > 50:
+    @staticmethod
+    def bucket_for_identity(ident):
+        return int(hashlib.md5(str(ident)).hexdigest(), base=16) % NUM_IDENTITY_BUCKETS
 
-            # If over 50 identities are waiting for persistent storage, 
-            # go ahead and kick off a deferred task to do so
-            # in case it'll be a while before the cron job runs.
-            deferred.defer(persist_gae_bingo_identity_records, list_identities)
+    @staticmethod
+    def key_for_bucket_counter(bucket):
+        return "_gae_bingo_identity_bucket:%s:count" % bucket
 
-            # There are race conditions here such that we could miss persistence
-            # of some identities, but that's not a big deal as long as
-            # there is no statistical correlation b/w the experiment and those
-            # being lost.
-            memcache.set(key, [])
+    @staticmethod
+    def key_for_bucket_persisted(bucket):
+        return "_gae_bingo_identity_bucket:%s:persisted" % bucket
 
-        else:
+    @staticmethod
+    def key_for_bucket_slot(bucket, slot):
+        return "_gae_bingo_identity_bucket:%s:%s" % (bucket, slot)
 
-            memcache.set(key, list_identities)
+    @staticmethod
+    def claim_bucket_slot(ident):
+        """ Returns (bucket, slot), a slot no other writer will get, for
+        queuing ident. Slots are numbered from 1; slot is None if memcache
+        couldn't hand one out. """
+        bucket = BingoIdentityCache.bucket_for_identity(ident)
+        slot = memcache.incr(BingoIdentityCache.key_for_bucket_counter(bucket), initial_value=0)
+        return bucket, slot
 
     @staticmethod
     def persist_buckets_to_datastore():
-        # Persist all memcache buckets to datastore
-        dict_buckets = memcache.get_multi(["_gae_bingo_identity_bucket:%s" % bucket for bucket in range(0, 50)])
+        # Persist the partial batches of all memcache buckets to datastore.
+        # Full batches have already been deferred by the writers that filled them.
+        counter_keys = [BingoIdentityCache.key_for_bucket_counter(bucket) for bucket in range(NUM_IDENTITY_BUCKETS)]
+        persisted_keys = [BingoIdentityCache.key_for_bucket_persisted(bucket) for bucket in range(NUM_IDENTITY_BUCKETS)]
+
+        dict_counts = memcache.get_multi(counter_keys + persisted_keys)
+
+        persisted = {}
+        for bucket in range(NUM_IDENTITY_BUCKETS):
+            count = long(dict_counts.get(counter_keys[bucket]) or 0)
+            last_full_batch = count - count % IDENTITY_BUCKET_BATCH_SIZE
+
+            # A marker past the count means the counter was evicted and
+            # restarted, so the marker is stale
+            last_persisted = long(dict_counts.get(persisted_keys[bucket]) or 0)
+            if last_persisted > count:
+                last_persisted = 0
+
+            first_slot = max(last_full_batch, last_persisted) + 1
 
-        for key in dict_buckets:
-            if len(dict_buckets[key]) > 0:
-                deferred.defer(persist_gae_bingo_identity_records, dict_buckets[key])
-                memcache.set(key, [])
+            if first_slot <= count:
+                deferred.defer(persist_identity_bucket, bucket, first_slot, count)
+                persisted[persisted_keys[bucket]] = count
+
+        if persisted:
+            memcache.set_multi(persisted)
 
     @staticmethod
     def load_from_datastore():
@@ -346,22 +400,42 @@ class BingoIdentityCache(object):
     def __init__(self):
         self.dirty = False
 
-        self.participating_tests = [] # List of test names currently participating in
+        self.participating_tests = set() # Set of test names currently participating in
         self.converted_tests = {} # Dict of test names:number of times user has successfully converted
 
+    def __getstate__(self):
+        # Pickled for memcache as a versioned tuple, without attribute names
+        # or the dirty flag. A bare 2-tuple would be read as (state,
+        # slotstate) by versions without this __setstate__.
+        # _GAEBingoIdentityRecord uses DatastoreIdentityCacheState instead.
+        return (BingoIdentityCache.STATE_VERSION, list(self.participating_tests), self.converted_tests)
+
+    def __setstate__(self, state):
+        self.dirty = False
+
+        if isinstance(state, dict):
+            # Pickled before identity caches used a compact state
+            self.participating_tests = set(state.get("participating_tests") or [])
+            self.converted_tests = state.get("converted_tests") or {}
+        elif len(state) == 2:
+            # The unversioned compact state
+            participating_tests, self.converted_tests = state
+            self.participating_tests = set(participating_tests)
+        else:
+            version, participating_tests, self.converted_tests = state
+            self.participating_tests = set(participating_tests)
+
     def purge(self):
         bingo_cache = BingoCache.get()
-        
-        for participating_test in self.participating_tests:
-            if not participating_test in bingo_cache.experiments:
-                self.participating_tests.remove(participating_test)
+
+        self.participating_tests.intersection_update(bingo_cache.experiments)
 
         for converted_test in self.converted_tests.keys():
             if not converted_test in bingo_cache.experiments:
                 del self.converted_tests[converted_test]
 
     def participate_in(self, experiment_name):
-        self.participating_tests.append(experiment_name)
+        self.participating_tests.add(experiment_name)
         self.dirty = True
 
     def convert_in(self, experiment_name):
@@ -385,20 +459,50 @@ def store_if_dirty():
     if bingo_identity_cache:
         bingo_identity_cache.store_for_identity_if_dirty(identity())
 
+def persist_identity_bucket(bucket, first_slot, last_slot):
+    """ Persists the identities queued in slots first_slot through last_slot
+    of bucket. """
+    slot_keys = [BingoIdentityCache.key_for_bucket_slot(bucket, slot) for slot in xrange(first_slot, last_slot + 1)]
+    dict_identities = memcache.get_multi(slot_keys)
+
+    # The same identity may have been queued by several requests
+    persist_gae_bingo_identity_records(list(set(dict_identities.values())))
+
+    # Slot numbers aren't reused until the counter's evicted, so clean up
+    memcache.delete_multi(slot_keys)
+
+class DatastoreIdentityCacheState(object):
+    """ Pickles a BingoIdentityCache as its plain attribute dict, with
+    participating_tests as a list, instead of the compact memcache state.
+    Every version of BingoIdentityCache can load that, including instances
+    still serving an older version during a deploy or after a rollback. """
+
+    def __init__(self, identity_cache):
+        self.identity_cache = identity_cache
+
+    def __reduce__(self):
+        return (copy_reg._reconstructor, (BingoIdentityCache, object, None), {
+                    "dirty": False,
+                    "participating_tests": list(self.identity_cache.participating_tests),
+                    "converted_tests": self.identity_cache.converted_tests,
+                })
+
 def persist_gae_bingo_identity_records(list_identities):
 
     dict_identity_caches = memcache.get_multi([BingoIdentityCache.key_for_identity(ident) for ident in list_identities])
 
+    bingo_identities = []
     for ident in list_identities:
         identity_cache = dict_identity_caches.get(BingoIdentityCache.key_for_identity(ident))
 
         if identity_cache:
-            bingo_identity = _GAEBingoIdentityRecord(
+            bingo_identities.append(_GAEBingoIdentityRecord(
                         key_name = _GAEBingoIdentityRecord.key_for_identity(ident),
                         identity = ident,
-                        pickled = pickle.dumps(identity_cache),
-                    )
-            bingo_identity.put()
+                        pickled = pickle.dumps(DatastoreIdentityCacheState(identity_cache), pickle.HIGHEST_PROTOCOL),
+                    ))
+
+    db.put(bingo_identities)
 
 class PersistToDatastore(RequestHandler):
     def get(self):
@@ -7,7 +7,7 @@ import urllib
 from google.appengine.ext.webapp import RequestHandler
 from .config import can_control_experiments
 from .cache import BingoCache
-from .stats import describe_result_in_words
+from .results import get_experiment_results
 
 class Dashboard(RequestHandler):
 
@@ -65,7 +65,7 @@ class Export(RequestHandler):
                     writer.writerow([alternative.number, alternative.content, alternative.participants, alternative.conversions, alternative.conversion_rate])
 
                 writer.writerow([])
-                writer.writerow(["SIGNIFICANCE TEST RESULTS: %s" % describe_result_in_words(alternatives)])
+                writer.writerow(["SIGNIFICANCE TEST RESULTS: %s" % get_experiment_results(experiment, alternatives)["description"]])
                 writer.writerow([])
 
                 writer.writerow([])
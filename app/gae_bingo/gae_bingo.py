@@ -6,7 +6,7 @@ import urllib
 
 from google.appengine.api import memcache
 
-from .cache import BingoCache, bingo_and_identity_cache
+from .cache import BingoCache, bingo_and_identity_cache, CHOSEN_ALTERNATIVES, MAX_CHOSEN_ALTERNATIVES
 from .models import create_experiment_and_alternatives, ConversionTypes
 from .identity import identity
 from .config import can_control_experiments
@@ -247,18 +247,43 @@ def _find_alternative_for_user(experiment_hashable_name,
                                alternatives,
                                identity_val=None):
 
-    if can_control_experiments():
-        # If gae_bingo administrator, allow possible override of alternative
-        qs_dict = cgi.parse_qs(os.environ.get("QUERY_STRING") or "")
+    if not alternatives:
+        return None
+
+    # A request usually asks for the same experiment's alternative several
+    # times, e.g. participating and then converting, so remember choices
+    # for the rest of the request
+    choice_key = (alternatives[0].experiment_name, identity(identity_val))
+    number = CHOSEN_ALTERNATIVES.get(choice_key)
+    if number is None:
+        number = _choose_alternative_for_user(experiment_hashable_name,
+                                              alternatives,
+                                              choice_key[1]).number
+        if len(CHOSEN_ALTERNATIVES) >= MAX_CHOSEN_ALTERNATIVES:
+            # Outside of the middleware nothing clears these between requests
+            CHOSEN_ALTERNATIVES.clear()
+        CHOSEN_ALTERNATIVES[choice_key] = number
+
+    for alternative in alternatives:
+        if alternative.number == number:
+            return alternative
+
+def _choose_alternative_for_user(experiment_hashable_name,
+                                 alternatives,
+                                 identity):
+
+    # Only look up whether this is a gae_bingo administrator, which costs a
+    # datastore query, if there's an override to allow
+    qs_dict = cgi.parse_qs(os.environ.get("QUERY_STRING") or "")
 
-        alternative_number_override = qs_dict.get("gae_bingo_alternative_number")
-        if alternative_number_override:
+    alternative_number_override = qs_dict.get("gae_bingo_alternative_number")
+    if alternative_number_override and can_control_experiments():
 
-            matches = filter(lambda alternative: alternative.number == int(alternative_number_override[0]), alternatives)
-            if len(matches) == 1:
-                return matches[0]
+        matches = filter(lambda alternative: alternative.number == int(alternative_number_override[0]), alternatives)
+        if len(matches) == 1:
+            return matches[0]
 
-    return modulo_choose(experiment_hashable_name, alternatives, identity(identity_val))
+    return modulo_choose(experiment_hashable_name, alternatives, identity)
 
 def modulo_choose(experiment_hashable_name, alternatives, identity):
     alternatives_weight = sum(map(lambda alternative: alternative.weight, alternatives))
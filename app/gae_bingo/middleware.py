@@ -1,6 +1,7 @@
 import logging
 
 from cache import flush_request_cache, store_if_dirty
+from models import start_buffering_increments, flush_buffered_increments
 from identity import identity, get_identity_cookie_value, set_identity_cookie_header, delete_identity_cookie_header, using_logged_in_bingo_identity, flush_identity_cache
 
 class GAEBingoWSGIMiddleware(object):
@@ -14,6 +15,9 @@ class GAEBingoWSGIMiddleware(object):
         flush_request_cache()
         flush_identity_cache()
 
+        # Buffer participant and conversion counts until the end of the request
+        start_buffering_increments()
+
         def gae_bingo_start_response(status, headers, exc_info = None):
 
             if using_logged_in_bingo_identity():
@@ -29,12 +33,18 @@ class GAEBingoWSGIMiddleware(object):
 
             return start_response(status, headers, exc_info)
 
-        result = self.app(environ, gae_bingo_start_response)
-        for value in result:
-            yield value
+        try:
+            result = self.app(environ, gae_bingo_start_response)
+            for value in result:
+                yield value
+
+            # Persist any changed GAEBingo data to memcache
+            store_if_dirty()
 
-        # Persist any changed GAEBingo data to memcache
-        store_if_dirty()
+        finally:
+            # Apply all of the request's buffered counts in one go, even if
+            # the request failed partway through
+            flush_buffered_increments()
 
         # We probably don't need to do this b/c we clear the cache at the start of each request,
         # but what the heck, cache bugs are just the worst.
@@ -122,14 +122,14 @@ class _GAEBingoAlternative(db.Model):
         # It's possible that the cached _GAEBingoAlternative entities will fall a bit behind
         # due to concurrency issues, but the memcache.incr'd version should stay up-to-date and
         # be persisted.
-        self.participants = long(memcache.incr("%s:participants" % self.key_for_self(), initial_value=self.participants))
+        self.participants = increment_counter("%s:participants" % self.key_for_self(), self.participants)
 
     def increment_conversions(self):
         # Use a memcache.incr-backed counter to keep track of increments in a scalable fashion.
         # It's possible that the cached _GAEBingoAlternative entities will fall a bit behind
         # due to concurrency issues, but the memcache.incr'd version should stay up-to-date and
         # be persisted.
-        self.conversions = long(memcache.incr("%s:conversions" % self.key_for_self(), initial_value=self.conversions))
+        self.conversions = increment_counter("%s:conversions" % self.key_for_self(), self.conversions)
 
     def latest_participants_count(self):
         return max(self.participants, long(memcache.get("%s:participants" % self.key_for_self()) or 0))
@@ -145,6 +145,50 @@ class _GAEBingoAlternative(db.Model):
         self.participants = self.latest_participants_count()
         self.conversions = self.latest_conversions_count()
 
+# Counter increments buffered for the current request, memcache key ->
+# [increment, initial value]. GAEBingoWSGIMiddleware starts buffering at the
+# beginning of every request and applies them all with a single
+# memcache.offset_multi at its end. Outside of the middleware (e.g. in
+# deferred tasks) nothing is buffered and every increment is its own incr.
+BUFFERED_INCREMENTS = None
+
+def start_buffering_increments():
+    global BUFFERED_INCREMENTS
+    BUFFERED_INCREMENTS = {}
+
+def flush_buffered_increments():
+    """ Applies the current request's buffered increments and stops buffering. """
+    global BUFFERED_INCREMENTS
+
+    increments, BUFFERED_INCREMENTS = BUFFERED_INCREMENTS, None
+    if not increments:
+        return
+
+    results = memcache.offset_multi(dict((key, increment) for key, (increment, initial_value) in increments.iteritems()))
+
+    # offset_multi only takes one initial value for all keys, so counters that
+    # aren't in memcache (evicted, or never incremented) are started separately
+    # from the count each alternative was last persisted with.
+    for key, (increment, initial_value) in increments.iteritems():
+        if results.get(key) is None:
+            memcache.incr(key, delta=increment, initial_value=initial_value)
+
+def increment_counter(key, initial_value):
+    """ Increments the memcache counter at key, starting it from initial_value
+    if it isn't in memcache. Returns the counter's new value, or while
+    buffering, initial_value plus this request's increments.
+    """
+    if BUFFERED_INCREMENTS is None:
+        return long(memcache.incr(key, initial_value=initial_value))
+
+    if key in BUFFERED_INCREMENTS:
+        BUFFERED_INCREMENTS[key][0] += 1
+    else:
+        BUFFERED_INCREMENTS[key] = [1, initial_value]
+
+    increment, initial_value = BUFFERED_INCREMENTS[key]
+    return long(initial_value + increment)
+
 class _GAEBingoSnapshotLog(db.Model):
     alternative_number = db.IntegerProperty()
     conversions = db.IntegerProperty(default = 0)
@@ -152,6 +196,24 @@ class _GAEBingoSnapshotLog(db.Model):
     time_recorded = db.DateTimeProperty(auto_now_add = True)
         
     
+class _GAEBingoExperimentResults(db.Model):
+    # Statistics for an experiment, as computed by stats.analyze whenever a
+    # snapshot is logged, so dashboards don't have to recompute them
+    pickled_results = db.BlobProperty()
+    time_computed = db.DateTimeProperty(auto_now = True)
+
+    @staticmethod
+    def key_for_experiment_name(experiment_name):
+        return "_gae_experiment_results:%s" % experiment_name
+
+    @property
+    def results(self):
+        return pickle.loads(self.pickled_results)
+
+    @staticmethod
+    def get_for_experiment_name(experiment_name):
+        return _GAEBingoExperimentResults.get_by_key_name(_GAEBingoExperimentResults.key_for_experiment_name(experiment_name))
+
 class _GAEBingoIdentityRecord(db.Model):
     identity = db.StringProperty()
     pickled = db.BlobProperty()
@@ -0,0 +1,91 @@
+import datetime
+import pickle
+import time
+
+from google.appengine.ext import db
+
+from .models import _GAEBingoSnapshotLog, _GAEBingoExperimentResults, ConversionTypes
+from .stats import analyze
+
+# Most recent snapshot log entries used for an experiment's timeline and
+# sequential tests
+MAX_SNAPSHOTS = 1000
+
+def get_experiment_snapshots(experiment):
+    """ All of an experiment's recent snapshot log entries, newest first, in
+    a single query for all of its alternatives """
+    query = _GAEBingoSnapshotLog.all().ancestor(experiment)
+    query.order('-time_recorded')
+    return query.fetch(MAX_SNAPSHOTS)
+
+def snapshot_series(snapshots):
+    """ Groups snapshot log entries, newest first, into one {alternative
+    number: (participants, conversions)} dict per logged snapshot, oldest
+    first. Every snapshot logs each alternative once, in order. """
+    series = []
+    for snapshot in reversed(snapshots):
+        if not series or snapshot.alternative_number in series[-1]:
+            series.append({})
+        series[-1][snapshot.alternative_number] = (snapshot.participants, snapshot.conversions)
+    return series
+
+def timeline_series(experiment, alternatives, snapshots):
+    """ Conversion rates over time for the dashboard's chart, one series of
+    [time in ms, rate] points per alternative """
+
+    experiment_data_map = {}
+    experiment_data = []
+    y_scale_multiplier = 1.0 if experiment.conversion_type == ConversionTypes.Counting else 100.0
+
+    alternative_contents = dict((alternative.number, str(alternative.content)) for alternative in alternatives)
+
+    for snapshot in snapshots:
+
+        if snapshot.alternative_number not in experiment_data_map:
+            alternative_content_str = alternative_contents.get(snapshot.alternative_number,
+                                                               "Alternative #" + str(snapshot.alternative_number))
+            experiment_data.append({ "name": alternative_content_str, "data": [] })
+            experiment_data_map[snapshot.alternative_number] = experiment_data[-1]
+
+        conv_rate = 0.0
+        if snapshot.participants > 0:
+            conv_rate = float(snapshot.conversions) / float(snapshot.participants) * y_scale_multiplier
+        conv_rate = round(conv_rate, 3)
+
+        utc_time = time.mktime(snapshot.time_recorded.timetuple()) * 1000
+
+        experiment_data_map[snapshot.alternative_number]["data"].append([utc_time, conv_rate])
+
+    return experiment_data
+
+def compute_experiment_results(experiment, alternatives, snapshots=None):
+    if snapshots is None:
+        snapshots = get_experiment_snapshots(experiment)
+
+    results = analyze(alternatives, experiment.conversion_type, snapshot_series(snapshots))
+    results["timeline_series"] = timeline_series(experiment, alternatives, snapshots)
+    results["time_computed"] = datetime.datetime.now()
+    return results
+
+def store_experiment_results(experiments_and_alternatives):
+    """ Computes and stores the results of each (experiment, alternatives)
+    pair, for get_experiment_results """
+    results_models = []
+
+    for experiment, alternatives in experiments_and_alternatives:
+        results = compute_experiment_results(experiment, alternatives)
+        results_models.append(_GAEBingoExperimentResults(
+                    key_name = _GAEBingoExperimentResults.key_for_experiment_name(experiment.name),
+                    pickled_results = pickle.dumps(results, pickle.HIGHEST_PROTOCOL),
+                ))
+
+    db.put(results_models)
+
+def get_experiment_results(experiment, alternatives):
+    """ The experiment's results as of its latest snapshot, or computed from
+    alternatives' current counts if none have been stored yet """
+    results_model = _GAEBingoExperimentResults.get_for_experiment_name(experiment.name)
+    if results_model:
+        return results_model.results
+
+    return compute_experiment_results(experiment, alternatives)
@@ -1,101 +1,342 @@
-import logging
+import math
 
-# This file in particular is almost a direct port from Patrick McKenzie's A/Bingo's abingo/lib/abingo/statistics.rb
+from .models import ConversionTypes
 
-HANDY_Z_SCORE_CHEATSHEET = [[0.10, 1.29], [0.05, 1.65], [0.01, 2.33], [0.001, 3.08]]
+# Tests for any number of alternatives. Every alternative is compared against
+# the control (the lowest numbered alternative), and there's an overall
+# chi-square test of whether any alternative's rate differs at all.
+#
+# Binary conversions are tested as proportions. Counting conversions can
+# happen more than once per participant, so their rates are tested as
+# Poisson means.
 
-PERCENTAGES = {0.10: '90%', 0.05: '95%', 0.01: '99%', 0.001: '99.9%'}
+SIGNIFICANCE_LEVEL = 0.05
+CONFIDENCE = 0.95
 
-DESCRIPTION_IN_WORDS = {
-        0.10: 'fairly confident', 0.05: 'confident',
-        0.01: 'very confident', 0.001: 'extremely confident'
-        }
+# Participants an alternative needs before its results are worth more than
+# a grain of salt
+MIN_PARTICIPANTS = 10
+
+# The sequential test mixes over effects of about this fraction of the
+# pooled conversion rate
+SEQUENTIAL_EFFECT_SIZE = 0.1
+
+def normal_sf(z):
+    """ P(Z > z) for a standard normal Z """
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+def normal_ppf(p):
+    """ The z with P(Z < z) = p for a standard normal Z """
+    if not 0 < p < 1:
+        raise ValueError("normal_ppf is only defined on (0, 1), not %s" % p)
+
+    low, high = -40.0, 40.0
+    for _ in xrange(200):
+        mid = (low + high) / 2
+        if normal_sf(mid) > 1 - p:
+            low = mid
+        else:
+            high = mid
+        if high - low < 1e-12:
+            break
+    return (low + high) / 2
+
+def regularized_gamma_q(a, x):
+    """ The regularized upper incomplete gamma function Q(a, x) """
+    if x <= 0:
+        return 1.0
+
+    log_prefix = -x + a * math.log(x) - math.lgamma(a)
+
+    if x < a + 1:
+        # Series for P(a, x), which converges quickly here
+        term = total = 1.0 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1.0 - total * math.exp(log_prefix))
+
+    # Continued fraction for Q(a, x), by the modified Lentz method
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in xrange(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        if abs(d) < tiny:
+            d = tiny
+        c = b + an / c
+        if abs(c) < tiny:
+            c = tiny
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return math.exp(log_prefix) * h
+
+def chi_square_sf(x, degrees_of_freedom):
+    """ P(X > x) for X chi-square distributed with degrees_of_freedom """
+    return regularized_gamma_q(degrees_of_freedom / 2.0, x / 2.0)
+
+def two_sided_p_value(z):
+    return min(1.0, 2 * normal_sf(abs(z)))
+
+def rate_variance(rate, conversion_type):
+    """ Variance of a single participant's conversions at rate """
+    if conversion_type == ConversionTypes.Counting:
+        return rate
+    return rate * (1 - rate)
+
+def variance_rate(rate, conversion_type):
+    """ rate, capped at 1 for binary conversions. Their counters can drift
+    past the participant count, but a proportion can't. """
+    if conversion_type == ConversionTypes.Counting:
+        return rate
+    return min(rate, 1.0)
+
+def rate_interval(conversions, participants, conversion_type, confidence=CONFIDENCE):
+    """ Confidence interval for a conversion rate: the Wilson score interval
+    for binary conversions, the normal approximation for counting ones. """
+    if not participants:
+        return None
+
+    z = normal_ppf(0.5 + confidence / 2)
+    rate = float(conversions) / participants
+
+    if conversion_type == ConversionTypes.Counting:
+        margin = z * math.sqrt(rate / participants)
+        return (max(0.0, rate - margin), rate + margin)
+
+    rate = variance_rate(rate, conversion_type)
+    denominator = 1 + z * z / participants
+    center = (rate + z * z / (2 * participants)) / denominator
+    margin = z * math.sqrt(rate * (1 - rate) / participants + z * z / (4 * participants * participants)) / denominator
+    return (max(0.0, center - margin), min(1.0, center + margin))
+
+def chi_square_test(counts, conversion_type):
+    """ Tests whether any of counts' (participants, conversions) pairs has a
+    different rate than the rest. Returns (statistic, degrees of freedom,
+    p-value), or None with fewer than two groups of participants. """
+    counts = [(participants, conversions) for participants, conversions in counts if participants]
+    if len(counts) < 2:
+        return None
+
+    total_participants = sum(participants for participants, conversions in counts)
+    pooled_rate = variance_rate(float(sum(conversions for participants, conversions in counts)) / total_participants,
+                                conversion_type)
+
+    variance = rate_variance(pooled_rate, conversion_type)
+    degrees_of_freedom = len(counts) - 1
+    if variance <= 0:
+        return (0.0, degrees_of_freedom, 1.0)
+
+    statistic = sum((conversions - participants * pooled_rate) ** 2 / (participants * variance)
+                    for participants, conversions in counts)
+    return (statistic, degrees_of_freedom, chi_square_sf(statistic, degrees_of_freedom))
 
-def zscore(alternatives):
+def difference_test(control, treatment, conversion_type):
+    """ Compares two (participants, conversions) pairs. Returns the
+    difference in rates, its variance and its pooled z-score. """
+    (n1, c1), (n2, c2) = control, treatment
+    rate1, rate2 = float(c1) / n1, float(c2) / n2
 
-    if len(alternatives) != 2:
-        raise Exception("Sorry, can't currently automatically calculate statistics for A/B tests with > 2 alternatives. Need to brush up on some statistics via http://www.khanacademy.org/#statistics before implementing.")
+    # Unpooled variance for the interval...
+    variance = (rate_variance(variance_rate(rate1, conversion_type), conversion_type) / n1 +
+                rate_variance(variance_rate(rate2, conversion_type), conversion_type) / n2)
 
-    if alternatives[0].participants == 0 or alternatives[1].participants == 0:
-        raise Exception("Can't calculate the z score if either of the alternatives lacks participants.")
+    # ...pooled variance for the test, under the hypothesis of no difference
+    pooled_rate = variance_rate(float(c1 + c2) / (n1 + n2), conversion_type)
+    pooled_variance = rate_variance(pooled_rate, conversion_type) * (1.0 / n1 + 1.0 / n2)
 
-    cr1 = alternatives[0].conversion_rate
-    cr2 = alternatives[1].conversion_rate
+    z = (rate2 - rate1) / math.sqrt(pooled_variance) if pooled_variance > 0 else 0.0
+    return rate2 - rate1, variance, z
 
-    n1 = alternatives[0].participants
-    n2 = alternatives[1].participants
+def holm_adjusted(p_values):
+    """ Holm-Bonferroni adjusted p-values, in the order given """
+    order = sorted(range(len(p_values)), key=lambda i: p_values[i])
 
-    numerator = cr1 - cr2
-    frac1 = cr1 * (1 - cr1) / float(n1)
-    frac2 = cr2 * (1 - cr2) / float(n2)
+    adjusted = [None] * len(p_values)
+    running_max = 0.0
+    for rank, i in enumerate(order):
+        running_max = max(running_max, min(1.0, (len(p_values) - rank) * p_values[i]))
+        adjusted[i] = running_max
+    return adjusted
 
-    if frac1 + frac2 == 0:
-        return 0
-    elif frac1 + frac2 < 0:
-        raise Exception("At the moment we can't calculate the z score of experiments that allow multiple conversions per participant.")
+def sequential_p_value(series, conversion_type):
+    """ Always-valid p-value for the difference between two alternatives,
+    given the series of ((participants, conversions), (participants,
+    conversions)) counts they had at every snapshot.
 
-    return numerator / float((frac1 + frac2) ** 0.5)
+    Checking an ordinary p-value every time a snapshot comes in and stopping
+    once it dips below 0.05 finds far more than 5% false positives. This is
+    the mixture sequential probability ratio test's p-value, which stays
+    valid however often it's looked at.
+    """
+    series = [(control, treatment) for control, treatment in series if control[0] and treatment[0]]
+    if not series:
+        return None
 
-def p_value(alternatives):
+    (n1, c1), (n2, c2) = series[-1]
+    pooled_rate = float(c1 + c2) / (n1 + n2)
+    tau_squared = (SEQUENTIAL_EFFECT_SIZE * pooled_rate) ** 2
+    if tau_squared <= 0:
+        return 1.0
 
-    index = 0
-    z = zscore(alternatives)
-    z = abs(z)
+    p = 1.0
+    for control, treatment in series:
+        difference, variance, z = difference_test(control, treatment, conversion_type)
+        if variance <= 0:
+            continue
 
-    found_p = None
-    while index < len(HANDY_Z_SCORE_CHEATSHEET):
-        if z > HANDY_Z_SCORE_CHEATSHEET[index][1]:
-            found_p = HANDY_Z_SCORE_CHEATSHEET[index][0]
-        index += 1
+        log_likelihood_ratio = (0.5 * math.log(variance / (variance + tau_squared)) +
+                                difference * difference * tau_squared / (2 * variance * (variance + tau_squared)))
+        p = min(p, math.exp(-log_likelihood_ratio) if log_likelihood_ratio < 700 else 0.0)
 
-    return found_p
+    return p
 
-def is_statistically_significant(p = 0.05):
-    return p_value <= p
+def analyze(alternatives, conversion_type, snapshot_series=None):
+    """ Analyzes an experiment's alternatives, which need number, content,
+    participants and conversions, as in _GAEBingoAlternative.
 
-def describe_result_in_words(alternatives):
+    snapshot_series, if given, is a list of {alternative number:
+    (participants, conversions)} dicts, one per snapshot in the order they
+    were taken, for sequential tests.
+    """
+    alternatives = sorted(alternatives, key=lambda alternative: alternative.number)
+    counts = [(alternative.participants, alternative.conversions) for alternative in alternatives]
 
-    try:
-        z = zscore(alternatives)
-    except Exception, e:
-        return str(e)
+    results = {
+        "conversion_type": conversion_type,
+        "alternatives": [],
+        "comparisons": [],
+        "chi_square": None,
+        "degrees_of_freedom": None,
+        "p_value": None,
+    }
 
-    p = p_value(alternatives)
+    for alternative, (participants, conversions) in zip(alternatives, counts):
+        results["alternatives"].append({
+            "number": alternative.number,
+            "content": str(alternative.content),
+            "participants": participants,
+            "conversions": conversions,
+            "rate": float(conversions) / participants if participants else 0.0,
+            "interval": rate_interval(conversions, participants, conversion_type),
+        })
+
+    test = chi_square_test(counts, conversion_type)
+    if test:
+        results["chi_square"], results["degrees_of_freedom"], results["p_value"] = test
+
+    control = alternatives[0] if alternatives else None
+    z_margin = normal_ppf(0.5 + CONFIDENCE / 2)
+
+    for alternative, treatment_counts in zip(alternatives[1:], counts[1:]):
+        if not counts[0][0] or not treatment_counts[0]:
+            continue
+
+        difference, variance, z = difference_test(counts[0], treatment_counts, conversion_type)
+        margin = z_margin * math.sqrt(variance)
+
+        comparison = {
+            "number": alternative.number,
+            "content": str(alternative.content),
+            "difference": difference,
+            "interval": (difference - margin, difference + margin),
+            "z": z,
+            "p_value": two_sided_p_value(z),
+            "sequential_p_value": None,
+        }
+
+        if snapshot_series:
+            comparison["sequential_p_value"] = sequential_p_value(
+                    [(snapshot.get(control.number, (0, 0)), snapshot.get(alternative.number, (0, 0)))
+                        for snapshot in snapshot_series],
+                    conversion_type)
+
+        results["comparisons"].append(comparison)
+
+    for comparison, adjusted in zip(results["comparisons"],
+                                    holm_adjusted([comparison["p_value"] for comparison in results["comparisons"]])):
+        comparison["adjusted_p_value"] = adjusted
+
+    results["description"] = describe_results(results)
+    return results
+
+def format_rate(rate, conversion_type):
+    if conversion_type == ConversionTypes.Counting:
+        return "%.3f per participant" % rate
+    return "%4.2f%%" % (rate * 100)
+
+def format_p_value(p):
+    if p < 0.001:
+        return "p < 0.001"
+    return "p = %.3f" % p
+
+def describe_results(results):
+    """ Describes analyze's results in words, for the dashboard """
+    alternatives = results["alternatives"]
+    conversion_type = results["conversion_type"]
+
+    # Only alternatives with participants take part in the chi-square test
+    tested = [alternative for alternative in alternatives if alternative["participants"]]
+    if len(tested) < 2:
+        return "Can't compare the alternatives until at least two of them have participants."
 
     words = ""
 
-    if alternatives[0].participants < 10 or alternatives[1].participants < 10:
+    if min(alternative["participants"] for alternative in alternatives) < MIN_PARTICIPANTS:
         words += "Take these results with a grain of salt since your samples are so small: "
 
-    best_alternative = max(alternatives, key=lambda alternative: alternative.conversion_rate)
-    worst_alternative = min(alternatives, key=lambda alternative: alternative.conversion_rate)
-
-    words += """The best alternative you have is: [%(best_alternative_content)s], which had 
-    %(best_alternative_conversions)s conversions from %(best_alternative_participants)s participants 
-    (%(best_alternative_pretty_conversion_rate)s).  The other alternative was [%(worst_alternative_content)s], 
-    which had %(worst_alternative_conversions)s conversions from %(worst_alternative_participants)s participants 
-    (%(worst_alternative_pretty_conversion_rate)s).  """ % {
-                "best_alternative_content": best_alternative.content,
-                "best_alternative_conversions": best_alternative.conversions,
-                "best_alternative_participants": best_alternative.participants,
-                "best_alternative_pretty_conversion_rate": best_alternative.pretty_conversion_rate,
-                "worst_alternative_content": worst_alternative.content,
-                "worst_alternative_conversions": worst_alternative.conversions,
-                "worst_alternative_participants": worst_alternative.participants,
-                "worst_alternative_pretty_conversion_rate": worst_alternative.pretty_conversion_rate,
-            }
-
-    if p is None:
-        words += "However, this difference is not statistically significant."
+    best = max(alternatives, key=lambda alternative: alternative["rate"])
+    words += "The best alternative you have is: [%s], which had %s conversions from %s participants (%s). " % (
+            best["content"], best["conversions"], best["participants"],
+            format_rate(best["rate"], conversion_type))
+
+    control = alternatives[0]
+    for comparison in results["comparisons"]:
+        low, high = comparison["interval"]
+        words += "[%s] vs. [%s]: a difference of %s (%d%% interval %s to %s), %s" % (
+                comparison["content"], control["content"],
+                format_rate(comparison["difference"], conversion_type),
+                int(CONFIDENCE * 100),
+                format_rate(low, conversion_type), format_rate(high, conversion_type),
+                format_p_value(comparison["p_value"]))
+
+        if len(results["comparisons"]) > 1:
+            words += ", %s adjusted for %d comparisons" % (
+                    format_p_value(comparison["adjusted_p_value"]), len(results["comparisons"]))
+
+        if comparison["sequential_p_value"] is not None:
+            words += ", %s allowing for repeated looks" % format_p_value(comparison["sequential_p_value"])
+
+        words += ". "
+
+    if results["p_value"] is not None and len(tested) > 2:
+        words += "Across all %d alternatives with participants, chi-square = %.2f with %d degrees of freedom, %s. " % (
+                len(tested), results["chi_square"], results["degrees_of_freedom"],
+                format_p_value(results["p_value"]))
+
+    significant = [comparison for comparison in results["comparisons"]
+                   if comparison["adjusted_p_value"] <= SIGNIFICANCE_LEVEL and
+                      (comparison["sequential_p_value"] is None or comparison["sequential_p_value"] <= SIGNIFICANCE_LEVEL)]
+
+    if significant:
+        words += "The difference%s for %s %s statistically significant at the %d%% level." % (
+                "s" if len(significant) > 1 else "",
+                ", ".join("[%s]" % comparison["content"] for comparison in significant),
+                "are" if len(significant) > 1 else "is",
+                int(100 * (1 - SIGNIFICANCE_LEVEL)))
     else:
-        words += """This difference is %(percentage_likelihood)s likely to be statistically significant, which means you can be 
-        %(description)s that it is the result of your alternatives actually mattering, rather than 
-        being due to random chance.  However, this statistical test can't measure how likely the currently 
-        observed magnitude of the difference is to be accurate or not.  It only says "better," not "better 
-        by so much.\"""" % {
-                    "percentage_likelihood": PERCENTAGES[p],
-                    "description": DESCRIPTION_IN_WORDS[p],
-                }
+        words += "However, no difference is statistically significant."
 
     return words
 
+def describe_result_in_words(alternatives, conversion_type=ConversionTypes.Binary):
+    return describe_results(analyze(alternatives, conversion_type))
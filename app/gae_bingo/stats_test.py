@@ -0,0 +1,40 @@
+import unittest
+
+from . import stats
+from .models import ConversionTypes
+
+class Alternative(object):
+    def __init__(self, number, participants, conversions):
+        self.number = number
+        self.content = "Alternative #%d" % number
+        self.participants = participants
+        self.conversions = conversions
+
+class StatsTest(unittest.TestCase):
+
+    def test_counting_interval_uses_rates_above_one(self):
+        results = stats.analyze([Alternative(0, 10, 30), Alternative(1, 10, 50)],
+                                ConversionTypes.Counting)
+
+        # Rates of 3 and 5 per participant: the variance of the difference
+        # is 3 / 10 + 5 / 10, so the interval is 2 +/- 1.96 * sqrt(0.8)
+        low, high = results["comparisons"][0]["interval"]
+        self.assertAlmostEqual(low, 0.247, places=3)
+        self.assertAlmostEqual(high, 3.753, places=3)
+
+    def test_binary_interval_caps_rates_at_one(self):
+        difference, variance, z = stats.difference_test((10, 12), (10, 5),
+                                                        ConversionTypes.Binary)
+        self.assertAlmostEqual(variance, 0.5 * 0.5 / 10)
+
+    def test_chi_square_ignores_alternatives_without_participants(self):
+        alternatives = [Alternative(0, 1000, 100), Alternative(1, 1000, 130),
+                        Alternative(2, 1000, 105), Alternative(3, 0, 0)]
+        results = stats.analyze(alternatives, ConversionTypes.Binary)
+
+        self.assertEqual(results["degrees_of_freedom"], 2)
+        self.assertTrue("Across all 3 alternatives with participants" in results["description"])
+        self.assertTrue("with 2 degrees of freedom" in results["description"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Counts the RPCs gae_bingo makes while handling a problem attempt, before and
+after request-scoped buffering of participant/conversion counters.
+
+Three experiments shaped like the hints, struggling and suggested activity
+experiments each have a conversion per name in the bingo lists of
+attempt_problem. A simulated attempt participates in all of them, then
+scores those conversions. "before" uses the previous _find_alternative_for_user,
+which asked can_control_experiments() (a UserData query) on every call, and
+memcache.incr's every counter right away. "after" runs the attempt inside
+GAEBingoWSGIMiddleware, which buffers the counters and applies them with one
+memcache.offset_multi at the end of the request.
+
+Usage: python gae_bingo_benchmark.py [ATTEMPTS]
+
+The App Engine SDK has to be importable (e.g. on PYTHONPATH).
+"""
+
+import base64
+import cgi
+import collections
+import itertools
+import os
+import sys
+import time
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import testbed
+
+from gae_bingo import gae_bingo as bingo_module
+from gae_bingo import cache, middleware
+from gae_bingo.gae_bingo import ab_test, bingo
+from gae_bingo.config import can_control_experiments
+from gae_bingo.identity import flush_identity_cache, identity
+
+RPC_COUNTS = collections.Counter()
+IDENTITY_NUMBERS = itertools.count()
+
+
+def count_rpc(service, call, request, response):
+    RPC_COUNTS["%s.%s" % (service, call)] += 1
+
+
+# The previous implementation, kept here for comparison
+def legacy_find_alternative_for_user(experiment_hashable_name,
+                                     alternatives,
+                                     identity_val=None):
+
+    if can_control_experiments():
+        qs_dict = cgi.parse_qs(os.environ.get("QUERY_STRING") or "")
+
+        alternative_number_override = qs_dict.get("gae_bingo_alternative_number")
+        if alternative_number_override:
+
+            matches = filter(lambda alternative: alternative.number == int(alternative_number_override[0]), alternatives)
+            if len(matches) == 1:
+                return matches[0]
+
+    return bingo_module.modulo_choose(experiment_hashable_name, alternatives, identity(identity_val))
+
+
+EXPERIMENTS = {
+    "hints": ["hints_problems_done", "hints_wrong_problems",
+              "hints_keep_going_after_wrong", "hints_gained_new_proficiency"],
+    "struggling": ["struggling_problems_done", "struggling_problems_wrong",
+                   "struggling_struggled_binary",
+                   "struggling_gained_proficiency_post_struggling"],
+    "suggested_activity": ["suggested_activity_problems_done",
+                           "suggested_activity_problems_wrong"],
+}
+
+
+def attempt_problem():
+    for name, conversions in EXPERIMENTS.iteritems():
+        ab_test("%s benchmark" % name, conversion_name=conversions)
+
+    bingo([
+        "hints_problems_done",
+        "struggling_problems_done",
+        "suggested_activity_problems_done",
+    ])
+    bingo([
+        "hints_wrong_problems",
+        "struggling_problems_wrong",
+        "suggested_activity_problems_wrong",
+    ])
+    bingo("struggling_struggled_binary")
+
+
+def unbuffered_request(environ, start_response):
+    cache.flush_request_cache()
+    flush_identity_cache()
+    attempt_problem()
+    cache.store_if_dirty()
+    return []
+
+
+def buffered_request(environ, start_response):
+    attempt_problem()
+    start_response("200 OK", [])
+    return []
+buffered_request = middleware.GAEBingoWSGIMiddleware(buffered_request)
+
+
+def measure(app, attempts):
+    RPC_COUNTS.clear()
+    start = time.time()
+    for _ in xrange(attempts):
+        # A new identity every attempt, so every experiment is participated in
+        ident = "benchmark%d" % next(IDENTITY_NUMBERS)
+        os.environ["HTTP_COOKIE"] = "gae_b_id=%s" % base64.urlsafe_b64encode(ident)
+        list(app(dict(os.environ), lambda status, headers, exc_info=None: None))
+    return (time.time() - start) / attempts, RPC_COUNTS.copy()
+
+
+def main(attempts):
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    tb.init_user_stub()
+    tb.init_taskqueue_stub()
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append("count_rpc", count_rpc)
+
+    # Create the experiments outside of the measured attempts
+    measure(buffered_request, 1)
+
+    current = bingo_module._find_alternative_for_user
+    bingo_module._find_alternative_for_user = legacy_find_alternative_for_user
+    before = measure(unbuffered_request, attempts)
+    bingo_module._find_alternative_for_user = current
+    after = measure(buffered_request, attempts)
+
+    print "attempts: %d" % attempts
+    print "%-8s %8s %s" % ("", "ms", "RPCs per attempt")
+    for name, (secs, counts) in [("before", before), ("after", after)]:
+        rpcs = ", ".join("%s: %.1f" % (call, float(count) / attempts)
+                         for call, count in sorted(counts.iteritems()))
+        print "%-8s %8.2f %s" % (name, 1000 * secs, rpcs)
+
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
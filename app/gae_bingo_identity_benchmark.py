@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Measures how many identities BingoIdentityCache persistence loses, and how
+many memcache RPCs it makes, with concurrent writers.
+
+Every writer thread stores a dirty identity cache, the way store_if_dirty
+does at the end of a request. Every memcache RPC sleeps a random bit first
+so that writers interleave like concurrent instances would. Once all writers
+are done the cron job's persistence runs, then all deferred tasks, and we
+count the identities that made it into the datastore.
+
+"before" is the previous scheme, kept here for comparison: a memcache.get
+and set of a whole shared bucket list per identity (which concurrent writers
+overwrite) and a cron job that skipped the last of the 51 buckets. "after"
+is the current one, with a memcache.incr'd slot per identity.
+
+Usage: python gae_bingo_identity_benchmark.py [IDENTITIES] [THREADS]
+
+The App Engine SDK has to be importable (e.g. on PYTHONPATH).
+"""
+
+import base64
+import collections
+import hashlib
+import random
+import sys
+import threading
+import time
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+from google.appengine.ext import testbed
+
+from gae_bingo.cache import BingoIdentityCache, persist_gae_bingo_identity_records
+from gae_bingo.models import _GAEBingoIdentityRecord
+
+RPC_COUNTS = collections.Counter()
+
+
+def count_rpc(service, call, request, response):
+    if service == "memcache":
+        RPC_COUNTS[call] += 1
+        time.sleep(random.random() * 0.002)
+
+
+# The previous implementation, kept here for comparison
+def legacy_store_for_identity(identity_cache, ident):
+    memcache.set(BingoIdentityCache.key_for_identity(ident), identity_cache)
+
+    sig = hashlib.md5(str(ident)).hexdigest()
+    sig_num = int(sig, base=16)
+    bucket = sig_num % 51
+    key = "_gae_bingo_identity_bucket:%s" % bucket
+
+    list_identities = memcache.get(key) or []
+    list_identities.append(ident)
+
+    if len(list_identities) > 50:
+        deferred.defer(persist_gae_bingo_identity_records, list_identities)
+        memcache.set(key, [])
+    else:
+        memcache.set(key, list_identities)
+
+
+def legacy_persist_buckets_to_datastore():
+    dict_buckets = memcache.get_multi(["_gae_bingo_identity_bucket:%s" % bucket for bucket in range(0, 50)])
+
+    for key in dict_buckets:
+        if len(dict_buckets[key]) > 0:
+            deferred.defer(persist_gae_bingo_identity_records, dict_buckets[key])
+            memcache.set(key, [])
+
+
+def current_store_for_identity(identity_cache, ident):
+    identity_cache.store_for_identity_if_dirty(ident)
+
+
+def run_tasks(taskqueue_stub):
+    # Tasks may defer more tasks, so keep going until the queue is empty
+    while True:
+        tasks = taskqueue_stub.GetTasks("default")
+        if not tasks:
+            return
+        taskqueue_stub.FlushQueue("default")
+        for task in tasks:
+            deferred.run(base64.b64decode(task["body"]))
+
+
+def measure(tb, store_fxn, persist_fxn, num_identities, num_threads):
+    memcache.flush_all()
+    db.delete(_GAEBingoIdentityRecord.all(keys_only=True).fetch(None))
+
+    identities = ["benchmark%d" % i for i in xrange(num_identities)]
+
+    def writer(thread_identities):
+        for ident in thread_identities:
+            identity_cache = BingoIdentityCache()
+            identity_cache.participate_in("benchmark experiment")
+            store_fxn(identity_cache, ident)
+
+    RPC_COUNTS.clear()
+    start = time.time()
+
+    threads = [threading.Thread(target=writer, args=(identities[i::num_threads],))
+               for i in xrange(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    secs = time.time() - start
+    store_rpcs = sum(RPC_COUNTS.values())
+
+    persist_fxn()
+    run_tasks(tb.get_stub(testbed.TASKQUEUE_SERVICE_NAME))
+
+    persisted = _GAEBingoIdentityRecord.all().count(limit=None)
+    return secs, store_rpcs, RPC_COUNTS.copy(), num_identities - persisted
+
+
+def main(num_identities, num_threads):
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub()
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append("count_rpc", count_rpc)
+
+    print "identities: %d, threads: %d" % (num_identities, num_threads)
+    print "%-8s %8s %10s %10s  %s" % ("", "secs", "lost", "RPCs/id", "memcache calls")
+    for name, store_fxn, persist_fxn in [
+            ("before", legacy_store_for_identity, legacy_persist_buckets_to_datastore),
+            ("after", current_store_for_identity, BingoIdentityCache.persist_buckets_to_datastore)]:
+        secs, store_rpcs, counts, lost = measure(tb, store_fxn, persist_fxn,
+                                                 num_identities, num_threads)
+        calls = ", ".join("%s: %d" % item for item in sorted(counts.iteritems()))
+        print "%-8s %8.2f %9.1f%% %10.2f  %s" % (
+            name, secs, 100.0 * lost / num_identities,
+            float(store_rpcs) / num_identities, calls)
+
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 20)
@@ -1,4 +1,5 @@
 import os
+import random
 
 from google.appengine.api import lib_config
 
@@ -28,9 +29,42 @@ def _should_profile_development_default():
     Can be overridden in appengine_config.py"""
     return True
 
+def _cache_stats_default():
+    """Default to not reporting any instance cache statistics.
+
+    Can be overridden in appengine_config.py to return a dict with "hits",
+    "misses", "evictions", "bytes" and "max_bytes" keys."""
+    return None
+
+def _cache_key_stats_default():
+    """Default to not reporting any per-key cache statistics.
+
+    Can be overridden in appengine_config.py to return a list of dicts with
+    "family", "hits", "misses", "recomputes" and "recompute_ms" keys."""
+    return None
+
+def _background_sampling_fraction_default():
+    """Default to not sampling any production requests in the background.
+
+    Can be overridden in appengine_config.py to return the fraction of
+    production requests, e.g. 0.01, whose stacks are sampled and added up
+    for /gae_mini_profiler/samples."""
+    return 0.0
+
+def _background_samples_per_second_default():
+    """Default rate at which background sampled requests are sampled.
+
+    Can be overridden in appengine_config.py. See sampling_profiler_benchmark.py
+    for the overhead of different rates."""
+    return 50
+
 _config = lib_config.register("gae_mini_profiler", {
     "should_profile_production": _should_profile_production_default,
-    "should_profile_development": _should_profile_development_default})
+    "should_profile_development": _should_profile_development_default,
+    "cache_stats": _cache_stats_default,
+    "cache_key_stats": _cache_key_stats_default,
+    "background_sampling_fraction": _background_sampling_fraction_default,
+    "background_samples_per_second": _background_samples_per_second_default})
 
 def should_profile():
     """Returns true if the current request should be profiles."""
@@ -38,3 +72,23 @@ def should_profile():
         return _config.should_profile_development()
     else:
         return _config.should_profile_production()
+
+def should_sample_in_background():
+    """Returns true if the current request's stacks should be sampled in the
+    background. Only production requests are, since the dev server's
+    sampling only ever takes one sample."""
+    if os.environ["SERVER_SOFTWARE"].startswith("Devel"):
+        return False
+    return random.random() < _config.background_sampling_fraction()
+
+def background_samples_per_second():
+    return _config.background_samples_per_second()
+
+def cache_stats():
+    """Returns the app's instance cache statistics, if it reports any."""
+    return _config.cache_stats()
+
+def cache_key_stats():
+    """Returns the current request's per-key cache statistics, if the app
+    reports any."""
+    return _config.cache_key_stats()
@@ -7,6 +7,7 @@ application = webapp.WSGIApplication([
     ("/gae_mini_profiler/request/log", profiler.RequestLogHandler),
     ("/gae_mini_profiler/request", profiler.RequestStatsHandler),
     ("/gae_mini_profiler/shared", profiler.SharedStatsHandler),
+    ("/gae_mini_profiler/samples", profiler.BackgroundSamplesHandler),
 ])
 
 def main():
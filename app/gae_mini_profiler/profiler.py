@@ -232,12 +232,49 @@ class RequestStatsHandler(RequestHandler):
 
         self.response.out.write(json.dumps(list_request_stats))
 
+class BackgroundSamplesHandler(RequestHandler):
+    """Returns the stacks sampled in the background over the last few hours,
+    in the collapsed format flame graph tools read.
+
+    Accepts "hours", the number of hours to include (1 by default), and
+    "source", which adds each frame's line of source when set to 1.
+    """
+
+    def get(self):
+
+        if not config.should_profile():
+            self.error(403)
+            return
+
+        from gae_mini_profiler import sampling_profiler
+
+        try:
+            num_hours = max(1, min(int(self.request.get("hours") or 1), 24 * 7))
+        except ValueError:
+            num_hours = 1
+
+        now = datetime.datetime.utcnow()
+        hours = [now - datetime.timedelta(hours=i) for i in xrange(num_hours)]
+
+        stacks, total_samples = sampling_profiler.BackgroundSamples.get(hours)
+
+        self.response.headers["Content-Type"] = "text/plain"
+        self.response.headers["X-MiniProfiler-Total-Samples"] = str(total_samples)
+        self.response.out.write(sampling_profiler.BackgroundSamples.collapsed(
+                stacks, include_source=self.request.get("source") == "1"))
+
+
 class RequestStats(object):
 
     serialized_properties = ["request_id", "url", "url_short", "s_dt",
                              "profiler_results", "appstats_results", "mode",
                              "temporary_redirect", "logs",
-                             "logging_request_id"]
+                             "logging_request_id", "cache_stats",
+                             "cache_key_stats"]
+
+    # Stats stored before these were added don't have them
+    cache_stats = None
+    cache_key_stats = None
 
     def __init__(self, profiler, environ):
         # unique mini profiler request id
@@ -261,6 +298,8 @@ class RequestStats(object):
         self.profiler_results = profiler.profiler_results()
         self.appstats_results = profiler.appstats_results()
         self.logs = profiler.logs
+        self.cache_stats = config.cache_stats()
+        self.cache_key_stats = config.cache_key_stats()
 
         self.temporary_redirect = profiler.temporary_redirect
         self.disabled = False
@@ -491,9 +530,13 @@ class ProfilerWSGIMiddleware(object):
         CurrentRequestId.set(None)
 
         # Never profile calls to the profiler itself to avoid endless recursion.
-        if (not config.should_profile() or
-            environ.get("PATH_INFO", "").startswith("/gae_mini_profiler/")):
-            result = self.app(environ, start_response)
+        is_profiler_request = environ.get("PATH_INFO", "").startswith("/gae_mini_profiler/")
+
+        if is_profiler_request or not config.should_profile():
+            if not is_profiler_request and config.should_sample_in_background():
+                result = self.sample_in_background(environ, start_response)
+            else:
+                result = self.app(environ, start_response)
             for value in result:
                 yield value
         else:
@@ -547,6 +590,32 @@ class ProfilerWSGIMiddleware(object):
                 memcache.add = old_memcache_add
                 memcache.delete = old_memcache_delete
 
+    def sample_in_background(self, environ, start_response):
+        """Serve the request while sampling its stacks at a low rate, adding
+        them to the instance's background samples when it's done."""
+        from gae_mini_profiler import sampling_profiler
+        profile = sampling_profiler.Profile(
+                samples_per_second=config.background_samples_per_second())
+
+        try:
+            result = profile.run(lambda: self.app(environ, start_response))
+
+            # If we're dealing w/ a generator, sample all of the .next calls as well
+            if type(result) == GeneratorType:
+
+                while True:
+                    try:
+                        yield profile.run(result.next)
+                    except StopIteration:
+                        break
+
+            else:
+                for value in result:
+                    yield value
+
+        finally:
+            sampling_profiler.BackgroundSamples.record(profile)
+
     @staticmethod
     def headers_with_modified_redirect(environ, headers):
         """Return headers with redirects modified to include miniprofiler id.
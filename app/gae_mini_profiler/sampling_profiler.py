@@ -18,13 +18,24 @@ routines take a reasonable amount of time.)  It is better suited for answering
 the question, "Where is the time spent by my app?"
 """
 
+from __future__ import with_statement
+
 from collections import defaultdict
+import datetime
+import linecache
 import logging
 import os
 import sys
 import time
 import threading
-import traceback
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from google.appengine.api import memcache
 
 from gae_mini_profiler import util
 
@@ -34,10 +45,11 @@ class InspectingThread(threading.Thread):
     """Thread that periodically triggers profiler inspections."""
     SAMPLES_PER_SECOND = 250
 
-    def __init__(self, profile=None):
+    def __init__(self, profile=None, samples_per_second=SAMPLES_PER_SECOND):
         super(InspectingThread, self).__init__()
         self._stop_event = threading.Event()
         self.profile = profile
+        self.interval = 1.0 / samples_per_second
 
     def stop(self):
         """Stop this thread."""
@@ -59,25 +71,37 @@ class InspectingThread(threading.Thread):
             self.profile.take_sample()
 
             # ...then sleep and let it do some more work.
-            time.sleep(1.0 / InspectingThread.SAMPLES_PER_SECOND)
+            time.sleep(self.interval)
 
             # Only take one sample per thread if this is running on the
             # single-threaded dev server.
-            if _is_dev_server and len(self.profile.samples) > 0:
+            if _is_dev_server and self.profile.total_samples > 0:
                 break
 
 
-class ProfileSample(object):
-    """Single stack trace sample gathered during a periodic inspection."""
-    def __init__(self, stack):
-        self.stack_trace = traceback.extract_stack(stack)
+def frame_location(code, line_num):
+    """Return the (filename, line number, function name) of a sampled frame."""
+    return (code.co_filename, line_num, code.co_name)
 
 
 class Profile(object):
-    """Profiler that periodically inspects a request and logs stack traces."""
-    def __init__(self):
-        # All saved stack trace samples
-        self.samples = []
+    """Profiler that periodically inspects a request and counts its stacks.
+
+    Samples are kept as cheaply as possible: each stack is a tuple of
+    (code object id, line number) pairs, innermost frame first, and identical
+    stacks are just counted. Nothing is formatted, and no source is read,
+    until results() is asked for.
+    """
+    def __init__(self, samples_per_second=InspectingThread.SAMPLES_PER_SECOND):
+        # Number of times each distinct stack was sampled
+        self.stacks = defaultdict(int)
+        self.total_samples = 0
+
+        # Code objects by id, for every frame in self.stacks. Holding on to
+        # them also keeps their ids from being reused.
+        self.code_objects = {}
+
+        self.samples_per_second = samples_per_second
 
         # Thread id for the request thread currently being profiled
         self.current_request_thread_id = None
@@ -85,24 +109,47 @@ class Profile(object):
         # Thread that constantly waits, inspects, waits, inspect, ...
         self.inspecting_thread = None
 
+    def located_stacks(self):
+        """Return sample counts by stack, with each stack a tuple of
+        (filename, line number, function name) frames, outermost first."""
+        located_stacks = defaultdict(int)
+        locations = {}
+
+        for stack, count in self.stacks.iteritems():
+            located_stack = []
+            for frame in reversed(stack):
+                location = locations.get(frame)
+                if location is None:
+                    code_id, line_num = frame
+                    location = locations[frame] = frame_location(self.code_objects[code_id], line_num)
+                located_stack.append(location)
+            located_stacks[tuple(located_stack)] += count
+
+        return located_stacks
+
     def results(self):
         """Return sampling results in a dictionary for template context."""
         aggregated_calls = defaultdict(int)
-        total_samples = len(self.samples)
-
-        for sample in self.samples:
-            for filename, line_num, function_name, src in sample.stack_trace:
-                aggregated_calls["%s\n\n%s:%s (%s)" %
-                        (src, filename, line_num, function_name)] += 1
-
-        # Turn aggregated call samples into dictionary of results
-        calls = [{
-            "func_desc": item[0],
-            "func_desc_short": util.short_method_fmt(item[0]),
-            "count_samples": item[1],
-            "per_samples": "%s%%" % util.decimal_fmt(
-                100.0 * item[1] / total_samples),
-            } for item in aggregated_calls.items()]
+        total_samples = self.total_samples
+
+        for stack, count in self.located_stacks().iteritems():
+            for filename, line_num, function_name in stack:
+                aggregated_calls[(filename, line_num, function_name)] += count
+
+        # Turn aggregated call samples into dictionary of results, only now
+        # looking up the source of each line
+        calls = []
+        for (filename, line_num, function_name), count_samples in aggregated_calls.iteritems():
+            func_desc = "%s\n\n%s:%s (%s)" % (
+                    linecache.getline(filename, line_num).strip(),
+                    filename, line_num, function_name)
+            calls.append({
+                "func_desc": func_desc,
+                "func_desc_short": util.short_method_fmt(func_desc),
+                "count_samples": count_samples,
+                "per_samples": "%s%%" % util.decimal_fmt(
+                    100.0 * count_samples / total_samples),
+                })
 
         # Sort call sample results by # of times calls appeared in a sample
         calls = sorted(calls, reverse=True,
@@ -147,8 +194,25 @@ class Profile(object):
                 should_sample = thread_id == self.current_request_thread_id
 
             if should_sample:
-                # Grab a sample of this thread's current stack
-                self.samples.append(ProfileSample(stack))
+                # Count this thread's current stack
+                self.record_stack(stack)
+
+    def record_stack(self, frame):
+        code_objects = self.code_objects
+        stack = []
+
+        while frame is not None:
+            code = frame.f_code
+            # Code objects hash slowly (they hash their constants, including
+            # any nested code objects), so frames are keyed by id instead
+            code_id = id(code)
+            if code_id not in code_objects:
+                code_objects[code_id] = code
+            stack.append((code_id, frame.f_lineno))
+            frame = frame.f_back
+
+        self.stacks[tuple(stack)] += 1
+        self.total_samples += 1
 
     def run(self, fxn):
         """Run function with samping profiler enabled, saving results."""
@@ -163,7 +227,8 @@ class Profile(object):
 
         # Start the thread that will be periodically inspecting the frame
         # stack of this current request thread
-        self.inspecting_thread = InspectingThread(profile=self)
+        self.inspecting_thread = InspectingThread(profile=self,
+                samples_per_second=self.samples_per_second)
         self.inspecting_thread.start()
 
         try:
@@ -174,3 +239,130 @@ class Profile(object):
             # Stop and clear the inspecting thread
             self.inspecting_thread.stop()
             self.inspecting_thread = None
+
+
+class BackgroundSamples(object):
+    """Stack samples aggregated across many requests, for flame graphs.
+
+    A fraction of production requests (see config.should_sample_in_background)
+    is sampled at a low rate. Each instance adds those requests' stacks up
+    and, every FLUSH_INTERVAL_SECS, merges its totals into the current hour's
+    totals in memcache. Stacks are stored as (filename, line number, function
+    name) frames, outermost first, so they can be merged across instances;
+    source lines are only looked up when a report asks for them.
+    """
+
+    FLUSH_INTERVAL_SECS = 60
+
+    # Only the most sampled stacks of an hour are kept, to stay well under
+    # memcache's 1MB limit
+    MAX_STACKS = 5000
+
+    # Hours of samples kept
+    EXPIRATION_SECS = 7 * 24 * 60 * 60
+
+    CAS_RETRIES = 5
+
+    _lock = threading.Lock()
+    _stacks = defaultdict(int)
+    _total_samples = 0
+    _last_flush = time.time()
+
+    @staticmethod
+    def memcache_key(hour):
+        return "__gae_mini_profiler_background_samples_%s" % hour.strftime("%Y-%m-%d-%H")
+
+    @staticmethod
+    def record(profile):
+        """Add a finished background Profile's samples to this instance's
+        totals, and flush them if it's time."""
+        located_stacks = profile.located_stacks()
+
+        with BackgroundSamples._lock:
+            for stack, count in located_stacks.iteritems():
+                BackgroundSamples._stacks[stack] += count
+            BackgroundSamples._total_samples += profile.total_samples
+
+            if time.time() - BackgroundSamples._last_flush < BackgroundSamples.FLUSH_INTERVAL_SECS:
+                return
+
+            stacks, total_samples = BackgroundSamples._stacks, BackgroundSamples._total_samples
+            BackgroundSamples._stacks = defaultdict(int)
+            BackgroundSamples._total_samples = 0
+            BackgroundSamples._last_flush = time.time()
+
+        try:
+            BackgroundSamples.merge_into_memcache(stacks, total_samples)
+        except Exception, e:
+            # Background samples are best effort; never fail a request over them
+            logging.warning("Dropping background profiler samples: %s" % e)
+
+    @staticmethod
+    def dumps(stacks, total_samples):
+        return zlib.compress(pickle.dumps((dict(stacks), total_samples), pickle.HIGHEST_PROTOCOL))
+
+    @staticmethod
+    def loads(value):
+        return pickle.loads(zlib.decompress(value))
+
+    @staticmethod
+    def merge_into_memcache(stacks, total_samples):
+        key = BackgroundSamples.memcache_key(datetime.datetime.utcnow())
+        client = memcache.Client()
+
+        for _ in xrange(BackgroundSamples.CAS_RETRIES):
+            value = client.gets(key)
+
+            if value is None:
+                if client.add(key, BackgroundSamples.dumps(stacks, total_samples),
+                              time=BackgroundSamples.EXPIRATION_SECS):
+                    return
+                continue
+
+            stored_stacks, stored_total_samples = BackgroundSamples.loads(value)
+            for stack, count in stacks.iteritems():
+                stored_stacks[stack] = stored_stacks.get(stack, 0) + count
+
+            if len(stored_stacks) > BackgroundSamples.MAX_STACKS:
+                stored_stacks = dict(sorted(stored_stacks.iteritems(),
+                        key=lambda item: item[1], reverse=True)[:BackgroundSamples.MAX_STACKS])
+
+            if client.cas(key, BackgroundSamples.dumps(stored_stacks, stored_total_samples + total_samples),
+                          time=BackgroundSamples.EXPIRATION_SECS):
+                return
+
+        logging.warning("Couldn't merge background profiler samples after %s tries" % BackgroundSamples.CAS_RETRIES)
+
+    @staticmethod
+    def get(hours):
+        """Return (sample counts by stack, total samples) for hours, a list of
+        datetimes."""
+        values = memcache.get_multi([BackgroundSamples.memcache_key(hour) for hour in hours])
+
+        stacks = defaultdict(int)
+        total_samples = 0
+        for value in values.itervalues():
+            hour_stacks, hour_total_samples = BackgroundSamples.loads(value)
+            for stack, count in hour_stacks.iteritems():
+                stacks[stack] += count
+            total_samples += hour_total_samples
+
+        return stacks, total_samples
+
+    @staticmethod
+    def collapsed(stacks, include_source=False):
+        """Return stacks in the "collapsed" format that flame graph tools like
+        flamegraph.pl read: one line per stack, its frames separated by
+        semicolons, followed by its count."""
+        lines = []
+        for stack, count in sorted(stacks.iteritems(), key=lambda item: item[1], reverse=True):
+            frames = []
+            for filename, line_num, function_name in stack:
+                frame = "%s (%s:%s)" % (function_name, filename, line_num)
+                source = include_source and linecache.getline(filename, line_num).strip()
+                if source:
+                    frame += " %s" % source
+                # Semicolons separate frames
+                frames.append(frame.replace(";", ","))
+            lines.append("%s %s" % (";".join(frames), count))
+        return "\n".join(lines)
@@ -1,7 +1,6 @@
 import logging
 
-from gandalf.cache import GandalfCache
-from gandalf.config import current_logged_in_identity
+from gandalf.cache import GandalfCache, request_identity, request_results
 
 def gandalf(bridge_name):
 
@@ -10,30 +9,27 @@ def gandalf(bridge_name):
 
     gandalf_cache = GandalfCache.get()
 
-    bridge = gandalf_cache.get_bridge_model(bridge_name)
+    bridge = gandalf_cache.get_compiled_bridge(bridge_name)
 
     if not bridge:
         logging.error("User tried to cross bridge '%s', which does not exist" % bridge_name)
         return False
 
-    filters = gandalf_cache.get_filter_models(bridge_name)
-
-    identity = current_logged_in_identity()
+    identity, identity_string = request_identity()
 
     # Currently do not support users with no identity
     if not identity:
         return False
 
-    # A user needs to pass a single whitelist, and pass no blacklists, to pass a bridge
-    passes_a_whitelist = False
+    results = request_results()
+    key = (bridge_name, identity_string)
+
+    if results is not None and key in results:
+        return results[key]
 
-    for filter in filters:
-        if filter.whitelist:
-            if filter.filter_class.passes_filter(filter, identity):
-                passes_a_whitelist = True
-        else:
-            if filter.filter_class.passes_filter(filter, identity):
-                return False
+    passes = bridge.passes(identity, identity_string)
 
-    return passes_a_whitelist
+    if results is not None:
+        results[key] = passes
 
+    return passes
@@ -1,22 +1,60 @@
+import time
+
 from google.appengine.ext import db
 from google.appengine.datastore import entity_pb
 from google.appengine.api import memcache
 
 from gandalf.models import GandalfBridge
-_request_cache = {}
+from gandalf.filters import CompiledBridge
+from gandalf.config import current_logged_in_identity, identity_string
 
-def flush_request_cache():
+# Per-request values, like the cache version and the results of crossing
+# bridges. None outside of requests handled by GandalfWSGIMiddleware, where
+# nothing is cached per request.
+_request_cache = None
+
+# The GandalfCache of the latest version seen by this instance, with its
+# bridges compiled, kept for as long as the version stamp doesn't change
+_instance_cache = {}
+
+def start_request_cache():
     global _request_cache
     _request_cache = {}
 
-def init_request_cache_from_memcache():
-    if not _request_cache.get("loaded_from_memcache"):
-        _request_cache[GandalfCache.MEMCACHE_KEY] = memcache.get(GandalfCache.MEMCACHE_KEY)
-        _request_cache["loaded_from_memcache"] = True
+def flush_request_cache():
+    global _request_cache
+    _request_cache = None
+
+def request_identity():
+    """ Returns the current identity and its string, looked up once per
+    request """
+    if _request_cache is not None and "identity" in _request_cache:
+        return _request_cache["identity"]
+
+    identity = current_logged_in_identity()
+    value = (identity, identity_string(identity) if identity else None)
+
+    if _request_cache is not None:
+        _request_cache["identity"] = value
+
+    return value
+
+def request_results():
+    """ Returns this request's dict of (bridge name, identity string) ->
+    whether the identity crossed the bridge, or None outside of requests """
+    if _request_cache is None:
+        return None
+
+    return _request_cache.setdefault("results", {})
 
 class GandalfCache(object):
 
-    MEMCACHE_KEY = "_gandalf_cache"
+    MEMCACHE_KEY = "_gandalf_cache:%s"
+
+    # Bumped whenever a bridge or filter changes. Every version's cache has
+    # its own memcache key, so instances notice changes by reading this one
+    # small value, once per request, and old versions simply expire.
+    VERSION_MEMCACHE_KEY = "_gandalf_cache_version"
 
     def __init__(self):
 
@@ -26,17 +64,60 @@ class GandalfCache(object):
         self.filters = {} # Protobuf version of filters for extremely fast (de)serialization
         self.filter_models = {} # Deserialized filter models
 
+        self.compiled_bridges = {} # CompiledBridges, built from the deserialized models
+
+    def __getstate__(self):
+        # Only the protobufs go to memcache
+        return {"bridges": self.bridges, "filters": self.filters}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.bridges = state["bridges"]
+        self.filters = state["filters"]
+
+    @staticmethod
+    def key_for_version(version):
+        return GandalfCache.MEMCACHE_KEY % version
+
+    @staticmethod
+    def current_version():
+        if _request_cache is not None and "version" in _request_cache:
+            return _request_cache["version"]
+
+        version = memcache.get(GandalfCache.VERSION_MEMCACHE_KEY)
+
+        if version is None:
+            # Start a new version that can't collide with any this stamp had
+            # before it was evicted
+            memcache.add(GandalfCache.VERSION_MEMCACHE_KEY, long(time.time() * 1000))
+            version = memcache.get(GandalfCache.VERSION_MEMCACHE_KEY)
+
+        if _request_cache is not None:
+            _request_cache["version"] = version
+
+        return version
+
     @staticmethod
     def get():
-        init_request_cache_from_memcache()
+        global _instance_cache
+
+        version = GandalfCache.current_version()
+
+        if version is None or _instance_cache.get("version") != version:
+
+            gandalf_cache = None
+            if version is not None:
+                gandalf_cache = memcache.get(GandalfCache.key_for_version(version))
 
-        if not _request_cache.get(GandalfCache.MEMCACHE_KEY):
-            _request_cache[GandalfCache.MEMCACHE_KEY] = GandalfCache.load_from_datastore()
+            if not gandalf_cache:
+                gandalf_cache = GandalfCache.load_from_datastore(version)
 
-        return _request_cache[GandalfCache.MEMCACHE_KEY]
+            _instance_cache = {"version": version, "cache": gandalf_cache}
+
+        return _instance_cache["cache"]
 
     @staticmethod
-    def load_from_datastore():
+    def load_from_datastore(version=None):
         gandalf_cache = GandalfCache()
 
         bridges = GandalfBridge.all()
@@ -54,24 +135,47 @@ class GandalfCache(object):
             for filter in filters:
                 gandalf_cache.filters[key].append(db.model_to_protobuf(filter).Encode())
 
-        memcache.set(GandalfCache.MEMCACHE_KEY, gandalf_cache)
+        if version is not None:
+            memcache.set(GandalfCache.key_for_version(version), gandalf_cache)
 
         return gandalf_cache
 
     @staticmethod
-    def delete_from_memcache():
-        memcache.delete(GandalfCache.MEMCACHE_KEY)
+    def invalidate():
+        # Move every instance on to a new version. If the stamp can't be
+        # incremented, e.g. because it was evicted, deleting it makes the
+        # next reader start a new one.
+        if memcache.incr(GandalfCache.VERSION_MEMCACHE_KEY) is None:
+            memcache.delete(GandalfCache.VERSION_MEMCACHE_KEY)
+
+        # And make sure the rest of this request sees the change, too
+        if _request_cache is not None:
+            _request_cache.pop("version", None)
+            _request_cache.pop("results", None)
 
     def get_bridge_model(self, bridge_name):
-        if bridge_name in self.bridges:
-            return self.bridge_models.setdefault(bridge_name,
-                db.model_from_protobuf(entity_pb.EntityProto(self.bridges[bridge_name])))
-        else:
+        if bridge_name not in self.bridges:
             return None
 
+        if bridge_name not in self.bridge_models:
+            self.bridge_models[bridge_name] = db.model_from_protobuf(entity_pb.EntityProto(self.bridges[bridge_name]))
+
+        return self.bridge_models[bridge_name]
+
     def get_filter_models(self, bridge_name):
-        if bridge_name in self.filters:
-            return self.filter_models.setdefault(bridge_name,
-                [db.model_from_protobuf(entity_pb.EntityProto(filter)) for filter in self.filters[bridge_name]])
-        else:
+        if bridge_name not in self.filters:
             return None
+
+        if bridge_name not in self.filter_models:
+            self.filter_models[bridge_name] = [db.model_from_protobuf(entity_pb.EntityProto(filter)) for filter in self.filters[bridge_name]]
+
+        return self.filter_models[bridge_name]
+
+    def get_compiled_bridge(self, bridge_name):
+        if bridge_name not in self.bridges:
+            return None
+
+        if bridge_name not in self.compiled_bridges:
+            self.compiled_bridges[bridge_name] = CompiledBridge(self.get_filter_models(bridge_name) or [])
+
+        return self.compiled_bridges[bridge_name]
@@ -29,8 +29,9 @@ def current_logged_in_identity():
     return UserData.current(bust_cache=True)
 
 def current_logged_in_identity_string():
-    identity = current_logged_in_identity()
+    return identity_string(current_logged_in_identity())
 
+def identity_string(identity):
     if not identity:
         return None
 
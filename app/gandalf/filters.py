@@ -20,7 +20,11 @@ class BridgeFilter(object):
 
     @staticmethod
     def _identity_percentage(key):
-        sig = hashlib.md5(str(key) + current_logged_in_identity_string()).hexdigest()
+        return BridgeFilter.identity_percentage(str(key), current_logged_in_identity_string())
+
+    @staticmethod
+    def identity_percentage(key_string, identity_string):
+        sig = hashlib.md5(key_string + identity_string).hexdigest()
         return int(sig, base=16) % 100
 
     @staticmethod
@@ -57,6 +61,53 @@ class BridgeFilter(object):
         return html
 
 
+class CompiledBridge(object):
+    """ A bridge's filters, reduced to what's needed to evaluate them.
+
+    Built once per version of the GandalfCache and shared by every request
+    on the instance, so it's never modified after construction.
+    """
+    __slots__ = ("whitelists", "blacklists")
+
+    def __init__(self, filters):
+        whitelists = []
+        blacklists = []
+
+        for filter in filters:
+            compiled = (filter.filter_class._matches, filter.context, filter.percentage, str(filter.key()))
+
+            if filter.whitelist:
+                whitelists.append(compiled)
+            else:
+                blacklists.append(compiled)
+
+        self.whitelists = tuple(whitelists)
+        self.blacklists = tuple(blacklists)
+
+    @staticmethod
+    def _passes(compiled, identity, identity_string):
+        matches, context, percentage, key_string = compiled
+
+        # Skip hashing the identity for filters that let everyone or no one
+        # through, which most do
+        if percentage <= 0 or not matches(context, identity):
+            return False
+
+        return percentage >= 100 or percentage > BridgeFilter.identity_percentage(key_string, identity_string)
+
+    def passes(self, identity, identity_string):
+        # A user needs to pass a single whitelist, and pass no blacklists, to pass a bridge
+        for compiled in self.blacklists:
+            if CompiledBridge._passes(compiled, identity, identity_string):
+                return False
+
+        for compiled in self.whitelists:
+            if CompiledBridge._passes(compiled, identity, identity_string):
+                return True
+
+        return False
+
+
 class IsDeveloperFilter(BridgeFilter):
     name = "is-developer"
 
@@ -1,4 +1,4 @@
-from gandalf.cache import flush_request_cache
+from gandalf.cache import start_request_cache, flush_request_cache
 
 
 class GandalfWSGIMiddleware(object):
@@ -9,8 +9,13 @@ class GandalfWSGIMiddleware(object):
     def __call__(self, environ, start_response):
 
         # Make sure request-cached values are cleared at start of request
-        flush_request_cache()
+        start_request_cache()
 
-        result = self.app(environ, start_response)
-        for value in result:
-            yield value
+        try:
+            result = self.app(environ, start_response)
+            for value in result:
+                yield value
+
+        finally:
+            # Nothing's cached per request outside of requests
+            flush_request_cache()
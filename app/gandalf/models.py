@@ -11,12 +11,12 @@ class GandalfBridge(db.Model):
     def put(self, **kwargs):
         super(GandalfBridge, self).put(**kwargs)
         from gandalf.cache import GandalfCache
-        GandalfCache.delete_from_memcache()
+        GandalfCache.invalidate()
 
     def delete(self, **kwargs):
         super(GandalfBridge, self).delete(**kwargs)
         from gandalf.cache import GandalfCache
-        GandalfCache.delete_from_memcache()
+        GandalfCache.invalidate()
 
     @property
     def status(self):
@@ -38,12 +38,12 @@ class GandalfFilter(db.Model):
     def put(self, **kwargs):
         from gandalf.cache import GandalfCache
         super(GandalfFilter, self).put(**kwargs)
-        GandalfCache.delete_from_memcache()
+        GandalfCache.invalidate()
 
     def delete(self, **kwargs):
         super(GandalfFilter, self).delete(**kwargs)
         from gandalf.cache import GandalfCache
-        GandalfCache.delete_from_memcache()
+        GandalfCache.invalidate()
 
     @property
     def filter_class(self):
@@ -4,12 +4,18 @@ import cloudstorage as gcs
 
 import datetime
 import logging
+import math
 import pickle
+import random
+import struct
+import time
+import zlib
 
 from google.appengine.api import memcache
 from google.appengine.ext import db
 
 from app import App
+import cache_key_stats
 import request_cache
 
 BLOBCACHE_BUCKET = "hebkhan.appspot.com"
@@ -96,6 +102,23 @@ else:
 # If key has expired or is no longer in the current cache and throws an error when trying to be recomputed, then try getting resource from permanent key that is not set to expire
 # @layer_cache.cache(... expiration=60, permanent_cache_key = lambda object: "permanent_layer_cache_key_for_object_%s" % object.id())
 #
+# Look up many keys at once, with one round trip per layer and one call to
+# the target for all of the misses. The target takes a list of items and
+# returns a list of results in the same order; key_fxn maps one item to its
+# key:
+#
+# @layer_cache.cache_multi(lambda user_data: "user_summary_%s" % user_data.key_email)
+# def user_summaries(user_datas):
+#   ... compute summaries for all of user_datas at once...
+#   return summaries
+#
+# user_summaries(user_datas) # -> a list with one summary per user_data
+#
+# Protect an expensive, hot key from stampedes when it expires: only one caller
+# at a time recomputes it while everyone else is served the previous value, and
+# callers may refresh it a little before it expires:
+# @layer_cache.cache(... stampede_protection=layer_cache.StampedeProtection())
+#
 # _____Disabling:_____
 #
 # You can disable layer_cache for the rest of the request by calling:
@@ -122,16 +145,78 @@ def enable():
 def is_disabled():
     return request_cache.get("layer_cache_disabled") or False
 
+class StampedeProtection(object):
+    """ Opt-in protection against many callers recomputing the same expired
+    key at once. Only applies to keys cached in memcache.
+
+    lease_secs: how long the one caller allowed to recompute a key holds its
+        memcache lease before another caller may try.
+    stale_secs: how long after expiration the previous value is kept around
+        and served while the key is being recomputed.
+    early_refresh_beta: how eagerly callers refresh a key before it expires,
+        scaled by how long the last recompute took. 0 disables early refresh.
+    wait_secs: how long a caller that finds neither a value nor the lease
+        polls memcache for the lease holder's result before recomputing
+        anyway.
+    """
+
+    POLL_INTERVAL_SECS = 0.1
+
+    def __init__(self, lease_secs=30, stale_secs=60 * 60, early_refresh_beta=1.0, wait_secs=5):
+        self.lease_secs = lease_secs
+        self.stale_secs = stale_secs
+        self.early_refresh_beta = early_refresh_beta
+        self.wait_secs = wait_secs
+
+    @staticmethod
+    def lease_key(key):
+        return "__layer_cache_lease_%s" % key
+
+    def acquire_lease(self, key, namespace):
+        return memcache.add(StampedeProtection.lease_key(key), True,
+                            time=self.lease_secs, namespace=namespace)
+
+    def release_lease(self, key, namespace):
+        memcache.delete(StampedeProtection.lease_key(key), namespace=namespace)
+
+    def memcache_time(self, expiration):
+        if not expiration:
+            return expiration
+        return expiration + self.stale_secs
+
+    def should_refresh(self, envelope, now):
+        """ Probabilistic early refresh: the closer a value is to expiring,
+        and the longer it took to compute, the likelier a caller is to
+        refresh it early. See "Optimal Probabilistic Cache Stampede
+        Prevention" (Vattani, Chierichetti, Lowenstein).
+        """
+        if envelope.expires_at is None:
+            return False
+        early_secs = 0
+        if self.early_refresh_beta:
+            early_secs = -envelope.recompute_secs * self.early_refresh_beta * math.log(1.0 - random.random())
+        return now + early_secs >= envelope.expires_at
+
+class StampedeEnvelope(object):
+    """ What a stampede-protected key stores in memcache: the value plus when
+    it goes stale and how long it took to compute. """
+
+    def __init__(self, value, expires_at, recompute_secs):
+        self.value = value
+        self.expires_at = expires_at
+        self.recompute_secs = recompute_secs
+
 def cache(
         expiration = DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS,
         layer = Layers.Memcache | Layers.InAppMemory,
         persist_across_app_versions = False,
         bigdata = False,
+        stampede_protection = None,
         ):
     def decorator(target):
         key = "__layer_cache_%s.%s__" % (target.__module__, target.__name__)
         def wrapper(*args, **kwargs):
-            return layer_cache_check_set_return(target, lambda *args, **kwargs: key, expiration, layer, persist_across_app_versions, None, bigdata, *args, **kwargs)
+            return layer_cache_check_set_return(target, lambda *args, **kwargs: key, expiration, layer, persist_across_app_versions, None, bigdata, stampede_protection, *args, **kwargs)
         return wrapper
     return decorator
 
@@ -142,31 +227,105 @@ def cache_with_key_fxn(
         persist_across_app_versions = False,
         permanent_key_fxn = None,
         bigdata = False,
+        stampede_protection = None,
         ):
     def decorator(target):
         def wrapper(*args, **kwargs):
-            return layer_cache_check_set_return(target, key_fxn, expiration, layer, persist_across_app_versions, permanent_key_fxn, bigdata, *args, **kwargs)
+            return layer_cache_check_set_return(target, key_fxn, expiration, layer, persist_across_app_versions, permanent_key_fxn, bigdata, stampede_protection, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def cache_multi(
+        key_fxn,
+        expiration = DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS,
+        layer = Layers.Memcache | Layers.InAppMemory,
+        persist_across_app_versions = False,
+        ):
+    def decorator(target):
+        def wrapper(items, bust_cache=False):
+            return layer_cache_check_set_return_multi(target, key_fxn, expiration, layer, persist_across_app_versions, items, bust_cache)
         return wrapper
     return decorator
 
 import cPickle
-def big_memcache_set(key, value, chunksize=950000, **kw):
-    serialized = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
-    size = len(serialized)
-    if size//chunksize>32:
-        raise Exception("value is way too big for memcache (%s)", size)
-    values = {}
-    for i, offset in enumerate(xrange(0, size, chunksize)):
-        values[str(i)] = serialized[offset:offset+chunksize]
-    not_set = memcache.set_multi(values, key_prefix=key, **kw)
-    return not not_set # an empty list means success
+
+# Values too big for a single memcache entry are pickled, compressed and
+# split into chunks. The value's own key holds a manifest:
+#
+#     (BIG_MEMCACHE_MAGIC, generation, chunk count, compressed length, crc32)
+#
+# and chunk i is stored under "<key>:<generation>:<i>". Each set picks a new
+# generation, so a reader can never mix chunks from two different sets, and
+# only the chunks the manifest lists are fetched. If any of them was evicted,
+# or the data doesn't match the manifest, the value is a clean miss. Values
+# that compress down to a single chunk are stored inline in the manifest and
+# cost a single get.
+BIG_MEMCACHE_MAGIC = "bmc1"
+BIG_MEMCACHE_CHUNK_SIZE = 950000
+BIG_MEMCACHE_COMPRESSION_LEVEL = 6
+
+def big_memcache_chunk_key(key, generation, i):
+    return "%s:%s:%d" % (key, generation, i)
+
+def big_memcache_pack(value, chunksize=BIG_MEMCACHE_CHUNK_SIZE):
+    """ Returns (manifest, chunks) for value. """
+    compressed = zlib.compress(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL),
+                               BIG_MEMCACHE_COMPRESSION_LEVEL)
+    size = len(compressed)
+    crc = zlib.crc32(compressed) & 0xffffffff
+
+    if size <= chunksize:
+        return (BIG_MEMCACHE_MAGIC, None, 0, size, crc, compressed), []
+
+    generation = "%x" % random.getrandbits(32)
+    chunks = [compressed[offset:offset + chunksize]
+              for offset in xrange(0, size, chunksize)]
+    return (BIG_MEMCACHE_MAGIC, generation, len(chunks), size, crc), chunks
+
+def big_memcache_unpack(manifest, chunks):
+    """ Returns the value, or None if chunks don't match the manifest. """
+    size, crc = manifest[3], manifest[4]
+    compressed = "".join(chunks)
+    if len(compressed) != size or zlib.crc32(compressed) & 0xffffffff != crc:
+        return None
+    return cPickle.loads(zlib.decompress(compressed))
+
+def big_memcache_set(key, value, chunksize=BIG_MEMCACHE_CHUNK_SIZE, **kw):
+    manifest, chunks = big_memcache_pack(value, chunksize)
+
+    if chunks:
+        generation = manifest[1]
+        mapping = dict((big_memcache_chunk_key(key, generation, i), chunk)
+                       for i, chunk in enumerate(chunks))
+        if memcache.set_multi(mapping, **kw):
+            # Some chunks weren't stored, so don't publish a manifest for them
+            return False
+
+    # The manifest goes last, so readers never see it before its chunks
+    return memcache.set(key, manifest, **kw)
 
 def big_memcache_get(key, **kw):
-    result = memcache.get_multi([str(i) for i in xrange(32)], key_prefix=key, **kw).items()
-    result.sort()
-    serialized = ''.join([v for (k,v) in result if v is not None])
-    if serialized:
-        return cPickle.loads(serialized)
+    manifest = memcache.get(key, **kw)
+    if not (isinstance(manifest, tuple) and manifest and manifest[0] == BIG_MEMCACHE_MAGIC):
+        return None
+
+    magic, generation, num_chunks = manifest[:3]
+    if not num_chunks:
+        chunks = [manifest[5]]
+    else:
+        chunk_keys = [big_memcache_chunk_key(key, generation, i)
+                      for i in xrange(num_chunks)]
+        found = memcache.get_multi(chunk_keys, **kw)
+        if len(found) != num_chunks:
+            logging.info("big_memcache value %s lost %d of %d chunks" %
+                         (key, num_chunks - len(found), num_chunks))
+            return None
+        chunks = [found[chunk_key] for chunk_key in chunk_keys]
+
+    value = big_memcache_unpack(manifest, chunks)
+    if value is None:
+        logging.warning("big_memcache value %s doesn't match its manifest" % key)
+    return value
 
 def layer_cache_check_set_return(
         target,
@@ -176,6 +335,7 @@ def layer_cache_check_set_return(
         persist_across_app_versions = False,
         permanent_key_fxn = None,
         bigdata = False,
+        stampede_protection = None,
         *args,
         **kwargs):
 
@@ -186,16 +346,22 @@ def layer_cache_check_set_return(
         get_from_memcache = memcache.get
         set_to_memcache = memcache.set
 
+    stats_family = cache_key_stats.family(target)
+
     def get_cached_result(key, namespace, expiration, layer):
 
         if layer & Layers.InAppMemory:
             result = cachepy.get(key)
             if result is not None:
+                cache_key_stats.record_hit(stats_family, "InAppMemory")
                 return result
 
         if layer & Layers.Memcache:
             result = get_from_memcache(key, namespace=namespace)
+            if isinstance(result, StampedeEnvelope):
+                result = result.value
             if result is not None:
+                cache_key_stats.record_hit(stats_family, "Memcache")
                 # Found in memcache, fill upward layers
                 if layer & Layers.InAppMemory:
                     cachepy.set(key, result, expiry=expiration)
@@ -204,6 +370,7 @@ def layer_cache_check_set_return(
         if layer & Layers.Datastore:
             result = KeyValueCache.get(key, namespace=namespace)
             if result is not None:
+                cache_key_stats.record_hit(stats_family, "Datastore")
                 # Found in datastore, fill upward layers
                 if layer & Layers.InAppMemory:
                     cachepy.set(key, result, expiry=expiration)
@@ -212,18 +379,38 @@ def layer_cache_check_set_return(
                 return result
 
         if layer & Layers.Blobstore:
-            result = BlobCache.get(key, namespace=namespace)
-            # TODO: fill upward layers if size of dumped result is going to be less than 1MB (might be too costly to figure that out
+            result, pickled_size = BlobCache.get_with_size(key, namespace=namespace)
+            if result is not None:
+                cache_key_stats.record_hit(stats_family, "Blobstore")
+                # Found in Cloud Storage, fill upward layers. cachepy has its
+                # own per-item cap, but memcache is only filled when the
+                # value's pickled size says it fits.
+                if layer & Layers.InAppMemory:
+                    cachepy.set(key, result, expiry=expiration)
+                fits = (pickled_size is not None and
+                        pickled_size <= BlobCache.MEMCACHE_FILL_MAX_BYTES)
+                if (fits or bigdata) and layer & Layers.Memcache:
+                    try:
+                        set_to_memcache(key, result, time=expiration, namespace=namespace)
+                    except Exception, e:
+                        # Too big for memcache after all
+                        logging.warning("Couldn't fill memcache for %s: %s" % (key, e))
             return result
 
 
-    def set_cached_result(key, namespace, expiration, layer, result):
+    def set_cached_result(key, namespace, expiration, layer, result, recompute_secs=0):
         # Cache the result
         if layer & Layers.InAppMemory:
             cachepy.set(key, result, expiry=expiration)
 
         if layer & Layers.Memcache:
-            if not set_to_memcache(key, result, time=expiration, namespace=namespace):
+            value, memcache_time = result, expiration
+            if stampede_protection:
+                expires_at = time.time() + expiration if expiration else None
+                value = StampedeEnvelope(result, expires_at, recompute_secs)
+                memcache_time = stampede_protection.memcache_time(expiration)
+
+            if not set_to_memcache(key, value, time=memcache_time, namespace=namespace):
                 logging.error("Memcache set failed for %s" % key)
 
         if layer & Layers.Datastore:
@@ -245,62 +432,241 @@ def layer_cache_check_set_return(
     if key is None or request_cache.get("layer_cache_disabled"):
         return target(*args, **kwargs)
 
+    if bust_cache:
+        cache_key_stats.record_bust(stats_family)
+
     namespace = App.version
 
     if persist_across_app_versions:
         namespace = None
 
-    if not bust_cache:
-        try:
-            result = get_cached_result(key, namespace, expiration, layer)
-        except IOError:
-            logging.exception("Exception loading from %s cache", key)
-            result = None
-        if result is not None:
-            return result
+    # The previous value of a stampede-protected key, which is served if the
+    # key can't be recomputed right now
+    stale_result = None
+    holds_lease = False
+    leased_key = key
 
+    # Whoever holds the lease gives it back however this call ends, so
+    # nobody else is left polling for wait_secs
     try:
-        result = target(*args, **kwargs)
+        if stampede_protection and layer & Layers.Memcache and not bust_cache:
+            if layer & Layers.InAppMemory:
+                result = cachepy.get(key)
+                if result is not None:
+                    cache_key_stats.record_hit(stats_family, "InAppMemory")
+                    return result
+
+            envelope = get_from_memcache(key, namespace=namespace)
+            if envelope is None:
+                # Nobody has a value yet, so let the lease holder compute it while
+                # everyone else waits for it to show up in memcache
+                holds_lease = stampede_protection.acquire_lease(key, namespace)
+                if not holds_lease:
+                    deadline = time.time() + stampede_protection.wait_secs
+                    while envelope is None and time.time() < deadline:
+                        time.sleep(StampedeProtection.POLL_INTERVAL_SECS)
+                        envelope = get_from_memcache(key, namespace=namespace)
+
+            if isinstance(envelope, StampedeEnvelope):
+                cache_key_stats.record_hit(stats_family, "Memcache")
+                now = time.time()
+                if not stampede_protection.should_refresh(envelope, now):
+                    if layer & Layers.InAppMemory:
+                        expiry = expiration
+                        if envelope.expires_at is not None:
+                            expiry = max(1, envelope.expires_at - now)
+                        cachepy.set(key, envelope.value, expiry=expiry)
+                    return envelope.value
+
+                # Stale, or picked for an early refresh. Only the lease holder
+                # recomputes; everyone else keeps serving the previous value.
+                holds_lease = stampede_protection.acquire_lease(key, namespace)
+                if not holds_lease:
+                    return envelope.value
+                stale_result = envelope.value
+
+            elif envelope is not None:
+                # Cached before stampede protection was turned on for this key
+                cache_key_stats.record_hit(stats_family, "Memcache")
+                return envelope
+
+            if stale_result is None and layer & (Layers.Datastore | Layers.Blobstore):
+                try:
+                    result = get_cached_result(key, namespace, expiration,
+                            layer & (Layers.Datastore | Layers.Blobstore))
+                except IOError:
+                    logging.exception("Exception loading from %s cache", key)
+                    result = None
+                if result is not None:
+                    set_cached_result(key, namespace, expiration,
+                            layer & (Layers.InAppMemory | Layers.Memcache), result)
+                    return result
+
+        elif not bust_cache:
+            try:
+                result = get_cached_result(key, namespace, expiration, layer)
+            except IOError:
+                logging.exception("Exception loading from %s cache", key)
+                result = None
+            if result is not None:
+                return result
 
-    # an error happened trying to recompute the result, see if there is a value for it in the permanent cache
-    except Exception, e:
-        import traceback, StringIO
-        fp = StringIO.StringIO()
-        traceback.print_exc(file=fp)
-        logging.error("Error fetching from cache (key=%s)", key)
-        logging.error(fp.getvalue())
+        if not bust_cache and stale_result is None:
+            cache_key_stats.record_miss(stats_family)
 
-        if permanent_key_fxn is not None:
-            permanent_key = permanent_key_fxn(*args, **kwargs)
+        try:
+            recompute_start = time.time()
+            result = target(*args, **kwargs)
+            recompute_secs = time.time() - recompute_start
 
-            result = get_cached_result(permanent_key, namespace, expiration, layer)
+        # an error happened trying to recompute the result, see if there is a value for it in the permanent cache
+        except Exception, e:
+            import traceback, StringIO
+            fp = StringIO.StringIO()
+            traceback.print_exc(file=fp)
+            logging.error("Error fetching from cache (key=%s)", key)
+            logging.error(fp.getvalue())
 
-            if result is not None:
-                logging.info("resource is not available, restoring from permanent cache")
+            if stale_result is not None:
+                logging.info("resource is not available, serving the previous value")
+                return stale_result
 
-                # In case the key's value has been changed by target's execution
-                key = key_fxn(*args, **kwargs)
+            if permanent_key_fxn is not None:
+                permanent_key = permanent_key_fxn(*args, **kwargs)
 
-                #retreived item from permanent cache - save it to the more temporary cache and then return it
-                set_cached_result(key, namespace, expiration, layer, result)
-                return result
+                result = get_cached_result(permanent_key, namespace, expiration, layer)
 
-        # could not retrieve item from a permanent cache, raise the error on up
-        raise e
+                if result is not None:
+                    logging.info("resource is not available, restoring from permanent cache")
 
-    if isinstance(result, UncachedResult):
-        # Don't cache this result, just return it
-        result = result.result
-    else:
-        if permanent_key_fxn is not None:
-            permanent_key = permanent_key_fxn(*args, **kwargs)
-            set_cached_result(permanent_key, namespace, 0, layer, result)
+                    # In case the key's value has been changed by target's execution
+                    key = key_fxn(*args, **kwargs)
+
+                    #retreived item from permanent cache - save it to the more temporary cache and then return it
+                    set_cached_result(key, namespace, expiration, layer, result)
+                    return result
 
-        # In case the key's value has been changed by target's execution
-        key = key_fxn(*args, **kwargs)
-        set_cached_result(key, namespace, expiration, layer, result)
+            # could not retrieve item from a permanent cache, raise the error on up
+            raise e
 
-    return result
+        if isinstance(result, UncachedResult):
+            # Don't cache this result, just return it
+            result = result.result
+        else:
+            if permanent_key_fxn is not None:
+                permanent_key = permanent_key_fxn(*args, **kwargs)
+                set_cached_result(permanent_key, namespace, 0, layer, result)
+
+            # In case the key's value has been changed by target's execution
+            key = key_fxn(*args, **kwargs)
+            set_cached_result(key, namespace, expiration, layer, result, recompute_secs)
+            cache_key_stats.record_recompute(stats_family, recompute_secs, result)
+
+        return result
+
+    finally:
+        if holds_lease:
+            stampede_protection.release_lease(leased_key, namespace)
+
+def layer_cache_check_set_return_multi(
+        target,
+        key_fxn,
+        expiration = DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS,
+        layer = Layers.Memcache | Layers.InAppMemory,
+        persist_across_app_versions = False,
+        items = (),
+        bust_cache = False):
+    """ Batch version of layer_cache_check_set_return, used by cache_multi.
+
+    Makes one pass over cachepy, one memcache.get_multi and one datastore
+    get for the keys still missing after that, then calls target once with
+    every item that missed all layers. Hits fill the layers above the one
+    they were found in with a single set_multi/put per layer. The Blobstore
+    layer and bigdata aren't supported here.
+    """
+    items = list(items)
+    keys = [key_fxn(item) for item in items]
+
+    if request_cache.get("layer_cache_disabled"):
+        return target(items)
+
+    stats_family = cache_key_stats.family(target)
+    if bust_cache:
+        cache_key_stats.record_bust(stats_family)
+
+    namespace = App.version
+    if persist_across_app_versions:
+        namespace = None
+
+    # Cached results by key, and recomputed results by index into items
+    results = {}
+    computed_results = {}
+    if not bust_cache:
+        missing = [key for key in keys if key is not None]
+
+        if layer & Layers.InAppMemory:
+            for key in missing:
+                result = cachepy.get(key)
+                if result is not None:
+                    results[key] = result
+            missing = [key for key in missing if key not in results]
+            if results:
+                cache_key_stats.record_hit(stats_family, "InAppMemory", len(results))
+
+        if missing and layer & Layers.Memcache:
+            found = memcache.get_multi(missing, namespace=namespace)
+            for key, result in found.iteritems():
+                if result is not None:
+                    results[key] = result
+                    if layer & Layers.InAppMemory:
+                        cachepy.set(key, result, expiry=expiration)
+            if found:
+                cache_key_stats.record_hit(stats_family, "Memcache", len(found))
+            missing = [key for key in missing if key not in results]
+
+        if missing and layer & Layers.Datastore:
+            found = KeyValueCache.get_multi(missing, namespace=namespace)
+            if found:
+                cache_key_stats.record_hit(stats_family, "Datastore", len(found))
+            for key, result in found.iteritems():
+                results[key] = result
+                if layer & Layers.InAppMemory:
+                    cachepy.set(key, result, expiry=expiration)
+            if found and layer & Layers.Memcache:
+                memcache.set_multi(found, time=expiration, namespace=namespace)
+
+    # Recompute every miss with a single call to the target
+    missing_indices = [i for i, key in enumerate(keys) if key not in results]
+    if missing_indices:
+        if not bust_cache:
+            cache_key_stats.record_miss(stats_family, len(missing_indices))
+
+        recompute_start = time.time()
+        computed = target([items[i] for i in missing_indices])
+        cache_key_stats.record_recompute(stats_family, time.time() - recompute_start)
+
+        to_cache = {}
+        for i, result in zip(missing_indices, computed):
+            if isinstance(result, UncachedResult):
+                result = result.result
+            elif keys[i] is not None and result is not None:
+                to_cache[keys[i]] = result
+            computed_results[i] = result
+
+        if to_cache:
+            if layer & Layers.InAppMemory:
+                for key, result in to_cache.iteritems():
+                    cachepy.set(key, result, expiry=expiration)
+
+            if layer & Layers.Memcache:
+                if memcache.set_multi(to_cache, time=expiration, namespace=namespace):
+                    logging.error("Memcache set_multi failed for some of %s" % to_cache.keys())
+
+            if layer & Layers.Datastore:
+                KeyValueCache.set_multi(to_cache, time=expiration, namespace=namespace)
+
+    return [computed_results[i] if i in computed_results else results[key]
+            for i, key in enumerate(keys)]
 
 # Functions can return an UncachedResult-wrapped object
 # to tell layer_cache to skip caching this specific result.
@@ -342,6 +708,35 @@ class KeyValueCache(db.Model):
 
         return None
 
+    @staticmethod
+    def get_multi(keys, namespace=""):
+        """ Returns a dict of key -> cached value for the keys that exist
+        and haven't expired. """
+        namespaced_keys = [KeyValueCache.get_namespaced_key(key, namespace) for key in keys]
+        key_values = KeyValueCache.get_by_key_name(namespaced_keys)
+
+        results = {}
+        for key, key_value in zip(keys, key_values):
+            if key_value and not key_value.is_expired():
+                results[key] = pickle.loads(key_value.value)
+        return results
+
+    @staticmethod
+    def set_multi(mapping, time=DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS, namespace=""):
+        """ Overwrites every key in mapping with a single put. """
+        dt = datetime.datetime.now()
+
+        dt_expires = datetime.datetime.max
+        if time > 0:
+            dt_expires = dt + datetime.timedelta(seconds=time)
+
+        db.put([KeyValueCache(
+                    key_name = KeyValueCache.get_namespaced_key(key, namespace),
+                    value = pickle.dumps(result),
+                    created = dt,
+                    expires = dt_expires)
+                for key, result in mapping.iteritems()])
+
     @staticmethod
     def set(key, result, time=DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS, namespace=""):
 
@@ -374,54 +769,210 @@ class KeyValueCache(db.Model):
         if key_value:
             db.delete(key_value)
 
+class _CompressingWriter(object):
+    """ File-like object that zlib-compresses everything written to it into
+    another file, keeping track of sizes and a checksum for the trailer. """
+
+    def __init__(self, f, level):
+        self.f = f
+        self.compressor = zlib.compressobj(level)
+        self.raw_size = 0
+        self.compressed_size = 0
+        self.crc = 0
+
+    def write(self, data):
+        self.raw_size += len(data)
+        self.crc = zlib.crc32(data, self.crc)
+        self._write_compressed(self.compressor.compress(data))
+
+    def finish(self):
+        self._write_compressed(self.compressor.flush())
+
+    def _write_compressed(self, compressed):
+        if compressed:
+            self.compressed_size += len(compressed)
+            self.f.write(compressed)
+
+class _ChunkedWriter(object):
+    """ Groups many small writes into chunk_size writes to another file. """
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.chunks:
+            self.f.write("".join(self.chunks))
+            self.chunks = []
+            self.size = 0
+
+class _DecompressingReader(object):
+    """ File-like object, good enough for cPickle.Unpickler, that decompresses
+    a _CompressingWriter stream read from another file in read_size chunks.
+    """
+
+    def __init__(self, f, read_size):
+        self.f = f
+        self.read_size = read_size
+        self.decompressor = zlib.decompressobj()
+        self.buffer = ""
+        self.offset = 0
+        self.raw_size = 0
+        self.compressed_size = 0
+        self.crc = 0
+
+    def _fill(self):
+        """ Decompresses another chunk into the buffer. Returns False at the
+        end of the compressed stream. """
+        if self.decompressor.unused_data:
+            return False
+
+        compressed = self.f.read(self.read_size)
+        if not compressed:
+            return False
+
+        data = self.decompressor.decompress(compressed)
+        self.compressed_size += len(compressed) - len(self.decompressor.unused_data)
+        self.raw_size += len(data)
+        self.crc = zlib.crc32(data, self.crc)
+
+        self.buffer = self.buffer[self.offset:] + data
+        self.offset = 0
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) - self.offset < size:
+            if not self._fill():
+                break
+
+        if size < 0:
+            size = len(self.buffer) - self.offset
+        data = self.buffer[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+    def readline(self):
+        while True:
+            newline = self.buffer.find("\n", self.offset)
+            if newline >= 0:
+                return self.read(newline + 1 - self.offset)
+            if not self._fill():
+                return self.read()
+
+    def trailer(self):
+        """ Reads the rest of the stream and returns the bytes after it. """
+        while self._fill():
+            pass
+        return self.decompressor.unused_data + self.f.read()
+
 class BlobCache():
+    """ Cloud Storage layer for values too big for memcache.
+
+    Values are pickled straight into a zlib stream as the file is written,
+    and unpickled straight out of it as the file is read, so neither the
+    whole pickle nor the whole compressed payload has to be held in memory.
+    Files are laid out as:
+
+        header:   HEADER_FORMAT (MAGIC, expiry in epoch seconds or 0)
+        payload:  the zlib-compressed pickle
+        trailer:  TRAILER_FORMAT (pickled size, compressed size, crc32 of
+                  the pickle)
+
+    The sizes go in a trailer because they aren't known until the stream has
+    been written. Expired values are treated as misses after reading just
+    the header. Files written before this format are plain pickles and are
+    still read.
+    """
+
+    MAGIC = "LCB\x01"
+    HEADER_FORMAT = "<4sq"
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+    TRAILER_FORMAT = "<QQI"
+
+    COMPRESSION_LEVEL = 6
+
+    # Reads are done a buffer at a time, so the cloudstorage client always
+    # has the next buffer's fetch in flight while this one is decompressed
+    READ_BUFFER_SIZE = 1024 * 1024
+    WRITE_CHUNK_SIZE = 256 * 1024
+
+    # Values read back are only copied into memcache when their pickled
+    # size, from the trailer, says they fit
+    MEMCACHE_FILL_MAX_BYTES = 900 * 1024
 
     @staticmethod
     def get_filename(key, namespace="all"):
         return "/%s/%s/%s" % (BLOBCACHE_BUCKET, namespace, key)
 
+    @staticmethod
+    def get_expires_at(expiration):
+        if expiration > 0:
+            return int(time.time()) + expiration
+        return 0
 
     @staticmethod
     def get(key, namespace="all"):
+        return BlobCache.get_with_size(key, namespace)[0]
+
+    @staticmethod
+    def get_with_size(key, namespace="all"):
+        """ Returns (value, pickled size), or (None, None) on a miss. The
+        size is None for files written before compression was added.
+        """
         try:
-            blob = gcs.open(BlobCache.get_filename(key, namespace))
+            blob = gcs.open(BlobCache.get_filename(key, namespace),
+                            read_buffer_size=BlobCache.READ_BUFFER_SIZE)
         except gcs.NotFoundError:
-            return
+            return None, None
 
         with blob as f:
-            obj = pickle.load(f)
-        return obj
-       
+            header = f.read(BlobCache.HEADER_SIZE)
+            if not header.startswith(BlobCache.MAGIC):
+                # Written before BlobCache compressed its values
+                f.seek(0)
+                return pickle.load(f), None
+
+            magic, expires_at = struct.unpack(BlobCache.HEADER_FORMAT, header)
+            if expires_at and expires_at < time.time():
+                return None, None
+
+            reader = _DecompressingReader(f, BlobCache.READ_BUFFER_SIZE)
+            obj = cPickle.Unpickler(reader).load()
+
+            raw_size, compressed_size, crc = struct.unpack(
+                    BlobCache.TRAILER_FORMAT, reader.trailer())
+            if (raw_size, compressed_size, crc & 0xffffffff) != (
+                    reader.raw_size, reader.compressed_size, reader.crc & 0xffffffff):
+                raise IOError("BlobCache file %s is corrupt" % key)
+
+        return obj, raw_size
+
     @staticmethod
     def set(key, result, time=DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS, namespace="all"):
-        # old_blob_infos = BlobCache.get_blob_infos(key, namespace)
-        # filename = BlobCache.get_filename(key, namespace)
-        # return gcs.listbucket(filename).fetch(100)
-      
-        value = pickle.dumps(result)
-        
-        # Create the file
+        expires_at = BlobCache.get_expires_at(time)
+
         filename = BlobCache.get_filename(key, namespace)
         gcs_file = gcs.open(filename, 'w', content_type='application/octet-stream')
- 
-        # might need to wrap it in an object to handle expiration time here
-        
-        # write the pickled result to the file
-        pos = 0
-        chunkSize = 65536
+
         with gcs_file as f:
-            for pos in range(0, len(value), chunkSize):
-                f.write(value[pos:pos+chunkSize])
-
-        # # Get the file's blob key
-        # blob_key = files.blobstore.get_blob_key(file_name)
-
-        # for info in old_blob_infos:
-        #     try:
-        #         info.delete()
-        #     except Exception, e:
-        #         # If deleting blob times out, don't crash the request. Just log the error.
-        #         logging.error("Failed to delete old blob from layer_cache: %s" % e)
+            f.write(struct.pack(BlobCache.HEADER_FORMAT, BlobCache.MAGIC, expires_at))
+
+            writer = _CompressingWriter(_ChunkedWriter(f, BlobCache.WRITE_CHUNK_SIZE),
+                                        BlobCache.COMPRESSION_LEVEL)
+            cPickle.Pickler(writer, cPickle.HIGHEST_PROTOCOL).dump(result)
+            writer.finish()
+            writer.f.flush()
+
+            f.write(struct.pack(BlobCache.TRAILER_FORMAT, writer.raw_size,
+                                writer.compressed_size, writer.crc & 0xffffffff))
 
     @staticmethod
     def delete(key, namespace="all"):
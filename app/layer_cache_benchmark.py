@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Compares looking up N cached values through the single-key layer_cache path
+in a loop against one layer_cache.cache_multi call, for warm memcache, warm
+datastore and cold caches. Reports wall time and the number of memcache and
+datastore RPCs made, using the App Engine testbed stubs.
+
+Usage: python layer_cache_benchmark.py [NUM_KEYS]
+
+The App Engine SDK has to be importable (e.g. on PYTHONPATH).
+"""
+
+import collections
+import sys
+import time
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import testbed
+
+import layer_cache
+
+LAYERS = (layer_cache.Layers.Datastore | layer_cache.Layers.Memcache |
+          layer_cache.Layers.InAppMemory)
+
+RPC_COUNTS = collections.Counter()
+
+
+def count_rpc(service, call, request, response):
+    RPC_COUNTS[service] += 1
+
+
+def value_for(n):
+    return {"id": n, "title": "Item %d" % n, "tags": ["tag"] * 10}
+
+
+@layer_cache.cache_with_key_fxn(lambda n: "benchmark_item_%d" % n, layer=LAYERS)
+def single(n):
+    return value_for(n)
+
+
+@layer_cache.cache_multi(lambda n: "benchmark_item_%d" % n, layer=LAYERS)
+def multi(numbers):
+    return [value_for(n) for n in numbers]
+
+
+def reset(tb, keep_memcache, keep_datastore):
+    layer_cache.cachepy.flush()
+    if not keep_memcache:
+        layer_cache.memcache.flush_all()
+    if not keep_datastore:
+        tb.get_stub(testbed.DATASTORE_SERVICE_NAME).Clear()
+
+
+def measure(tb, fxn, numbers, keep_memcache, keep_datastore):
+    # Warm up every layer, then drop the ones this scenario starts without
+    fxn(numbers)
+    reset(tb, keep_memcache, keep_datastore)
+
+    RPC_COUNTS.clear()
+    start = time.time()
+    fxn(numbers)
+    return time.time() - start, RPC_COUNTS["memcache"], RPC_COUNTS["datastore_v3"]
+
+
+def main(num_keys):
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append("count_rpc", count_rpc)
+
+    numbers = range(num_keys)
+    loop = lambda numbers: [single(n) for n in numbers]
+
+    print "keys: %d" % num_keys
+    print "%-16s %-7s %10s %10s %12s" % ("scenario", "path", "ms", "memcache", "datastore")
+    for scenario, keep_memcache, keep_datastore in [
+            ("warm memcache", True, True),
+            ("warm datastore", False, True),
+            ("cold", False, False)]:
+        for path, fxn in [("loop", loop), ("multi", multi)]:
+            reset(tb, False, False)
+            secs, memcache_rpcs, datastore_rpcs = measure(
+                tb, fxn, numbers, keep_memcache, keep_datastore)
+            print "%-16s %-7s %10.1f %10d %12d" % (
+                scenario, path, 1000 * secs, memcache_rpcs, datastore_rpcs)
+
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
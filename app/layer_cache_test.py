@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+
+import cPickle
+import pickle
+import random
+import time
+
+from mock import patch
+
+import layer_cache
+import testutil
+
+
+class StampedeProtectionTest(testutil.GAEModelTestCase):
+    """ Simulates many concurrent callers of an expensive cached function.
+
+    Each caller that gets to recompute the value calls the next caller from
+    inside the target, so every other caller runs while the recompute is
+    still in flight, as concurrent requests on other instances would.
+    """
+
+    NUM_CALLERS = 20
+
+    def setUp(self):
+        super(StampedeProtectionTest, self).setUp()
+        self.now = time.time()
+        self.recomputes = 0
+        self.values_computed = 0
+        self.results = []
+
+    def clock(self):
+        return self.now
+
+    def make_cached_fxn(self, stampede_protection):
+        @layer_cache.cache_with_key_fxn(
+                lambda: "stampede_test_key",
+                expiration=60,
+                layer=layer_cache.Layers.Memcache,
+                stampede_protection=stampede_protection)
+        def expensive():
+            self.recomputes += 1
+            self.values_computed += 1
+            value = "value %d" % self.values_computed
+            self.call_concurrently(expensive)
+            return value
+
+        return expensive
+
+    def call_concurrently(self, fxn):
+        # Every caller that hasn't started yet starts now, while the
+        # recompute that called us is still in flight
+        while self.pending_callers > 0:
+            self.pending_callers -= 1
+            self.results.append(fxn())
+
+    def run_callers(self, fxn, num_callers=NUM_CALLERS):
+        self.results = []
+        self.pending_callers = num_callers - 1
+        with patch("layer_cache.time.time", self.clock):
+            self.results.append(fxn())
+            self.call_concurrently(fxn)
+        return self.results
+
+    def prime(self, fxn):
+        self.run_callers(fxn, num_callers=1)
+        self.recomputes = 0
+
+    def test_unprotected_expiry_recomputes_for_every_caller(self):
+        fxn = self.make_cached_fxn(None)
+        self.prime(fxn)
+
+        # memcache itself expires the key in the unprotected case
+        layer_cache.memcache.flush_all()
+        self.run_callers(fxn)
+        self.assertEqual(self.recomputes, self.NUM_CALLERS)
+
+    def test_expired_key_is_recomputed_once(self):
+        protection = layer_cache.StampedeProtection(early_refresh_beta=0)
+        fxn = self.make_cached_fxn(protection)
+        self.prime(fxn)
+
+        self.now += 61
+        results = self.run_callers(fxn)
+
+        self.assertEqual(self.recomputes, 1)
+        # Everyone but the lease holder was served the stale value
+        self.assertEqual(results.count("value 1"), self.NUM_CALLERS - 1)
+        self.assertEqual(results.count("value 2"), 1)
+
+    def test_lease_is_released_after_recompute(self):
+        protection = layer_cache.StampedeProtection(early_refresh_beta=0)
+        fxn = self.make_cached_fxn(protection)
+        self.prime(fxn)
+
+        self.assertIsNone(layer_cache.memcache.get(
+            layer_cache.StampedeProtection.lease_key("stampede_test_key"),
+            namespace=layer_cache.App.version))
+
+    def test_early_refresh_ahead_of_expiry(self):
+        protection = layer_cache.StampedeProtection(early_refresh_beta=1.0)
+        fxn = self.make_cached_fxn(protection)
+        self.prime(fxn)
+
+        # A recompute that took (simulated) 30 seconds makes callers 5
+        # seconds before expiry very likely to refresh early
+        envelope = layer_cache.memcache.get("stampede_test_key",
+                namespace=layer_cache.App.version)
+        envelope.recompute_secs = 30
+        layer_cache.memcache.set("stampede_test_key", envelope,
+                namespace=layer_cache.App.version)
+
+        self.now += 55
+        with patch("layer_cache.random.random", lambda: 0.5):
+            results = self.run_callers(fxn)
+
+        self.assertEqual(self.recomputes, 1)
+        self.assertEqual(results.count("value 1"), self.NUM_CALLERS - 1)
+
+    def test_recompute_failure_serves_stale_value(self):
+        protection = layer_cache.StampedeProtection(early_refresh_beta=0)
+        fail = []
+
+        @layer_cache.cache_with_key_fxn(
+                lambda: "stampede_failing_key",
+                expiration=60,
+                layer=layer_cache.Layers.Memcache,
+                stampede_protection=protection)
+        def flaky():
+            if fail:
+                raise Exception("backend unavailable")
+            return "good value"
+
+        with patch("layer_cache.time.time", self.clock):
+            self.assertEqual(flaky(), "good value")
+            fail.append(True)
+            self.now += 61
+            self.assertEqual(flaky(), "good value")
+
+    def test_unreadable_lower_layer_is_recomputed(self):
+        protection = layer_cache.StampedeProtection(early_refresh_beta=0)
+
+        @layer_cache.cache_with_key_fxn(
+                lambda: "stampede_unreadable_key",
+                expiration=60,
+                layer=layer_cache.Layers.Memcache | layer_cache.Layers.Datastore,
+                stampede_protection=protection)
+        def fxn():
+            return "fresh value"
+
+        def unreadable(*args, **kwargs):
+            raise IOError("corrupt cache entry")
+
+        with patch.object(layer_cache.KeyValueCache, "get", staticmethod(unreadable)):
+            self.assertEqual(fxn(), "fresh value")
+
+        self.assertIsNone(layer_cache.memcache.get(
+            layer_cache.StampedeProtection.lease_key("stampede_unreadable_key"),
+            namespace=layer_cache.App.version))
+
+
+class CacheMultiTest(testutil.GAEModelTestCase):
+    def setUp(self):
+        super(CacheMultiTest, self).setUp()
+        self.computed = []
+        layer_cache.cachepy.flush()
+
+    def make_cached_fxn(self, layer):
+        @layer_cache.cache_multi(
+                lambda n: "cache_multi_square_%d" % n,
+                layer=layer)
+        def squares(numbers):
+            self.computed.append(list(numbers))
+            return [n * n for n in numbers]
+
+        return squares
+
+    def test_misses_are_computed_in_one_batch(self):
+        squares = self.make_cached_fxn(layer_cache.Layers.Memcache |
+                                       layer_cache.Layers.InAppMemory)
+
+        self.assertEqual(squares([1, 2, 3]), [1, 4, 9])
+        self.assertEqual(self.computed, [[1, 2, 3]])
+
+        # Only the new items are computed, in order
+        self.assertEqual(squares([3, 4, 1, 5]), [9, 16, 1, 25])
+        self.assertEqual(self.computed, [[1, 2, 3], [4, 5]])
+
+    def test_lower_layers_fill_upper_layers(self):
+        layer = (layer_cache.Layers.Datastore | layer_cache.Layers.Memcache |
+                 layer_cache.Layers.InAppMemory)
+        squares = self.make_cached_fxn(layer)
+        squares([1, 2])
+
+        layer_cache.cachepy.flush()
+        layer_cache.memcache.flush_all()
+
+        self.assertEqual(squares([2, 1]), [4, 1])
+        self.assertEqual(self.computed, [[1, 2]])
+        self.assertEqual(
+            layer_cache.memcache.get("cache_multi_square_2",
+                                     namespace=layer_cache.App.version), 4)
+
+    def test_matches_single_key_path(self):
+        @layer_cache.cache_with_key_fxn(lambda n: "cache_multi_square_%d" % n)
+        def square(n):
+            return n * n
+
+        squares = self.make_cached_fxn(layer_cache.Layers.Memcache |
+                                       layer_cache.Layers.InAppMemory)
+        numbers = range(10)
+        self.assertEqual(squares(numbers), [square(n) for n in numbers])
+
+    def test_bust_cache(self):
+        squares = self.make_cached_fxn(layer_cache.Layers.Memcache)
+        squares([1, 2])
+        squares([1, 2], bust_cache=True)
+        self.assertEqual(self.computed, [[1, 2], [1, 2]])
+
+
+class BlobCacheTest(testutil.GAEModelTestCase):
+    def setUp(self):
+        super(BlobCacheTest, self).setUp()
+        # The cloudstorage client stores files through these stubs locally
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_blobstore_stub()
+        self.testbed.init_urlfetch_stub()
+        layer_cache.cachepy.flush()
+
+        # Big and compressible, like the topic tree
+        self.value = [{"id": i, "title": u"Topic %d" % i, "children": range(20)}
+                      for i in xrange(5000)]
+
+    def test_round_trip_is_compressed(self):
+        layer_cache.BlobCache.set("blob_test_key", self.value)
+        pickled_size = len(cPickle.dumps(self.value, cPickle.HIGHEST_PROTOCOL))
+
+        value, size = layer_cache.BlobCache.get_with_size("blob_test_key")
+        self.assertEqual(value, self.value)
+        self.assertEqual(size, pickled_size)
+
+        filename = layer_cache.BlobCache.get_filename("blob_test_key")
+        with layer_cache.gcs.open(filename) as f:
+            self.assertTrue(len(f.read()) < pickled_size / 4)
+
+    def test_missing_and_expired_keys_are_misses(self):
+        self.assertIsNone(layer_cache.BlobCache.get("blob_test_missing"))
+
+        layer_cache.BlobCache.set("blob_test_key", self.value, time=60)
+        later = time.time() + 61
+        with patch("layer_cache.time.time", lambda: later):
+            self.assertIsNone(layer_cache.BlobCache.get("blob_test_key"))
+
+    def test_reads_uncompressed_files(self):
+        filename = layer_cache.BlobCache.get_filename("blob_test_key")
+        with layer_cache.gcs.open(filename, "w") as f:
+            f.write(pickle.dumps(self.value))
+
+        self.assertEqual(layer_cache.BlobCache.get("blob_test_key"), self.value)
+
+    def test_small_values_fill_upper_layers(self):
+        layer = layer_cache.Layers.Blobstore | layer_cache.Layers.Memcache
+        computed = []
+
+        @layer_cache.cache_with_key_fxn(lambda: "blob_test_small", layer=layer)
+        def small():
+            computed.append(True)
+            return "small value"
+
+        small()
+        layer_cache.memcache.flush_all()
+
+        self.assertEqual(small(), "small value")
+        self.assertEqual(len(computed), 1)
+        self.assertEqual(layer_cache.memcache.get("blob_test_small",
+                         namespace=layer_cache.App.version), "small value")
+
+    def test_big_compressible_values_only_fill_cachepy(self):
+        layer = (layer_cache.Layers.Blobstore | layer_cache.Layers.Memcache |
+                 layer_cache.Layers.InAppMemory)
+        value = "x" * (2 * 1024 * 1024)
+
+        @layer_cache.cache_with_key_fxn(lambda: "blob_test_big", layer=layer)
+        def big():
+            return value
+
+        big()
+        layer_cache.cachepy.flush()
+        layer_cache.memcache.flush_all()
+
+        # Well under the memcache limit compressed, but not pickled
+        with patch("layer_cache.memcache.set") as memcache_set:
+            self.assertEqual(big(), value)
+            self.assertFalse(memcache_set.called)
+        self.assertEqual(layer_cache.cachepy.get("blob_test_big"), value)
+
+    def test_uncompressed_files_fill_cachepy(self):
+        layer = layer_cache.Layers.Blobstore | layer_cache.Layers.InAppMemory
+        filename = layer_cache.BlobCache.get_filename("blob_test_old",
+                                                      layer_cache.App.version)
+        with layer_cache.gcs.open(filename, "w") as f:
+            f.write(pickle.dumps("old value"))
+
+        @layer_cache.cache_with_key_fxn(lambda: "blob_test_old", layer=layer)
+        def old():
+            return "new value"
+
+        self.assertEqual(old(), "old value")
+        self.assertEqual(layer_cache.cachepy.get("blob_test_old"), "old value")
+
+
+class BigMemcacheTest(testutil.GAEModelTestCase):
+    CHUNK_SIZE = 1000
+
+    def setUp(self):
+        super(BigMemcacheTest, self).setUp()
+        # Random enough not to compress into a single small chunk
+        rand = random.Random(0)
+        self.value = ["%x" % rand.getrandbits(64) for _ in xrange(5000)]
+
+    def set(self, key, value):
+        return layer_cache.big_memcache_set(key, value, chunksize=self.CHUNK_SIZE)
+
+    def test_round_trip(self):
+        self.assertTrue(self.set("big_test_key", self.value))
+        self.assertEqual(layer_cache.big_memcache_get("big_test_key"), self.value)
+
+        manifest = layer_cache.memcache.get("big_test_key")
+        self.assertTrue(manifest[2] > 32)
+
+    def test_small_values_are_stored_inline(self):
+        self.assertTrue(self.set("big_test_key", "small"))
+        self.assertEqual(layer_cache.big_memcache_get("big_test_key"), "small")
+        self.assertEqual(layer_cache.memcache.get("big_test_key")[2], 0)
+
+    def test_partial_eviction_is_a_miss(self):
+        self.set("big_test_key", self.value)
+        generation = layer_cache.memcache.get("big_test_key")[1]
+        layer_cache.memcache.delete(
+            layer_cache.big_memcache_chunk_key("big_test_key", generation, 3))
+
+        self.assertIsNone(layer_cache.big_memcache_get("big_test_key"))
+
+    def test_corrupt_chunk_is_a_miss(self):
+        self.set("big_test_key", self.value)
+        generation = layer_cache.memcache.get("big_test_key")[1]
+        chunk_key = layer_cache.big_memcache_chunk_key("big_test_key", generation, 0)
+        layer_cache.memcache.set(chunk_key, "x" * self.CHUNK_SIZE)
+
+        self.assertIsNone(layer_cache.big_memcache_get("big_test_key"))
+
+    def test_overwrite_never_mixes_chunks(self):
+        self.set("big_test_key", self.value)
+        self.set("big_test_key", list(reversed(self.value)))
+
+        self.assertEqual(layer_cache.big_memcache_get("big_test_key"),
+                         list(reversed(self.value)))
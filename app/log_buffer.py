@@ -0,0 +1,145 @@
+"""
+Write-behind buffering of log entities through pull queues.
+
+Writing every ProblemLog or VideoLog from its own deferred task costs a task
+execution and at least one datastore round trip per attempt or heartbeat.
+A LogBuffer instead adds each log to a pull queue. A drain task then leases
+up to BATCH_SIZE of them and hands them to a commit function in one go, so
+the commit can use multi-gets and multi-puts.
+
+Drains are scheduled at most once per DRAIN_DELAY_SECS window per buffer
+(deduplicated by a memcache marker and a named task). A drain that leases a
+full batch chains another drain right away. drain_all() is run from cron as
+a backstop in case memcache loses a marker.
+
+If a batch's commit fails, each log in it is committed on its own so one bad
+log can't hold back the rest. Logs whose commit keeps failing stay leased
+until the lease expires and are retried by a later drain. After MAX_RETRIES
+they're logged and dropped so they can't block the queue forever.
+"""
+
+import logging
+import pickle
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import deferred
+
+BATCH_SIZE = 100
+DRAIN_DELAY_SECS = 10
+LEASE_SECS = 5 * 60
+MAX_RETRIES = 10
+
+# All LogBuffers, by pull queue name
+BUFFERS = {}
+
+
+class LogBuffer(object):
+
+    def __init__(self, pull_queue_name, push_queue_name, commit_fxn):
+        """ commit_fxn is called with a list of buffered entities, in no
+        particular order, and must be idempotent since a drain can be
+        retried. It has to be a module-level function so drain tasks can
+        pickle it.
+        """
+        self.pull_queue_name = pull_queue_name
+        self.push_queue_name = push_queue_name
+        self.commit_fxn = commit_fxn
+        BUFFERS[pull_queue_name] = self
+
+    def add(self, entity):
+        task = taskqueue.Task(payload=pickle.dumps(entity, pickle.HIGHEST_PROTOCOL),
+                              method="PULL")
+        taskqueue.Queue(self.pull_queue_name).add(task)
+        self.schedule_drain()
+
+    def schedule_drain(self):
+        time_bucket = int(time.time()) // DRAIN_DELAY_SECS
+        task_name = "drain_%s_%d" % (self.pull_queue_name, time_bucket)
+
+        # Only the first add in each window pays for a task add
+        if not memcache.add(task_name, True, time=2 * DRAIN_DELAY_SECS):
+            return
+
+        try:
+            deferred.defer(drain, self.pull_queue_name, self.push_queue_name,
+                           self.commit_fxn,
+                           _name=task_name,
+                           _countdown=DRAIN_DELAY_SECS,
+                           _queue=self.push_queue_name)
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+
+
+def drain(pull_queue_name, push_queue_name, commit_fxn):
+    """ Leases up to BATCH_SIZE buffered entities and commits them. """
+    queue = taskqueue.Queue(pull_queue_name)
+    tasks = queue.lease_tasks(LEASE_SECS, BATCH_SIZE)
+    if not tasks:
+        return
+
+    done_tasks = []
+    pending = []
+    for task in tasks:
+        if task.retry_count > MAX_RETRIES:
+            logging.critical("Dropping buffered %s after %d failed commits" %
+                             (pull_queue_name, task.retry_count))
+            done_tasks.append(task)
+            continue
+        pending.append((task, pickle.loads(task.payload)))
+
+    committed = commit_batch(pull_queue_name, commit_fxn, pending)
+    done_tasks.extend(committed)
+
+    # Tasks that failed stay leased, and are retried once their lease expires
+    if done_tasks:
+        queue.delete_tasks(done_tasks)
+
+    logging.info("Committed %d of %d buffered entities from %s" %
+                 (len(committed), len(pending), pull_queue_name))
+
+    if len(tasks) == BATCH_SIZE:
+        deferred.defer(drain, pull_queue_name, push_queue_name, commit_fxn,
+                       _queue=push_queue_name)
+
+
+def commit_batch(pull_queue_name, commit_fxn, pending):
+    """ Commits the entities of a list of (task, entity) pairs, and returns
+    the tasks whose entities were committed.
+
+    The whole batch is committed at once if possible. Otherwise each entity
+    is committed on its own, so only the ones that fail are retried.
+    """
+    if not pending:
+        return []
+
+    try:
+        commit_fxn([entity for task, entity in pending])
+        return [task for task, entity in pending]
+    except Exception:
+        if len(pending) == 1:
+            logging.exception("Failed to commit buffered %s" % pull_queue_name)
+            return []
+        logging.exception("Failed to commit a batch of %d buffered %s, "
+                          "committing them one at a time" %
+                          (len(pending), pull_queue_name))
+
+    committed = []
+    for task, entity in pending:
+        try:
+            commit_fxn([entity])
+        except Exception:
+            logging.exception("Failed to commit buffered %s after %d retries" %
+                              (pull_queue_name, task.retry_count))
+        else:
+            committed.append(task)
+
+    return committed
+
+
+def drain_all():
+    for log_buffer in BUFFERS.values():
+        deferred.defer(drain, log_buffer.pull_queue_name,
+                       log_buffer.push_queue_name, log_buffer.commit_fxn,
+                       _queue=log_buffer.push_queue_name)
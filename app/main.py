@@ -18,10 +18,14 @@ import webapp2
 import devpanel
 import bulk_update.handler
 import request_cache
+import log_buffer
 from gae_mini_profiler import profiler
 from gae_bingo.middleware import GAEBingoWSGIMiddleware
+from gandalf.middleware import GandalfWSGIMiddleware
+from gandalf import gandalf
 import autocomplete
 import coaches
+import content_search
 import knowledgemap
 import consts
 import youtube_sync
@@ -580,27 +584,20 @@ class Search(request_handler.RequestHandler):
         exvids_future = util.async_queries([exvids_query])
 
         # One full (non-partial) search, then sort by kind
-        all_text_keys = Topic.full_text_search(
-                query, limit=50, kind=None,
-                stemming=Topic.INDEX_STEMMING,
-                multi_word_literal=Topic.INDEX_MULTI_WORD)
-
-        # Quick title-only partial search
-        topic_partial_results = filter(
-                lambda topic_dict: query in topic_dict["title"].lower(),
-                autocomplete.topic_title_dicts())
-        video_partial_results = filter(
-                lambda video_dict: query in video_dict["title"].lower(),
-                autocomplete.video_title_dicts())
-        url_partial_results = filter(
-                lambda url_dict: query in url_dict["title"].lower(),
-                autocomplete.url_title_dicts())
+        if gandalf("in_memory_search"):
+            all_text_keys = content_search.full_text_search(query, limit=50)
+        else:
+            all_text_keys = Topic.full_text_search(
+                    query, limit=50, kind=None,
+                    stemming=Topic.INDEX_STEMMING,
+                    multi_word_literal=Topic.INDEX_MULTI_WORD)
+
+        # Quick title-only partial search of videos and urls
+        video_partial_results = autocomplete.autocomplete_index().search(query)["videos"]
 
         # Combine results & do one big get!
         all_key_list = [str(key_and_title[0]) for key_and_title in all_text_keys]
-        # all_key_list.extend([result["key"] for result in topic_partial_results])
         all_key_list.extend([result["key"] for result in video_partial_results])
-        all_key_list.extend([result["key"] for result in url_partial_results])
         all_key_list = list(set(all_key_list))
 
         # Filter out anything that isn't a Topic, Url or Video
@@ -728,6 +725,13 @@ class RealtimeEntityCount(request_handler.RequestHandler):
             count = getattr(models, kind).all().count(10000)
             self.response.out.write("%s: %d<br>" % (kind, count))
 
+class DrainLogBuffers(request_handler.RequestHandler):
+    def get(self):
+        # Backstop for log_buffer's own drain scheduling, and for UserVideoCss
+        # flushes that were never scheduled; run by cron
+        log_buffer.drain_all()
+        models.sweep_css_transitions()
+
 class MemcacheViewer(request_handler.RequestHandler):
     @developer_required
     def get(self):
@@ -805,6 +809,7 @@ application = webapp2.WSGIApplication([
     ('/admin/youtubesync.*', youtube_sync.YouTubeSync),
     ('/admin/changeemail', ChangeEmail),
     ('/admin/realtimeentitycount', RealtimeEntityCount),
+    ('/admin/drainlogbuffers', DrainLogBuffers),
     ('/admin/unisubs', unisubs.ReportHandler),
     ('/admin/unisubs/import', unisubs.ImportHandler),
     ('/admin/exercisesync', exercises.SyncExercises),
@@ -815,6 +820,7 @@ application = webapp2.WSGIApplication([
     ('/devadmin/managedevs', devpanel.Manage),
     ('/devadmin/managecoworkers', devpanel.ManageCoworkers),
     ('/devadmin/managecommoncore', devpanel.ManageCommonCore),
+    ('/devadmin/cachestats', devpanel.CacheStats),
     ('/commoncore', common_core.CommonCore),
     ('/staging/commoncore', common_core.CommonCore),
     ('/devadmin/content', topics.EditContent),
@@ -951,4 +957,5 @@ application = webapp2.WSGIApplication([
 
 application = profiler.ProfilerWSGIMiddleware(application)
 application = GAEBingoWSGIMiddleware(application)
+application = GandalfWSGIMiddleware(application)
 application = request_cache.RequestCacheMiddleware(application)
@@ -1,16 +1,20 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import datetime, logging
+import time
 import json
 import math
 import urllib
 import pickle
 import random
 import itertools
+import array
+import collections
 from pprint import pformat
 
 from google.appengine.api import users
 from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.ext import deferred
 from google.appengine.ext.db import TransactionFailedError
 from api.jsonify import jsonify
@@ -25,12 +29,14 @@ from search import Searchable
 from app import App
 import layer_cache
 import request_cache
+import log_buffer
 from discussion import models_discussion
 from topics_list import all_topics_list
 import nicknames
 from counters import user_counter
 from facebook_util import is_facebook_user_id, FACEBOOK_ID_PREFIX
 from accuracy_model import AccuracyModel, InvFnExponentialNormalizer
+from accuracy_model import batch as accuracy_model_batch
 from decorators import clamp
 import base64, os
 
@@ -358,20 +364,32 @@ class UserExercise(db.Model):
 
     min_problems_required = db.IntegerProperty(default=consts.MIN_PROBLEMS_IMPOSED)
 
+    # Fitting a normalizer simulates an accuracy model until it crosses the
+    # proficiency threshold, so they are built once per instance and shared.
+    # _all_correct_normalizers is keyed by min_problems_required.
+    _all_correct_normalizers = {}
+    _had_wrong_normalizer_instance = None
+
     # Bound function objects to normalize the progress bar display from a probability
     # TODO(david): This is a bit of a hack to not have the normalizer move too
     #     slowly if the user got a lot of wrongs.
     def _all_correct_normalizer(self, prediction):
-        return InvFnExponentialNormalizer(
-            accuracy_model=AccuracyModel().update(correct=False),
-            proficiency_threshold=AccuracyModel.simulate([True] * self.min_problems_required)
-        ).normalize(prediction)
+        normalizer = UserExercise._all_correct_normalizers.get(self.min_problems_required)
+        if normalizer is None:
+            normalizer = InvFnExponentialNormalizer(
+                accuracy_model=AccuracyModel().update(correct=False),
+                proficiency_threshold=AccuracyModel.simulate([True] * self.min_problems_required)
+            )
+            UserExercise._all_correct_normalizers[self.min_problems_required] = normalizer
+        return normalizer.normalize(prediction)
 
     def _had_wrong_normalizer(self, prediction):
-        return InvFnExponentialNormalizer(
-            accuracy_model=AccuracyModel().update([False] * 3),
-            proficiency_threshold=consts.PROFICIENCY_ACCURACY_THRESHOLD
-        ).normalize(prediction)
+        if UserExercise._had_wrong_normalizer_instance is None:
+            UserExercise._had_wrong_normalizer_instance = InvFnExponentialNormalizer(
+                accuracy_model=AccuracyModel().update([False] * 3),
+                proficiency_threshold=consts.PROFICIENCY_ACCURACY_THRESHOLD
+            )
+        return UserExercise._had_wrong_normalizer_instance.normalize(prediction)
 
     @property
     def exercise_states(self):
@@ -512,6 +530,30 @@ class UserExercise(db.Model):
     def _is_struggling_old(self):
         return self.streak == 0 and self.total_done > 20
 
+    @staticmethod
+    def struggling_many(user_exercises, struggling_model=None):
+        """ Returns is_struggling(struggling_model) for each of user_exercises,
+        evaluating the accuracy models in one batch.
+        """
+        if struggling_model is None or struggling_model == 'old':
+            return [not user_exercise.has_been_proficient() and
+                    user_exercise._is_struggling_old()
+                    for user_exercise in user_exercises]
+
+        param = float(struggling_model.split('_')[1])
+        answer_histories, totals_done = accuracy_model_batch.pack_states(
+                [user_exercise.accuracy_model() for user_exercise in user_exercises])
+        predictions, _ = accuracy_model_batch.predict_many(
+                answer_histories, totals_done)
+        struggling = accuracy_model_batch.struggling_many(
+                totals_done, predictions,
+                param=param,
+                minimum_accuracy=consts.PROFICIENCY_ACCURACY_THRESHOLD,
+                minimum_attempts=consts.MIN_PROBLEMS_IMPOSED)
+
+        return [is_struggling and not user_exercise.has_been_proficient()
+                for user_exercise, is_struggling in itertools.izip(user_exercises, struggling)]
+
     @staticmethod
     @clamp(datetime.timedelta(days=consts.MIN_REVIEW_INTERVAL_DAYS),
             datetime.timedelta(days=consts.MAX_REVIEW_INTERVAL_DAYS))
@@ -661,12 +703,68 @@ class StudentList(db.Model):
     def get_students_data(self):
         return [s for s in self.students]
 
+    def prewarm_user_exercise_caches(self):
+        """ Rebuilds any missing UserExerciseCaches for this list's students
+        in the background, so coach reports don't have to.
+
+        Calls within the same few minutes are coalesced into a single task.
+        """
+        time_bucket = int(time.time()) // PREWARM_TASK_COALESCE_SECS
+        task_name = "prewarm_user_exercise_caches_%s_%d" % (self.key(), time_bucket)
+        task_name = re.sub(r'[^a-zA-Z0-9_-]{1}', '_', task_name)
+
+        try:
+            deferred.defer(prewarm_user_exercise_caches, self.key(),
+                           _name=task_name,
+                           _countdown=PREWARM_TASK_COALESCE_SECS,
+                           _queue="slow-background-queue")
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+
     @staticmethod
     def get_for_coach(key):
         query = StudentList.all()
         query.filter("coaches = ", key)
         return query
 
+PREWARM_TASK_COALESCE_SECS = 5 * 60
+PREWARM_STUDENTS_PER_TASK = 50
+
+def prewarm_user_exercise_caches(student_list_key, cursor=None):
+    """ Deferred task that brings the UserExerciseCaches of a StudentList's
+    students up to date, PREWARM_STUDENTS_PER_TASK at a time, chaining
+    itself until the whole list has been covered. Caches that can be
+    repacked are, and only missing or older ones are rebuilt.
+    """
+    query = UserData.all().filter("student_lists = ", student_list_key)
+    if cursor:
+        query.with_cursor(cursor)
+
+    students = query.fetch(PREWARM_STUDENTS_PER_TASK)
+    if not students:
+        return
+
+    user_exercise_caches = UserExerciseCache.get_by_key_name(
+            [UserExerciseCache.key_for_user_data(student) for student in students])
+    stale_students = []
+    caches_to_put = []
+    for student, user_exercise_cache in itertools.izip(students, user_exercise_caches):
+        if UserExerciseCache.repack(user_exercise_cache):
+            caches_to_put.append(user_exercise_cache)
+        elif (not user_exercise_cache or
+                user_exercise_cache.version != UserExerciseCache.CURRENT_VERSION):
+            stale_students.append(student)
+
+    if stale_students:
+        caches_to_put.extend(UserExerciseCache.rebuild(stale_students))
+
+    for future in UserExerciseCache.put_async_in_batches(caches_to_put):
+        future.get_result()
+
+    if len(students) == PREWARM_STUDENTS_PER_TASK:
+        deferred.defer(prewarm_user_exercise_caches, student_list_key, query.cursor(),
+                       _queue="slow-background-queue")
+
 class UserVideoCss(db.Model):
     user = db.UserProperty()
     video_css = db.TextProperty()
@@ -691,15 +789,106 @@ class UserVideoCss(db.Model):
 
     @staticmethod
     def set_started(user_data_key, item_key, version):
-        deferred.defer(set_css_deferred, user_data_key, item_key,
-                       UserVideoCss.STARTED, version,
-                       _queue="video-log-queue")
+        UserVideoCss._queue_transition(user_data_key, item_key,
+                                       UserVideoCss.STARTED, version)
 
     @staticmethod
     def set_completed(user_data_key, item_key, version):
-        deferred.defer(set_css_deferred, user_data_key, item_key,
-                       UserVideoCss.COMPLETED, version,
-                       _queue="video-log-queue")
+        UserVideoCss._queue_transition(user_data_key, item_key,
+                                       UserVideoCss.COMPLETED, version)
+
+    @staticmethod
+    def _queue_transition(user_data_key, item_key, status, version):
+        """ Adds a (video id, status, version) transition to the
+        video-css-buffer pull queue, tagged with the user's key, and makes
+        sure a flush_css_deferred task is scheduled to apply it.
+
+        All transitions queued for a user within VIDEO_CSS_FLUSH_DELAY_SECS
+        share one named task, so the UserVideoCss is read, rebuilt and put
+        once for all of them. If the pull queue is unavailable we fall back
+        to a set_css_deferred task for just this transition.
+        """
+        transition = (item_key.id(), status, version)
+        try:
+            taskqueue.Queue("video-css-buffer").add(taskqueue.Task(
+                    payload=pickle.dumps((transition, time.time()),
+                                         pickle.HIGHEST_PROTOCOL),
+                    method="PULL",
+                    tag=str(user_data_key)))
+        except taskqueue.Error:
+            deferred.defer(set_css_deferred, user_data_key, item_key,
+                           status, version,
+                           _queue="video-log-queue")
+            return
+
+        now = time.time()
+        time_bucket = int(now) // VIDEO_CSS_FLUSH_DELAY_SECS
+        task_name = "flush_css_%s_%d" % (user_data_key, time_bucket)
+        task_name = re.sub(r'[^a-zA-Z0-9_-]{1}', '_', task_name)
+
+        # Don't pay for a task add we already know will collide. This is
+        # only a hint: the transition itself is safe in the pull queue.
+        if request_cache.has(task_name) or memcache.get(task_name):
+            return
+
+        # Run once the window has closed, so every transition queued in it
+        # is in the pull queue by the time the flush leases them
+        countdown = (time_bucket + 1) * VIDEO_CSS_FLUSH_DELAY_SECS - now + 1
+
+        try:
+            deferred.defer(flush_css_deferred, user_data_key,
+                           _name=task_name,
+                           _countdown=countdown,
+                           _queue="video-log-queue")
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+
+        # Only now that the flush is known to exist, so a failed add is
+        # retried by the next transition
+        request_cache.set(task_name, True)
+        memcache.set(task_name, True, time=2 * VIDEO_CSS_FLUSH_DELAY_SECS)
+
+    @staticmethod
+    def _lease_pending(user_data_key):
+        """ Leases all of the user's queued transitions. Returns the leased
+        tasks and their transitions, oldest version first.
+        """
+        queue = taskqueue.Queue("video-css-buffer")
+        tasks = []
+        while True:
+            leased = queue.lease_tasks_by_tag(VIDEO_CSS_LEASE_SECS,
+                                              VIDEO_CSS_LEASE_BATCH_SIZE,
+                                              tag=str(user_data_key))
+            tasks.extend(leased)
+            if len(leased) < VIDEO_CSS_LEASE_BATCH_SIZE:
+                break
+
+        # lease_tasks_by_tag doesn't keep the order tasks were added in, so
+        # sort by version and then by the time each was queued
+        queued = [pickle.loads(task.payload) for task in tasks]
+        queued.sort(key=lambda (transition, time_queued): (transition[2], time_queued))
+        return tasks, [transition for transition, time_queued in queued]
+
+    def apply_transitions(self, transitions):
+        """ Applies (video id, status, version) transitions in order and
+        regenerates video_css once. Returns the highest version applied.
+        """
+        css = pickle.loads(self.pickled_dict)
+        version = 0
+
+        for video_id, status, transition_version in transitions:
+            id = '.v%d' % video_id
+            if status == UserVideoCss.STARTED:
+                css['completed'].discard(id)
+                css['started'].add(id)
+            else:
+                css['started'].discard(id)
+                css['completed'].add(id)
+            version = max(version, transition_version)
+
+        self.pickled_dict = pickle.dumps(css)
+        self.load_pickled()
+        return version
 
     @staticmethod
     def _chunker(seq, size):
@@ -723,23 +912,67 @@ class UserVideoCss(db.Model):
 
         self.video_css = ''.join(css_list)
 
+VIDEO_CSS_FLUSH_DELAY_SECS = 10
+VIDEO_CSS_LEASE_SECS = 60
+VIDEO_CSS_LEASE_BATCH_SIZE = 1000
+VIDEO_CSS_SWEEP_MAX_USERS = 100
+
 def set_css_deferred(user_data_key, video_key, status, version):
     user_data = UserData.get(user_data_key)
-    uvc = UserVideoCss.get_for_user_data(user_data)
-    css = pickle.loads(uvc.pickled_dict)
+    apply_css_transitions(user_data, [(video_key.id(), status, version)])
 
-    id = '.v%d' % video_key.id()
-    if status == UserVideoCss.STARTED:
-        css['completed'].discard(id)
-        css['started'].add(id)
-    else:
-        css['started'].discard(id)
-        css['completed'].add(id)
+def flush_css_deferred(user_data_key):
+    """ Applies every transition queued by UserVideoCss.set_started and
+    set_completed since the last flush in a single read-modify-write.
+    """
+    tasks, transitions = UserVideoCss._lease_pending(user_data_key)
+    if not tasks:
+        return
 
-    uvc.pickled_dict = pickle.dumps(css)
-    uvc.load_pickled()
+    queue = taskqueue.Queue("video-css-buffer")
+    try:
+        user_data = UserData.get(user_data_key)
+        apply_css_transitions(user_data, transitions)
+    except Exception:
+        # Give the transitions back right away, so the retry of this task
+        # can lease them again
+        for task in tasks:
+            queue.modify_task_lease(task, 0)
+        raise
+
+    queue.delete_tasks(tasks)
+
+    logging.info("Applied %d UserVideoCss transitions with 1 put" % len(transitions))
+
+def sweep_css_transitions(max_users=VIDEO_CSS_SWEEP_MAX_USERS):
+    """ Flushes the transitions of users whose flush_css_deferred task never
+    ran, oldest first. Run by cron.
+    """
+    queue = taskqueue.Queue("video-css-buffer")
+    for _ in xrange(max_users):
+        # With no tag given, this leases tasks of the oldest task's tag
+        tasks = queue.lease_tasks_by_tag(VIDEO_CSS_LEASE_SECS, 1)
+        if not tasks:
+            return
 
-    # if set_css_deferred runs out of order then we bump the version number
+        task = tasks[0]
+        queue.modify_task_lease(task, 0)
+
+        if task.eta_posix > time.time() - 2 * VIDEO_CSS_FLUSH_DELAY_SECS:
+            # Even the oldest transition's flush may still be on its way
+            return
+
+        try:
+            flush_css_deferred(db.Key(task.tag))
+        except Exception:
+            logging.exception("Failed to flush UserVideoCss transitions for %s" % task.tag)
+            return
+
+def apply_css_transitions(user_data, transitions):
+    uvc = UserVideoCss.get_for_user_data(user_data)
+    version = uvc.apply_transitions(transitions)
+
+    # if transitions are applied out of order then we bump the version number
     # to break the cache
     if version < uvc.version:
         version = uvc.version + 1
@@ -1740,6 +1973,7 @@ def preload_library(version):
     # causes circular importing if put at the top
     from library import library_content_html
     import autocomplete
+    import content_search
     import templatetags
 
     # preload library and autocomplete cache
@@ -1751,6 +1985,8 @@ def preload_library(version):
     logging.info("preloaded video autocomplete")
     autocomplete.topic_title_dicts(version.number)
     logging.info("preloaded topic autocomplete")
+    content_search.serialized_index(version.number)
+    logging.info("preloaded content search index")
     templatetags.topic_browser("browse", version.number)
     templatetags.topic_browser("browse-fixed", version.number)
     logging.info("preloaded topic_browser")
@@ -2599,7 +2835,8 @@ class Topic(Searchable, db.Model):
             else Setting.topic_tree_version(), 
             include_hidden),
         bigdata=True,
-        layer=layer_cache.Layers.Memcache)    
+        layer=layer_cache.Layers.Memcache,
+        stampede_protection=layer_cache.StampedeProtection())
     def get_all_topics(version=None, include_hidden=False):
         if not version:
             version = TopicVersion.get_default_version()
@@ -3618,6 +3855,29 @@ class UserTopic(db.Model):
         else:
             return UserTopic.get_by_key_name(key)
 
+    @staticmethod
+    def get_for_topics_and_user_data(topics, user_data):
+        """ Returns a UserTopic for each topic, fetched with a single
+        multi-get. UserTopics that don't exist yet are created in memory but
+        not put, so the caller can write them along with its other changes.
+        """
+        if not user_data:
+            return []
+
+        keys = [db.Key.from_path("UserTopic", UserTopic.get_key_name(topic, user_data))
+                for topic in topics]
+        user_topics = db.get(keys)
+
+        for i, topic in enumerate(topics):
+            if user_topics[i] is None:
+                user_topics[i] = UserTopic(
+                        key_name = keys[i].name(),
+                        title = topic.standalone_title,
+                        topic_key_name = topic.key().name(),
+                        user = user_data.user)
+
+        return user_topics
+
     # temporary function used for backfill
     @staticmethod
     def get_for_topic_and_user(topic, user, insert_if_missing=False):
@@ -3794,6 +4054,7 @@ class VideoLog(BackupModel):
         video_log.seconds_watched = seconds_watched
         video_log.last_second_watched = last_second_watched
 
+        user_topics = []
         if seconds_watched > 0:
             if user_video.seconds_watched == 0:
                 user_data.uservideocss_version += 1
@@ -3802,30 +4063,29 @@ class VideoLog(BackupModel):
             user_video.seconds_watched += seconds_watched
             user_data.total_seconds_watched += seconds_watched
 
-            # Update seconds_watched of all associated topics
-            video_topics = db.get(video.topic_string_keys)
+            # Update seconds_watched of all associated topics. The UserTopics
+            # are fetched together and written below along with user_video
+            # and user_data.
+            video_topics = [topic for topic in db.get(video.topic_string_keys) if topic]
+            user_topics = UserTopic.get_for_topics_and_user_data(video_topics, user_data)
 
-            first_topic = True
-            for topic in video_topics:
-                user_topic = UserTopic.get_for_topic_and_user_data(topic, user_data, insert_if_missing=True)
+            dt_now = datetime.datetime.now()
+            for topic, user_topic in zip(video_topics, user_topics):
                 user_topic.title = topic.standalone_title
                 user_topic.seconds_watched += seconds_watched
-                user_topic.last_watched = datetime.datetime.now()
-                user_topic.put()
+                user_topic.last_watched = dt_now
 
                 video_log.playlist_titles.append(user_topic.title)
 
-                if first_topic:
-                    action_cache.push_video_log(video_log)
+            if user_topics:
+                action_cache.push_video_log(video_log)
 
-                util_badges.update_with_user_topic(
+                util_badges.update_with_user_topics(
                         user_data,
-                        user_topic,
-                        include_other_badges=first_topic,
+                        user_topics,
+                        include_other_badges=True,
                         action_cache=action_cache)
 
-                first_topic = False
-
         user_video.last_second_watched = last_second_watched
         user_video.last_watched = datetime.datetime.now()
         user_video.duration = video.duration
@@ -3857,19 +4117,20 @@ class VideoLog(BackupModel):
             video_log.points_earned = video_points_received
             user_data.add_points(video_points_received)
 
-        db.put([user_video, user_data])
+        put_rpc = db.put_async([user_video, user_data] + user_topics)
 
-        # Defer the put of VideoLog for now, as we think it might be causing hot tablets
-        # and want to shift it off to an automatically-retrying task queue.
+        # Buffer the put of VideoLog for now, as we think it might be causing hot tablets
+        # and want to shift it off to an automatically-retrying, batched task queue.
         # http://ikaisays.com/2011/01/25/app-engine-datastore-tip-monotonically-increasing-values-are-bad/
-        deferred.defer(commit_video_log, video_log,
-                       _queue="video-log-queue")
+        VIDEO_LOG_BUFFER.add(video_log)
 
         if user_data is not None and user_data.coaches:
             # Making a separate queue for the log summaries so we can clearly see how much they are getting used
             deferred.defer(commit_log_summary_coaches, video_log, user_data.coaches,
                            _queue="log-summary-queue")
 
+        put_rpc.get_result()
+
         return (user_video, video_log, video_points_total, goals_updated)
 
     def time_started(self):
@@ -3907,6 +4168,13 @@ class VideoLog(BackupModel):
 def commit_video_log(video_log, user_data = None):
     video_log.put()
 
+# commit_video_logs writes a batch of VideoLogs drained from VIDEO_LOG_BUFFER
+def commit_video_logs(video_logs):
+    db.put(video_logs)
+
+VIDEO_LOG_BUFFER = log_buffer.LogBuffer("video-log-buffer", "video-log-queue",
+                                        commit_video_logs)
+
 class DailyActivityLog(db.Model):
     """ A log entry for a dashboard presented to users and coaches.
 
@@ -4182,18 +4450,81 @@ class ProblemLog(BackupModel):
 
 # commit_problem_log is used by our deferred problem log insertion process
 def commit_problem_log(problem_log_source, user_data = None):
+    if not is_committable_problem_log(problem_log_source):
+        return
+
+    # Committing transaction combines existing problem log with any followup attempts
+    def txn():
+        problem_log = ProblemLog.get_by_key_name(problem_log_source.key().name())
+        problem_log = merge_problem_log(problem_log, problem_log_source)
+        if problem_log:
+            logging.info(problem_log.time_ended())
+            problem_log.put()
+
+    db.run_in_transaction(txn)
+
+# commit_problem_logs writes a batch of ProblemLogs drained from
+# PROBLEM_LOG_BUFFER. Sources are grouped by their ProblemLog.key_for key
+# name, and each cross-group transaction multi-gets up to
+# PROBLEM_LOG_XG_GROUPS problem logs, merges in all of their followup
+# attempts and multi-puts the results.
+PROBLEM_LOG_XG_GROUPS = 5
+
+def commit_problem_logs(problem_log_sources):
+    sources_by_key_name = collections.OrderedDict()
+    for problem_log_source in problem_log_sources:
+        if is_committable_problem_log(problem_log_source):
+            key_name = problem_log_source.key().name()
+            sources_by_key_name.setdefault(key_name, []).append(problem_log_source)
+
+    def txn(key_names):
+        problem_logs = ProblemLog.get_by_key_name(key_names)
+
+        problem_logs_to_put = []
+        for key_name, problem_log in zip(key_names, problem_logs):
+            changed = False
+            for problem_log_source in sources_by_key_name[key_name]:
+                merged = merge_problem_log(problem_log, problem_log_source)
+                if merged:
+                    problem_log, changed = merged, True
+
+            if changed:
+                if problem_log.random_float is None:
+                    problem_log.random_float = random.random()
+                problem_logs_to_put.append(problem_log)
+
+        db.put(problem_logs_to_put)
+
+    key_names = sources_by_key_name.keys()
+    xg_on = db.create_transaction_options(xg=True)
+    for i in xrange(0, len(key_names), PROBLEM_LOG_XG_GROUPS):
+        db.run_in_transaction_options(xg_on, txn,
+                                      key_names[i:i + PROBLEM_LOG_XG_GROUPS])
+
+PROBLEM_LOG_BUFFER = log_buffer.LogBuffer("problem-log-buffer", "problem-log-queue",
+                                          commit_problem_logs)
+
+def is_committable_problem_log(problem_log_source):
     try:
         if not problem_log_source or not problem_log_source.key().name:
             logging.critical("Skipping problem log commit due to missing problem_log_source or key().name")
-            return
+            return False
     except db.NotSavedError:
         # Handle special case during new exercise deploy
         logging.critical("Skipping problem log commit due to db.NotSavedError")
-        return
+        return False
 
     if problem_log_source.count_attempts > 1000:
         logging.info("Ignoring attempt to write problem log w/ attempts over 1000.")
-        return
+        return False
+
+    return True
+
+def merge_problem_log(problem_log, problem_log_source):
+    """ Combines a followup attempt or hint into problem_log, creating it if
+    it's None. Returns the updated problem log, or None if problem_log_source
+    was already merged in by an earlier commit.
+    """
 
     # This does not have the same behavior as .insert(). This is used because
     # tasks can be run out of order so we extend the list as needed and insert
@@ -4203,78 +4534,70 @@ def commit_problem_log(problem_log_source, user_data = None):
             items.extend([filler] * (index + 1 - len(items)))
         items[index] = val
 
-    # Committing transaction combines existing problem log with any followup attempts
-    def txn():
-        problem_log = ProblemLog.get_by_key_name(problem_log_source.key().name())
-
-        if not problem_log:
-            problem_log = ProblemLog(
-                key_name = problem_log_source.key().name(),
-                user = problem_log_source.user,
-                exercise = problem_log_source.exercise,
-                problem_number = problem_log_source.problem_number,
-                time_done = problem_log_source.time_done,
-                sha1 = problem_log_source.sha1,
-                seed = problem_log_source.seed,
-                problem_type = problem_log_source.problem_type,
-                suggested = problem_log_source.suggested,
-                exercise_non_summative = problem_log_source.exercise_non_summative,
-                ip_address = problem_log_source.ip_address,
-                review_mode = problem_log_source.review_mode,
-        )
-
-        problem_log.count_hints = max(problem_log.count_hints, problem_log_source.count_hints)
-        problem_log.hint_used = problem_log.count_hints > 0
-        index_attempt = max(0, problem_log_source.count_attempts - 1)
-
-        # Bump up attempt count
-        if problem_log_source.attempts[0] != "hint": # attempt
-            if index_attempt < len(problem_log.time_taken_attempts) \
-               and problem_log.time_taken_attempts[index_attempt] != -1:
-                # This attempt has already been logged. Ignore this dupe taskqueue execution.
-                logging.info("Skipping problem log commit due to dupe taskqueue\
-                    execution for attempt: %s, key.name: %s" % \
-                    (index_attempt, problem_log_source.key().name()))
-                return
-
-            problem_log.count_attempts += 1
-
-            # Add time_taken for this individual attempt
-            problem_log.time_taken += problem_log_source.time_taken
-            insert_in_position(index_attempt, problem_log.time_taken_attempts, problem_log_source.time_taken, filler=-1)
+    if not problem_log:
+        problem_log = ProblemLog(
+            key_name = problem_log_source.key().name(),
+            user = problem_log_source.user,
+            exercise = problem_log_source.exercise,
+            problem_number = problem_log_source.problem_number,
+            time_done = problem_log_source.time_done,
+            sha1 = problem_log_source.sha1,
+            seed = problem_log_source.seed,
+            problem_type = problem_log_source.problem_type,
+            suggested = problem_log_source.suggested,
+            exercise_non_summative = problem_log_source.exercise_non_summative,
+            ip_address = problem_log_source.ip_address,
+            review_mode = problem_log_source.review_mode,
+    )
+
+    problem_log.count_hints = max(problem_log.count_hints, problem_log_source.count_hints)
+    problem_log.hint_used = problem_log.count_hints > 0
+    index_attempt = max(0, problem_log_source.count_attempts - 1)
+
+    # Bump up attempt count
+    if problem_log_source.attempts[0] != "hint": # attempt
+        if index_attempt < len(problem_log.time_taken_attempts) \
+           and problem_log.time_taken_attempts[index_attempt] != -1:
+            # This attempt has already been logged. Ignore this dupe taskqueue execution.
+            logging.info("Skipping problem log commit due to dupe taskqueue\
+                execution for attempt: %s, key.name: %s" % \
+                (index_attempt, problem_log_source.key().name()))
+            return None
 
-            # Add actual attempt content
-            insert_in_position(index_attempt, problem_log.attempts, problem_log_source.attempts[0], filler="")
+        problem_log.count_attempts += 1
 
-            # Proficiency earned should never change per problem
-            problem_log.earned_proficiency = problem_log.earned_proficiency or \
-                problem_log_source.earned_proficiency
+        # Add time_taken for this individual attempt
+        problem_log.time_taken += problem_log_source.time_taken
+        insert_in_position(index_attempt, problem_log.time_taken_attempts, problem_log_source.time_taken, filler=-1)
 
-        else: # hint
-            index_hint = max(0, problem_log_source.count_hints - 1)
+        # Add actual attempt content
+        insert_in_position(index_attempt, problem_log.attempts, problem_log_source.attempts[0], filler="")
 
-            if index_hint < len(problem_log.hint_time_taken_list) \
-               and problem_log.hint_time_taken_list[index_hint] != -1:
-                # This attempt has already been logged. Ignore this dupe taskqueue execution.
-                return
+        # Proficiency earned should never change per problem
+        problem_log.earned_proficiency = problem_log.earned_proficiency or \
+            problem_log_source.earned_proficiency
 
-            # Add time taken for hint
-            insert_in_position(index_hint, problem_log.hint_time_taken_list, problem_log_source.time_taken, filler=-1)
+    else: # hint
+        index_hint = max(0, problem_log_source.count_hints - 1)
 
-            # Add attempt number this hint follows
-            insert_in_position(index_hint, problem_log.hint_after_attempt_list, problem_log_source.count_attempts, filler=-1)
+        if index_hint < len(problem_log.hint_time_taken_list) \
+           and problem_log.hint_time_taken_list[index_hint] != -1:
+            # This attempt has already been logged. Ignore this dupe taskqueue execution.
+            return None
 
-        # Points should only be earned once per problem, regardless of attempt count
-        problem_log.points_earned = max(problem_log.points_earned, problem_log_source.points_earned)
+        # Add time taken for hint
+        insert_in_position(index_hint, problem_log.hint_time_taken_list, problem_log_source.time_taken, filler=-1)
 
-        # Correct cannot be changed from False to True after first attempt
-        problem_log.correct = (problem_log_source.count_attempts == 1 or problem_log.correct) and problem_log_source.correct and not problem_log.count_hints
+        # Add attempt number this hint follows
+        insert_in_position(index_hint, problem_log.hint_after_attempt_list, problem_log_source.count_attempts, filler=-1)
 
-        logging.info(problem_log.time_ended())
-        problem_log.put()
+    # Points should only be earned once per problem, regardless of attempt count
+    problem_log.points_earned = max(problem_log.points_earned, problem_log_source.points_earned)
 
+    # Correct cannot be changed from False to True after first attempt
+    problem_log.correct = (problem_log_source.count_attempts == 1 or problem_log.correct) and problem_log_source.correct and not problem_log.count_hints
 
-    db.run_in_transaction(txn)
+    return problem_log
 
 # Represents a matching between a playlist and a video
 # Allows us to keep track of which videos are in a playlist and
@@ -4477,10 +4800,14 @@ class UserExerciseCache(db.Model):
 
     # Bump this whenever you change the structure of the cached UserExercises
     # and need to invalidate all old caches
-    CURRENT_VERSION = 9
+    CURRENT_VERSION = 10
+
+    # Version 9 caches hold the same dicts, pickled instead of packed. They
+    # are repacked on read rather than rebuilt from UserExercises.
+    REPACKABLE_VERSION = 9
 
     version = db.IntegerProperty()
-    dicts = object_property.UnvalidatedObjectProperty()
+    dicts = object_property.PackedUserExerciseDictsProperty()
 
     def user_exercise_dict(self, exercise_name):
         return self.dicts.get(exercise_name) or UserExerciseCache.dict_from_user_exercise(None)
@@ -4492,6 +4819,20 @@ class UserExerciseCache(db.Model):
     def key_for_user_data(user_data):
         return "UserExerciseCache:%s" % user_data.key_email
 
+    @staticmethod
+    def repack(user_exercise_cache):
+        """ Brings a REPACKABLE_VERSION cache up to CURRENT_VERSION in place,
+        and returns whether it could. The caller still has to put it.
+        """
+        if (user_exercise_cache and
+                user_exercise_cache.version == UserExerciseCache.REPACKABLE_VERSION and
+                user_exercise_cache.dicts is not None):
+            # Already unpickled by PackedUserExerciseDictsProperty, so
+            # it only needs to be put back in the packed format.
+            user_exercise_cache.version = UserExerciseCache.CURRENT_VERSION
+            return True
+        return False
+
     @staticmethod
     def get(user_data_or_list):
         if not user_data_or_list:
@@ -4509,57 +4850,34 @@ class UserExerciseCache(db.Model):
                 )
 
         # For any that are missing or are out of date,
-        # build up asynchronous queries to repopulate their data
-        async_queries = []
+        # collect them to be rebuilt from UserExercises
         missing_cache_indices = []
+        caches_to_put = []
         for i, user_exercise_cache in enumerate(user_exercise_caches):
-            if not user_exercise_cache or user_exercise_cache.version != UserExerciseCache.CURRENT_VERSION:
+            if UserExerciseCache.repack(user_exercise_cache):
+                caches_to_put.append(user_exercise_cache)
+
+            elif not user_exercise_cache or user_exercise_cache.version != UserExerciseCache.CURRENT_VERSION:
                 # Null out the reference so the gc can collect, in case it's
                 # a stale version, since we're going to rebuild it below.
                 user_exercise_caches[i] = None
 
                 # This user's cached graph is missing or out-of-date,
                 # put it in the list of graphs to be regenerated.
-                async_queries.append(UserExercise.get_for_user_data(user_data_list[i]))
                 missing_cache_indices.append(i)
 
-        if len(async_queries) > 0:
-            caches_to_put = []
-
-            # Run the async queries in batches to avoid exceeding memory limits.
-            # Some coaches can have lots of active students, and their user
-            # exercise information is too much for app engine instances.
-            BATCH_SIZE = 5
-            for i in range(0, len(async_queries), BATCH_SIZE):
-                tasks = util.async_queries(async_queries[i:i+BATCH_SIZE])
-
-                # Populate the missing graphs w/ results from async queries
-                for j, task in enumerate(tasks):
-                    user_index = missing_cache_indices[i + j]
-                    user_data = user_data_list[user_index]
-                    user_exercises = task.get_result()
-
-                    user_exercise_cache = UserExerciseCache.generate(user_data, user_exercises)
-                    user_exercise_caches[user_index] = user_exercise_cache
+        if missing_cache_indices:
+            rebuilt_caches = UserExerciseCache.rebuild(
+                    [user_data_list[i] for i in missing_cache_indices])
 
-                    if len(caches_to_put) < 10:
-                        # We only put 10 at a time in case a teacher views a report w/ tons and tons of uncached students
-                        caches_to_put.append(user_exercise_cache)
+            for i, user_exercise_cache in itertools.izip(missing_cache_indices, rebuilt_caches):
+                user_exercise_caches[i] = user_exercise_cache
+                caches_to_put.append(user_exercise_cache)
 
-            # Null out references explicitly for GC.
-            tasks = None
-            async_queries = None
-
-            if len(caches_to_put) > 0:
-                # Fire off an asynchronous put to cache the missing results. On the production server,
-                # we don't wait for the put to finish before dealing w/ the rest of the request
-                # because we don't really care if the cache misses.
-                future_put = db.put_async(caches_to_put)
-
-                if App.is_dev_server:
-                    # On the dev server, we have to explicitly wait for get_result in order to
-                    # trigger the put (not truly asynchronous).
-                    future_put.get_result()
+        # On the production server, we don't wait for the puts to finish
+        # before dealing w/ the rest of the request because we don't really
+        # care if the cache misses.
+        UserExerciseCache.put_async_in_batches(caches_to_put)
 
         if not user_exercise_caches:
             return []
@@ -4568,14 +4886,74 @@ class UserExerciseCache(db.Model):
         # otherwise return single cache
         return user_exercise_caches if type(user_data_or_list) == list else user_exercise_caches[0]
 
+    # Number of UserExercise queries kept in flight while rebuilding caches.
+    # Some coaches can have lots of active students, and holding all of
+    # their user exercise information at once is too much for app engine
+    # instances.
+    REBUILD_WINDOW_SIZE = 5
+
+    # Number of caches per asynchronous put when persisting rebuilt caches
+    PUT_BATCH_SIZE = 25
+
+    @staticmethod
+    def rebuild(user_data_list):
+        """ Rebuilds the caches of user_data_list from their UserExercises.
+
+        Keeps at most REBUILD_WINDOW_SIZE UserExercise queries in flight and
+        turns each user's results into a cache as soon as they're read, so
+        only the compact caches are held on to, never every user's
+        UserExercises at once.
+        """
+        def start_query(user_data):
+            # run() issues the first batch's RPC right away
+            return UserExercise.get_for_user_data(user_data).run(batch_size=1000)
+
+        caches = []
+        in_flight = collections.deque()
+        pending = iter(user_data_list)
+
+        for user_data in itertools.islice(pending, UserExerciseCache.REBUILD_WINDOW_SIZE):
+            in_flight.append((user_data, start_query(user_data)))
+
+        while in_flight:
+            user_data, results = in_flight.popleft()
+            user_exercises = list(results)
+
+            # Keep the window full while this user's cache is generated
+            for next_user_data in itertools.islice(pending, 1):
+                in_flight.append((next_user_data, start_query(next_user_data)))
+
+            caches.append(UserExerciseCache.generate(user_data, user_exercises))
+
+        return caches
+
     @staticmethod
-    def dict_from_user_exercise(user_exercise, struggling_model=None):
+    def put_async_in_batches(user_exercise_caches):
+        """ Fires off asynchronous puts of PUT_BATCH_SIZE caches each. """
+        batch_size = UserExerciseCache.PUT_BATCH_SIZE
+        futures = [db.put_async(user_exercise_caches[i:i + batch_size])
+                   for i in xrange(0, len(user_exercise_caches), batch_size)]
+
+        if App.is_dev_server:
+            # On the dev server, we have to explicitly wait for get_result in order to
+            # trigger the put (not truly asynchronous).
+            for future in futures:
+                future.get_result()
+
+        return futures
+
+    @staticmethod
+    def dict_from_user_exercise(user_exercise, struggling_model=None, struggling=None):
+        # struggling may be precomputed by UserExercise.struggling_many
+        if struggling is None:
+            struggling = user_exercise.is_struggling(struggling_model) if user_exercise else False
+
         # TODO(david): We can probably remove some of this stuff here.
         return {
                 "streak": user_exercise.streak if user_exercise else 0,
                 "longest_streak": user_exercise.longest_streak if user_exercise else 0,
                 "progress": user_exercise.progress if user_exercise else 0.0,
-                "struggling": user_exercise.is_struggling(struggling_model) if user_exercise else False,
+                "struggling": struggling,
                 "total_done": user_exercise.total_done if user_exercise else 0,
                 "last_done": user_exercise.last_done if user_exercise else datetime.datetime.min,
                 "last_review": user_exercise.last_review if user_exercise else datetime.datetime.min,
@@ -4600,10 +4978,13 @@ class UserExerciseCache(db.Model):
 
         dicts = {}
 
+        user_exercises = list(user_exercises)
+        struggling_flags = UserExercise.struggling_many(user_exercises, struggling_model)
+
         # Build up cache
-        for user_exercise in user_exercises:
+        for user_exercise, struggling in itertools.izip(user_exercises, struggling_flags):
             user_exercise_dict = UserExerciseCache.dict_from_user_exercise(
-                    user_exercise, struggling_model)
+                    user_exercise, struggling_model, struggling)
 
             # In case user has multiple UserExercise mappings for a specific exercise,
             # always prefer the one w/ more problems done
@@ -4616,19 +4997,180 @@ class UserExerciseCache(db.Model):
                 dicts = dicts,
             )
 
+class ExerciseGraphIndex(object):
+    """ Compiled topology of the exercise catalog, shared by every user's
+    UserExerciseGraph.
+
+    Exercises are numbered by catalog order and their covers, coverers and
+    prerequisites are stored as CSR-style adjacency arrays (the neighbours
+    of exercise i are targets[offsets[i]:offsets[i + 1]]), along with a
+    topological order (coverers before the exercises they cover) and the
+    knowledge map's h/v position order. UserExerciseGraph.generate only
+    overlays per-user state onto this.
+
+    Indexes are held in instance memory and keyed by catalog version (see
+    Setting.cached_exercises_date) and by whether unlive exercises are
+    visible, so a new catalog only costs one rebuild per instance. Nothing
+    in an index may be mutated after it's built.
+    """
+
+    _indexes = {}
+
+    def __init__(self, exercise_dicts):
+        # In case the catalog has duplicate names, keep the first one
+        self.names = []
+        self.ids = {}
+        self.exercise_dicts = []
+        for exercise_dict in exercise_dicts:
+            if exercise_dict["name"] not in self.ids:
+                self.ids[exercise_dict["name"]] = len(self.names)
+                self.names.append(exercise_dict["name"])
+                self.exercise_dicts.append(exercise_dict)
+
+        def edges(field):
+            return [[self.ids[name] for name in exercise_dict[field] if name in self.ids]
+                    for exercise_dict in self.exercise_dicts]
+
+        covers = edges("covers")
+        coverers = [[] for _ in self.names]
+        for i, covered_ids in enumerate(covers):
+            for covered_id in covered_ids:
+                coverers[covered_id].append(i)
+
+        self.covers_offsets, self.covers_targets = ExerciseGraphIndex._csr(covers)
+        self.coverers_offsets, self.coverers_targets = ExerciseGraphIndex._csr(coverers)
+        self.prerequisites_offsets, self.prerequisites_targets = (
+                ExerciseGraphIndex._csr(edges("prerequisites")))
+
+        self.position_order = array.array('i', sorted(
+                xrange(len(self.names)),
+                key=lambda i: (self.exercise_dicts[i]["h_position"],
+                               self.exercise_dicts[i]["v_position"])))
+
+        self.topological_order = self._topological_order()
+
+        self._covered_closures = {}
+
+    @staticmethod
+    def _csr(adjacency):
+        offsets = array.array('i', [0])
+        targets = array.array('i')
+        for neighbours in adjacency:
+            targets.extend(neighbours)
+            offsets.append(len(targets))
+        return offsets, targets
+
+    def covers_of(self, i):
+        return self.covers_targets[self.covers_offsets[i]:self.covers_offsets[i + 1]]
+
+    def coverers_of(self, i):
+        return self.coverers_targets[self.coverers_offsets[i]:self.coverers_offsets[i + 1]]
+
+    def prerequisites_of(self, i):
+        return self.prerequisites_targets[self.prerequisites_offsets[i]:self.prerequisites_offsets[i + 1]]
+
+    def _topological_order(self):
+        """ Exercise ids with every exercise after all of its coverers.
+        Exercises on covering cycles (bad data) go last, in catalog order.
+        """
+        uncovered_counts = [self.coverers_offsets[i + 1] - self.coverers_offsets[i]
+                            for i in xrange(len(self.names))]
+
+        order = array.array('i', [i for i, count in enumerate(uncovered_counts) if not count])
+        for i in order:
+            for covered_id in self.covers_of(i):
+                uncovered_counts[covered_id] -= 1
+                if not uncovered_counts[covered_id]:
+                    order.append(covered_id)
+
+        if len(order) < len(self.names):
+            ordered = set(order)
+            order.extend(i for i in xrange(len(self.names)) if i not in ordered)
+
+        return order
+
+    def covered_closure(self, exercise_name):
+        """ Returns exercise_name and the names of every exercise it
+        transitively covers.
+
+        These are the exercises whose implicit proficiency and review
+        schedule can change when exercise_name's state changes.
+        """
+        closure = self._covered_closures.get(exercise_name)
+        if closure is None:
+            closure = []
+            if exercise_name in self.ids:
+                ids = [self.ids[exercise_name]]
+                seen = set(ids)
+                for i in ids:
+                    for covered_id in self.covers_of(i):
+                        if covered_id not in seen:
+                            seen.add(covered_id)
+                            ids.append(covered_id)
+                closure = [self.names[i] for i in ids]
+            self._covered_closures[exercise_name] = closure
+        return closure
+
+    @staticmethod
+    def get():
+        key = (Setting.cached_exercises_date(), user_util.is_current_user_developer())
+        index = ExerciseGraphIndex._indexes.get(key)
+
+        if index is None:
+            index = ExerciseGraphIndex(UserExerciseGraph.exercise_dicts())
+
+            # Drop indexes for older catalog versions
+            ExerciseGraphIndex._indexes = dict(
+                    (other_key, other_index)
+                    for other_key, other_index in ExerciseGraphIndex._indexes.iteritems()
+                    if other_key[0] == key[0])
+            ExerciseGraphIndex._indexes[key] = index
+
+        return index
+
+
 class UserExerciseGraph(object):
 
-    def __init__(self, graph={}, cache=None):
+    def __init__(self, graph={}, cache=None, exercise_graph_index=None):
         self.graph = graph
         self.cache = cache
+        self.exercise_graph_index = exercise_graph_index
+
+        # Names suggested from beyond the proficiency boundary, kept so that
+        # update() can skip recomputing them when no proficiency changed.
+        self._boundary_names = None
+
+        self._invalidate_views()
+
+    def _invalidate_views(self):
+        """ Drops the memoized views below. Must be called whenever graph
+        dicts are mutated.
+        """
+        self._sorted_graph_dicts = None
+        self._suggested_graph_dicts = None
+        self._proficient_graph_dicts = None
+        self._review_graph_dicts = None
+        self._review_exercise_names = None
+
+    def _sorted(self):
+        if self._sorted_graph_dicts is None:
+            if self.exercise_graph_index is not None:
+                names = self.exercise_graph_index.names
+                self._sorted_graph_dicts = [self.graph[names[i]]
+                        for i in self.exercise_graph_index.position_order]
+            else:
+                self._sorted_graph_dicts = sorted(sorted(self.graph.values(),
+                             key=lambda graph_dict: graph_dict["v_position"]),
+                             key=lambda graph_dict: graph_dict["h_position"])
+        return self._sorted_graph_dicts
 
     def graph_dict(self, exercise_name):
         return self.graph.get(exercise_name)
 
+    # The *_graph_dicts() methods return copies of the memoized lists, since
+    # callers are free to modify them.
     def graph_dicts(self):
-        return sorted(sorted(self.graph.values(),
-                             key=lambda graph_dict: graph_dict["v_position"]),
-                             key=lambda graph_dict: graph_dict["h_position"])
+        return list(self._sorted())
 
     def proficient_exercise_names(self):
         return [graph_dict["name"] for graph_dict in self.proficient_graph_dicts()]
@@ -4639,26 +5181,37 @@ class UserExerciseGraph(object):
     def review_exercise_names(self):
         return [graph_dict["name"] for graph_dict in self.review_graph_dicts()]
 
+    def is_reviewing(self, exercise_name):
+        if self._review_exercise_names is None:
+            self._review_exercise_names = set(self.review_exercise_names())
+        return exercise_name in self._review_exercise_names
+
     def has_completed_review(self):
         # TODO(david): This should return whether the user has completed today's
         #     review session.
-        return not self.review_exercise_names()
+        return not self.reviews_left_count()
 
     def reviews_left_count(self):
         # TODO(david): For future algorithms this should return # reviews left
         #     for today's review session.
         # TODO(david): Make it impossible to have >= 100 reviews.
-        return len(self.review_exercise_names())
+        if self._review_graph_dicts is None:
+            self.review_graph_dicts()
+        return len(self._review_graph_dicts)
 
     def suggested_graph_dicts(self):
-        return [graph_dict for graph_dict in self.graph_dicts() if graph_dict["suggested"]]
+        if self._suggested_graph_dicts is None:
+            self._suggested_graph_dicts = [graph_dict for graph_dict in self._sorted() if graph_dict["suggested"]]
+        return list(self._suggested_graph_dicts)
 
     def proficient_graph_dicts(self):
-        return [graph_dict for graph_dict in self.graph_dicts() if graph_dict["proficient"]]
+        if self._proficient_graph_dicts is None:
+            self._proficient_graph_dicts = [graph_dict for graph_dict in self._sorted() if graph_dict["proficient"]]
+        return list(self._proficient_graph_dicts)
 
     def recent_graph_dicts(self, n_recent=2):
         return sorted(
-                [graph_dict for graph_dict in self.graph_dicts() if graph_dict["last_done"]],
+                [graph_dict for graph_dict in self._sorted() if graph_dict["last_done"]],
                 reverse=True,
                 key=lambda graph_dict: graph_dict["last_done"],
                 )[0:n_recent]
@@ -4719,11 +5272,14 @@ class UserExerciseGraph(object):
 
             return graph_dict["is_ancestor_review_candidate"]
 
-        for graph_dict in self.graph_dicts():
+        if self._review_graph_dicts is not None:
+            return list(self._review_graph_dicts)
+
+        for graph_dict in self._sorted():
             compute_next_review(graph_dict)
 
         candidate_dicts = []
-        for graph_dict in self.graph_dicts():
+        for graph_dict in self._sorted():
             if (not graph_dict["summative"] and
                     graph_dict["proficient"] and
                     graph_dict["next_review"] <= now and
@@ -4739,7 +5295,8 @@ class UserExerciseGraph(object):
                     graph_dict["streak"] == 0):
                 review_dicts.append(graph_dict)
 
-        return review_dicts
+        self._review_graph_dicts = review_dicts
+        return list(review_dicts)
 
     def states(self, exercise_name):
         graph_dict = self.graph_dict(exercise_name)
@@ -4749,7 +5306,7 @@ class UserExerciseGraph(object):
             "suggested": graph_dict["suggested"],
             "struggling": graph_dict["struggling"],
             "summative": graph_dict["summative"],
-            "reviewing": graph_dict in self.review_graph_dicts(),
+            "reviewing": self.is_reviewing(exercise_name),
         }
 
     @staticmethod
@@ -4768,10 +5325,10 @@ class UserExerciseGraph(object):
         if not user_exercise_cache_list:
             return [] if type(user_data_or_list) == list else None
 
-        exercise_dicts = UserExerciseGraph.exercise_dicts()
+        exercise_graph_index = ExerciseGraphIndex.get()
 
         user_exercise_graphs = map(
-                lambda (user_data, user_exercise_cache): UserExerciseGraph.generate(user_data, user_exercise_cache, exercise_dicts),
+                lambda (user_data, user_exercise_cache): UserExerciseGraph.generate(user_data, user_exercise_cache, exercise_graph_index),
                 itertools.izip(user_data_list, user_exercise_cache_list))
 
         # Return list of graphs if a list was passed in,
@@ -4800,10 +5357,64 @@ class UserExerciseGraph(object):
         return map(UserExerciseGraph.dict_from_exercise, Exercise.get_all_use_cache())
 
     @staticmethod
-    def get_and_update(user_data, user_exercise):
+    def get_and_update(user_data, user_exercise, user_exercise_graph=None):
+        """ Returns the user's graph updated with user_exercise's new state.
+
+        If the user's graph was already generated earlier in the request, pass
+        it in as user_exercise_graph: it is updated in place, re-evaluating
+        only the exercises affected by user_exercise, instead of being
+        regenerated from the whole catalog.
+        """
+        if user_exercise_graph is not None and user_exercise_graph.cache is not None:
+            user_exercise_graph.cache.update(user_exercise)
+            user_exercise_graph.update(user_data, user_exercise.exercise)
+            return user_exercise_graph
+
         user_exercise_cache = UserExerciseCache.get(user_data)
         user_exercise_cache.update(user_exercise)
-        return UserExerciseGraph.generate(user_data, user_exercise_cache, UserExerciseGraph.exercise_dicts())
+        return UserExerciseGraph.generate(user_data, user_exercise_cache, ExerciseGraphIndex.get())
+
+    def update(self, user_data, exercise_name, exercise_graph_index=None):
+        """ Re-evaluates the graph after exercise_name's entry in self.cache
+        or user_data's explicit proficiencies changed.
+
+        Only exercise_name and the exercises it transitively covers can change
+        proficiency or review schedule. Suggestions are re-marked from the
+        cached proficiency boundary unless some proficiency changed.
+        """
+        graph_dict = self.graph.get(exercise_name)
+        if graph_dict is None:
+            return self
+
+        if exercise_graph_index is None:
+            exercise_graph_index = ExerciseGraphIndex.get()
+
+        graph_dict.update(self.cache.user_exercise_dict(exercise_name))
+
+        affected_dicts = [self.graph[name] for name in exercise_graph_index.covered_closure(exercise_name)
+                          if name in self.graph]
+        previously_proficient = [affected_dict["proficient"] for affected_dict in affected_dicts]
+
+        for affected_dict in affected_dicts:
+            if affected_dict["name"] in user_data.proficient_exercises:
+                affected_dict["proficient"] = affected_dict["explicitly_proficient"] = True
+            else:
+                affected_dict["proficient"] = affected_dict["explicitly_proficient"] = None
+
+            # Review state is derived from coverers, so it's stale too
+            affected_dict.pop("next_review", None)
+            affected_dict.pop("is_ancestor_review_candidate", None)
+
+        for affected_dict in affected_dicts:
+            UserExerciseGraph.set_implicit_proficiency(affected_dict)
+
+        if any(affected_dict["proficient"] != was_proficient
+               for affected_dict, was_proficient in itertools.izip(affected_dicts, previously_proficient)):
+            self._boundary_names = None
+
+        self.mark_suggested_from_boundary()
+
+        return self
 
     @staticmethod
     def get_boundary_names(graph):
@@ -4892,58 +5503,64 @@ class UserExerciseGraph(object):
         they will always be returned by suggested_graph_dicts()
         sorted by knowledge map position. We might want to change that.
         """
+        return UserExerciseGraph(graph=graph).mark_suggested_from_boundary().graph
+
+    def mark_suggested_from_boundary(self):
+        """ Same as mark_suggested, but reuses the boundary names computed by
+        a previous call unless update() invalidated them.
+        """
         num_to_suggest = 5
-        suggested_names = UserExerciseGraph.get_attempted_names(graph)
+        suggested_names = UserExerciseGraph.get_attempted_names(self.graph)
 
         if len(suggested_names) < num_to_suggest:
-            boundary_names = UserExerciseGraph.get_boundary_names(graph)
-            suggested_names.extend(boundary_names)
+            if self._boundary_names is None:
+                self._boundary_names = UserExerciseGraph.get_boundary_names(self.graph)
+            suggested_names.extend(self._boundary_names)
 
-        suggested_names = suggested_names[:num_to_suggest]
+        suggested_names = set(suggested_names[:num_to_suggest])
 
-        for exercise_name in graph:
+        for exercise_name in self.graph:
             is_suggested = exercise_name in suggested_names
-            graph[exercise_name]["suggested"] = is_suggested
+            self.graph[exercise_name]["suggested"] = is_suggested
 
-        return graph
+        self._invalidate_views()
+        return self
 
     @staticmethod
-    def generate(user_data, user_exercise_cache, exercise_dicts):
+    def set_implicit_proficiency(graph_dict):
+        if graph_dict["proficient"] is not None:
+            return graph_dict["proficient"]
 
-        graph = {}
+        graph_dict["proficient"] = False
 
-        # Build up base of graph
-        for exercise_dict in exercise_dicts:
+        # Consider an exercise implicitly proficient if the user has
+        # never missed a problem and a covering ancestor is proficient
+        if graph_dict["streak"] == graph_dict["total_done"]:
+            for covering_graph_dict in graph_dict["coverer_dicts"]:
+                if UserExerciseGraph.set_implicit_proficiency(covering_graph_dict):
+                    graph_dict["proficient"] = True
+                    break
 
-            user_exercise_dict = user_exercise_cache.user_exercise_dict(exercise_dict["name"])
+        return graph_dict["proficient"]
 
-            graph_dict = {}
+    @staticmethod
+    def generate(user_data, user_exercise_cache, exercise_graph_index):
 
-            graph_dict.update(user_exercise_dict)
-            graph_dict.update(exercise_dict)
-            graph_dict.update({
-                "coverer_dicts": [],
-                "prerequisite_dicts": [],
-            })
+        graph = {}
+        graph_dicts = []
 
-            # In case user has multiple UserExercise mappings for a specific exercise,
-            # always prefer the one w/ more problems done
-            if graph_dict["name"] not in graph or graph[graph_dict["name"]]["total_done"] < graph_dict["total_done"]:
-                graph[graph_dict["name"]] = graph_dict
-
-        # Cache coverers and prereqs for later
-        for graph_dict in graph.itervalues():
-            # Cache coverers
-            for covered_exercise_name in graph_dict["covers"]:
-                covered_graph_dict = graph.get(covered_exercise_name)
-                if covered_graph_dict:
-                    covered_graph_dict["coverer_dicts"].append(graph_dict)
-
-            # Cache prereqs
-            for prerequisite_exercise_name in graph_dict["prerequisites"]:
-                prerequisite_graph_dict = graph.get(prerequisite_exercise_name)
-                if prerequisite_graph_dict:
-                    graph_dict["prerequisite_dicts"].append(prerequisite_graph_dict)
+        # Overlay the user's state onto the catalog
+        for name, exercise_dict in itertools.izip(exercise_graph_index.names,
+                                                  exercise_graph_index.exercise_dicts):
+            graph_dict = dict(exercise_dict)
+            graph_dict.update(user_exercise_cache.user_exercise_dict(name))
+            graph[name] = graph_dict
+            graph_dicts.append(graph_dict)
+
+        # Link coverers and prereqs
+        for i, graph_dict in enumerate(graph_dicts):
+            graph_dict["coverer_dicts"] = [graph_dicts[j] for j in exercise_graph_index.coverers_of(i)]
+            graph_dict["prerequisite_dicts"] = [graph_dicts[j] for j in exercise_graph_index.prerequisites_of(i)]
 
         # Set explicit proficiencies
         for exercise_name in user_data.proficient_exercises:
@@ -4951,30 +5568,14 @@ class UserExerciseGraph(object):
             if graph_dict:
                 graph_dict["proficient"] = graph_dict["explicitly_proficient"] = True
 
-        # Calculate implicit proficiencies
-        def set_implicit_proficiency(graph_dict):
-            if graph_dict["proficient"] is not None:
-                return graph_dict["proficient"]
-
-            graph_dict["proficient"] = False
-
-            # Consider an exercise implicitly proficient if the user has
-            # never missed a problem and a covering ancestor is proficient
-            if graph_dict["streak"] == graph_dict["total_done"]:
-                for covering_graph_dict in graph_dict["coverer_dicts"]:
-                    if set_implicit_proficiency(covering_graph_dict):
-                        graph_dict["proficient"] = True
-                        break
-
-            return graph_dict["proficient"]
-
-        for exercise_name in graph:
-            set_implicit_proficiency(graph[exercise_name])
+        # Calculate implicit proficiencies, coverers first so that
+        # set_implicit_proficiency doesn't need to recurse
+        for i in exercise_graph_index.topological_order:
+            UserExerciseGraph.set_implicit_proficiency(graph_dicts[i])
 
         # Calculate suggested
-        graph = UserExerciseGraph.mark_suggested(graph)
-
-        return UserExerciseGraph(graph = graph, cache=user_exercise_cache)
+        return UserExerciseGraph(graph=graph, cache=user_exercise_cache,
+                exercise_graph_index=exercise_graph_index).mark_suggested_from_boundary()
 
 class PromoRecord(db.Model):
     """ A record to mark when a user has viewed a one-time event of some
@@ -1,5 +1,9 @@
 #!/usr/bin/env python
 
+import datetime
+import os
+import pickle
+
 import models
 import phantom_users.phantom_util
 import testutil
@@ -167,6 +171,138 @@ class PromoRecordTest(testutil.GAEModelTestCase):
         # Different promo
         self.assertTrue(self.r(p2, u1))
 
+class UserVideoCssTest(testutil.GAEModelTestCase):
+    def setUp(self):
+        super(UserVideoCssTest, self).setUp()
+        self.testbed.init_taskqueue_stub(
+                root_path=os.path.dirname(os.path.abspath(__file__)))
+        self.taskqueue_stub = self.testbed.get_stub('taskqueue')
+
+    def test_transitions_are_coalesced(self):
+        user_data = models.UserData.insert_for(
+                "http://googleid.khanacademy.org/1234",
+                "bob@gmail.com")
+        video_keys = [db.Key.from_path('Video', i) for i in range(1, 4)]
+
+        for version, video_key in enumerate(video_keys):
+            models.UserVideoCss.set_started(user_data.key(), video_key, version + 1)
+        models.UserVideoCss.set_completed(user_data.key(), video_keys[0], 4)
+
+        # All four transitions share a single flush task
+        tasks = self.taskqueue_stub.GetTasks("video-log-queue")
+        self.assertEqual(len(tasks), 1)
+
+        models.flush_css_deferred(user_data.key())
+
+        uvc = models.UserVideoCss.get_for_user_data(user_data)
+        css = pickle.loads(uvc.pickled_dict)
+        self.assertEqual(css['started'], set(['.v2', '.v3']))
+        self.assertEqual(css['completed'], set(['.v1']))
+        self.assertEqual(uvc.version, 4)
+        self.assertTrue('.v1' in uvc.video_css)
+
+        # Nothing is left for the next flush
+        tasks, transitions = models.UserVideoCss._lease_pending(user_data.key())
+        self.assertEqual(tasks, [])
+
+    def test_transitions_survive_a_failed_flush(self):
+        user_data = models.UserData.insert_for(
+                "http://googleid.khanacademy.org/1234",
+                "bob@gmail.com")
+        video_key = db.Key.from_path('Video', 1)
+        models.UserVideoCss.set_started(user_data.key(), video_key, 1)
+
+        def fail(user_data, transitions):
+            raise db.Timeout()
+
+        original_apply = models.apply_css_transitions
+        models.apply_css_transitions = fail
+        try:
+            self.assertRaises(db.Timeout, models.flush_css_deferred, user_data.key())
+        finally:
+            models.apply_css_transitions = original_apply
+
+        # The retry still finds the transition in the pull queue
+        models.flush_css_deferred(user_data.key())
+
+        uvc = models.UserVideoCss.get_for_user_data(user_data)
+        self.assertEqual(pickle.loads(uvc.pickled_dict)['started'], set(['.v1']))
+
+    def test_failed_flush_add_is_retried(self):
+        user_data = models.UserData.insert_for(
+                "http://googleid.khanacademy.org/1234",
+                "bob@gmail.com")
+        video_keys = [db.Key.from_path('Video', i) for i in range(1, 3)]
+
+        with patch("models.deferred.defer", side_effect=Exception("unavailable")):
+            self.assertRaises(Exception, models.UserVideoCss.set_started,
+                              user_data.key(), video_keys[0], 1)
+
+        # The failed add didn't leave a hint behind that skips the next one
+        models.UserVideoCss.set_started(user_data.key(), video_keys[1], 2)
+        tasks = self.taskqueue_stub.GetTasks("video-log-queue")
+        self.assertEqual(len(tasks), 1)
+
+    def test_sweep_applies_transitions_without_a_flush(self):
+        user_data = models.UserData.insert_for(
+                "http://googleid.khanacademy.org/1234",
+                "bob@gmail.com")
+
+        with patch("models.deferred.defer"):
+            models.UserVideoCss.set_started(user_data.key(),
+                                            db.Key.from_path('Video', 1), 1)
+
+        with patch("models.VIDEO_CSS_FLUSH_DELAY_SECS", 0):
+            models.sweep_css_transitions()
+
+        uvc = models.UserVideoCss.get_for_user_data(user_data)
+        self.assertEqual(pickle.loads(uvc.pickled_dict)['started'], set(['.v1']))
+
+class CommitProblemLogsTest(testutil.GAEModelTestCase):
+    def problem_log_source(self, user_data, problem_number, attempt_number,
+                           attempt_content, time_taken):
+        return models.ProblemLog(
+                key_name=models.ProblemLog.key_for(user_data, "addition_1", problem_number),
+                user=user_data.user,
+                exercise="addition_1",
+                problem_number=problem_number,
+                time_taken=time_taken,
+                time_done=datetime.datetime.now(),
+                count_hints=0,
+                correct=attempt_number == 1,
+                count_attempts=attempt_number,
+                attempts=[attempt_content])
+
+    def test_batch_merges_attempts_by_key(self):
+        user_data = models.UserData.insert_for(
+                "http://googleid.khanacademy.org/1234",
+                "bob@gmail.com")
+
+        sources = [
+            self.problem_log_source(user_data, 1, 1, "4", 10),
+            self.problem_log_source(user_data, 2, 1, "7", 5),
+            self.problem_log_source(user_data, 1, 2, "5", 20),
+            # Duplicate delivery of an attempt that was already buffered
+            self.problem_log_source(user_data, 1, 1, "4", 10),
+        ]
+        models.commit_problem_logs(sources)
+
+        # Committing the same batch again is a no-op
+        models.commit_problem_logs(sources)
+
+        problem_logs = models.ProblemLog.all().order("problem_number").fetch(10)
+        self.assertEqual(len(problem_logs), 2)
+
+        self.assertEqual(problem_logs[0].count_attempts, 2)
+        self.assertEqual(problem_logs[0].attempts, ["4", "5"])
+        self.assertEqual(problem_logs[0].time_taken_attempts, [10, 20])
+        self.assertEqual(problem_logs[0].time_taken, 30)
+        self.assertFalse(problem_logs[0].correct)
+        self.assertTrue(problem_logs[0].random_float is not None)
+
+        self.assertEqual(problem_logs[1].count_attempts, 1)
+        self.assertTrue(problem_logs[1].correct)
+
 class VideoSubtitlesTest(unittest2.TestCase):
     def test_get_key_name(self):
         kn = models.VideoSubtitles.get_key_name('en', 'YOUTUBEID')
@@ -184,3 +320,98 @@ class VideoSubtitlesTest(unittest2.TestCase):
         json = subs.load_json()
         self.assertIsNone(json)
         self.assertEqual(warn.call_count, 1, 'logging.warn() not called')
+
+class UserExerciseGraphUpdateTest(unittest2.TestCase):
+    class FakeUserData(object):
+        def __init__(self):
+            self.proficient_exercises = []
+
+    class FakeCache(object):
+        def __init__(self):
+            self.dicts = {}
+
+        def user_exercise_dict(self, exercise_name):
+            return (self.dicts.get(exercise_name) or
+                    models.UserExerciseCache.dict_from_user_exercise(None))
+
+        def set(self, exercise_name, streak, total_done, progress):
+            user_exercise_dict = dict(self.user_exercise_dict(exercise_name))
+            user_exercise_dict.update(streak=streak, total_done=total_done,
+                                      progress=progress)
+            self.dicts[exercise_name] = user_exercise_dict
+
+    @staticmethod
+    def exercise_dict(name, position, covers=[], prerequisites=[]):
+        return {
+            "id": position,
+            "name": name,
+            "display_name": name,
+            "h_position": position,
+            "v_position": 0,
+            "summative": False,
+            "num_milestones": 0,
+            "proficient": None,
+            "explicitly_proficient": None,
+            "suggested": None,
+            "covers": covers,
+            "prerequisites": prerequisites,
+        }
+
+    def states(self, user_exercise_graph):
+        return dict((name, (graph_dict["proficient"], graph_dict["suggested"]))
+                    for name, graph_dict in user_exercise_graph.graph.iteritems())
+
+    def test_update_matches_generate(self):
+        exercise_dicts = [
+            self.exercise_dict("addition_1", 0),
+            self.exercise_dict("subtraction_1", 1, prerequisites=["addition_1"]),
+            self.exercise_dict("addition_2", 2, covers=["addition_1"],
+                               prerequisites=["addition_1"]),
+            self.exercise_dict("addition_3", 3, covers=["addition_2"],
+                               prerequisites=["addition_2"]),
+            self.exercise_dict("subtraction_2", 4, covers=["subtraction_1"],
+                               prerequisites=["subtraction_1", "addition_2"]),
+        ]
+        index = models.ExerciseGraphIndex(exercise_dicts)
+        user_data = self.FakeUserData()
+        cache = self.FakeCache()
+
+        user_exercise_graph = models.UserExerciseGraph.generate(
+                user_data, cache, index)
+
+        steps = [
+            ("addition_1", 3, 3, 0.6, False),
+            ("addition_1", 5, 5, 1.0, True),
+            ("addition_3", 4, 4, 1.0, True),
+            ("subtraction_1", 0, 6, 0.3, False),
+        ]
+        for name, streak, total_done, progress, proficient in steps:
+            cache.set(name, streak, total_done, progress)
+            if proficient:
+                user_data.proficient_exercises.append(name)
+
+            user_exercise_graph.update(user_data, name, index)
+            regenerated = models.UserExerciseGraph.generate(
+                    user_data, cache, index)
+
+            self.assertEqual(self.states(user_exercise_graph),
+                             self.states(regenerated))
+
+        # addition_3 covers addition_2, which was never attempted
+        self.assertTrue(user_exercise_graph.graph_dict("addition_2")["proficient"])
+
+    def test_index_topology(self):
+        index = models.ExerciseGraphIndex([
+            self.exercise_dict("c", 2, covers=["b"], prerequisites=["b"]),
+            self.exercise_dict("a", 0),
+            self.exercise_dict("b", 1, covers=["a"], prerequisites=["a", "missing"]),
+        ])
+
+        def names(ids):
+            return [index.names[i] for i in ids]
+
+        self.assertEqual(names(index.position_order), ["a", "b", "c"])
+        self.assertEqual(names(index.topological_order), ["c", "b", "a"])
+        self.assertEqual(names(index.coverers_of(index.ids["a"])), ["b"])
+        self.assertEqual(names(index.prerequisites_of(index.ids["b"])), ["a"])
+        self.assertEqual(index.covered_closure("c"), ["c", "b", "a"])
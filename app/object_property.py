@@ -3,6 +3,8 @@
 from google.appengine.ext import db
 import pickle
 
+from packed_user_exercise_dicts import PackedUserExerciseDicts, is_packed
+
 # Use this property to store objects.
 class ObjectProperty(db.BlobProperty):
     def validate(self, value):
@@ -95,3 +97,32 @@ class StringListCompatTsvProperty(TsvProperty):
             return value
         else:
             return super(StringListCompatTsvProperty, self).make_value_from_datastore(value)
+
+class PackedUserExerciseDictsProperty(db.BlobProperty):
+    '''
+    Stores UserExerciseCache.dicts in the packed format described in
+    packed_user_exercise_dicts. Can also read the pickled dict of dicts
+    written by older versions of UserExerciseCache.
+    '''
+    data_type = PackedUserExerciseDicts
+
+    def validate(self, value):
+        if isinstance(value, dict):
+            value = PackedUserExerciseDicts(value)
+        return super(PackedUserExerciseDictsProperty, self).validate(value)
+
+    def get_value_for_datastore(self, model_instance):
+        value = super(PackedUserExerciseDictsProperty, self).get_value_for_datastore(model_instance)
+        if value is None:
+            return None
+        return db.Blob(value.to_packed())
+
+    def make_value_from_datastore(self, value):
+        if value is None:
+            return None
+
+        value = str(value)
+        if is_packed(value):
+            return PackedUserExerciseDicts.from_packed(value)
+
+        return PackedUserExerciseDicts(pickle.loads(value))
@@ -0,0 +1,169 @@
+"""
+Compact binary encoding for UserExerciseCache.dicts.
+
+UserExerciseCache used to pickle a dict of per-exercise dicts, paying for
+nine string keys and a pickled datetime per field for every exercise. The
+packed form is a small header, a table of exercise names and one
+fixed-width record per exercise:
+
+    header:   MAGIC, record count, length of the name table
+    names:    utf-8 exercise names joined by "\\0"
+    records:  RECORD_FORMAT, in the same order as the names
+
+Timestamps are stored as whole seconds since the epoch (None is stored as
+NONE_TIMESTAMP), so sub-second precision is dropped.
+
+PackedUserExerciseDicts behaves like the old dict of dicts, but only decodes
+an exercise's record when that exercise is looked up.
+"""
+
+import datetime
+import struct
+
+MAGIC = "UEC\x01"
+HEADER_FORMAT = "<4sII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# streak, longest_streak, total_done, review_interval_secs, progress,
+# struggling, last_done, last_review, proficient_date
+RECORD_FORMAT = "<IIIqd?qqq"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+EPOCH = datetime.datetime(1970, 1, 1)
+NONE_TIMESTAMP = -(1 << 63)
+
+
+def timestamp_from_datetime(value):
+    if not value:
+        return NONE_TIMESTAMP
+    delta = value - EPOCH
+    return delta.days * 86400 + delta.seconds
+
+
+def datetime_from_timestamp(value):
+    if value == NONE_TIMESTAMP:
+        return None
+    return EPOCH + datetime.timedelta(seconds=value)
+
+
+def encode_record(user_exercise_dict):
+    return struct.pack(RECORD_FORMAT,
+            user_exercise_dict["streak"],
+            user_exercise_dict["longest_streak"],
+            user_exercise_dict["total_done"],
+            user_exercise_dict["review_interval_secs"],
+            user_exercise_dict["progress"],
+            user_exercise_dict["struggling"],
+            timestamp_from_datetime(user_exercise_dict["last_done"]),
+            timestamp_from_datetime(user_exercise_dict["last_review"]),
+            timestamp_from_datetime(user_exercise_dict["proficient_date"]))
+
+
+def decode_record(data, offset=0):
+    (streak, longest_streak, total_done, review_interval_secs, progress,
+        struggling, last_done, last_review, proficient_date) = struct.unpack_from(
+                RECORD_FORMAT, data, offset)
+
+    return {
+        "streak": streak,
+        "longest_streak": longest_streak,
+        "progress": progress,
+        "struggling": struggling,
+        "total_done": total_done,
+        "last_done": datetime_from_timestamp(last_done),
+        "last_review": datetime_from_timestamp(last_review),
+        "review_interval_secs": review_interval_secs,
+        "proficient_date": datetime_from_timestamp(proficient_date),
+    }
+
+
+def is_packed(data):
+    return isinstance(data, str) and data.startswith(MAGIC)
+
+
+class PackedUserExerciseDicts(object):
+    """ Read-mostly mapping of exercise name -> user exercise dict. """
+
+    def __init__(self, dicts=None):
+        self._names = []
+        self._offsets = {}
+        self._data = ""
+        self._records_offset = 0
+
+        # Decoded or newly set dicts, which take precedence over _data
+        self._dicts = dict(dicts or {})
+
+    @staticmethod
+    def from_packed(data):
+        magic, count, names_length = struct.unpack_from(HEADER_FORMAT, data)
+        assert magic == MAGIC, "Not a packed UserExerciseCache"
+
+        packed = PackedUserExerciseDicts()
+        if count:
+            names = data[HEADER_SIZE:HEADER_SIZE + names_length].decode("utf-8").split(u"\0")
+            packed._names = names
+            packed._offsets = dict((name, i * RECORD_SIZE) for i, name in enumerate(names))
+
+        packed._data = data
+        packed._records_offset = HEADER_SIZE + names_length
+        return packed
+
+    def to_packed(self):
+        names = list(self._dicts)
+        names.extend(name for name in self._names if name not in self._dicts)
+
+        records = []
+        for name in names:
+            if name in self._dicts:
+                records.append(encode_record(self._dicts[name]))
+            else:
+                offset = self._records_offset + self._offsets[name]
+                records.append(self._data[offset:offset + RECORD_SIZE])
+
+        names_data = u"\0".join(names).encode("utf-8")
+        return "".join([struct.pack(HEADER_FORMAT, MAGIC, len(names), len(names_data)),
+                        names_data] + records)
+
+    def get(self, name, default=None):
+        user_exercise_dict = self._dicts.get(name)
+        if user_exercise_dict is None:
+            offset = self._offsets.get(name)
+            if offset is None:
+                return default
+            user_exercise_dict = decode_record(self._data, self._records_offset + offset)
+            self._dicts[name] = user_exercise_dict
+        return user_exercise_dict
+
+    def __getitem__(self, name):
+        user_exercise_dict = self.get(name)
+        if user_exercise_dict is None:
+            raise KeyError(name)
+        return user_exercise_dict
+
+    def __setitem__(self, name, user_exercise_dict):
+        self._dicts[name] = user_exercise_dict
+
+    def __contains__(self, name):
+        return name in self._dicts or name in self._offsets
+
+    def __len__(self):
+        return len(self._dicts) + len([name for name in self._names if name not in self._dicts])
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def iterkeys(self):
+        for name in self._dicts.keys():
+            yield name
+        for name in self._names:
+            if name not in self._dicts:
+                yield name
+
+    __iter__ = iterkeys
+
+    def iteritems(self):
+        for name in self.keys():
+            yield name, self.get(name)
+
+    def items(self):
+        return list(self.iteritems())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Compares the pickled dict of dicts that UserExerciseCache used to store
+(ObjectProperty pickles with the default protocol) against the packed
+format, for 1, 50 and 500 students.
+
+Usage: python packed_user_exercise_dicts_benchmark.py [NUM_EXERCISES]
+
+NUM_EXERCISES is how many exercises each student has attempted.
+"""
+
+import datetime
+import pickle
+import random
+import sys
+import time
+
+from packed_user_exercise_dicts import PackedUserExerciseDicts
+
+
+def synthetic_dicts(num_exercises, rand):
+    now = datetime.datetime(2012, 6, 1)
+    dicts = {}
+    for i in xrange(num_exercises):
+        total_done = rand.randint(1, 40)
+        streak = rand.randint(0, total_done)
+        dicts["exercise_name_%d" % i] = {
+            "streak": streak,
+            "longest_streak": streak,
+            "progress": rand.random(),
+            "struggling": rand.random() < 0.1,
+            "total_done": total_done,
+            "last_done": now - datetime.timedelta(seconds=rand.randint(0, 10 ** 7)),
+            "last_review": datetime.datetime.min,
+            "review_interval_secs": 60 * 60 * 24 * 7,
+            "proficient_date": now if rand.random() < 0.5 else None,
+        }
+    return dicts
+
+
+def timed(fxn, blobs):
+    start = time.time()
+    for blob in blobs:
+        fxn(blob)
+    return time.time() - start
+
+
+def main(num_exercises):
+    rand = random.Random(0)
+
+    print "%d exercises per student" % num_exercises
+    print "%8s %14s %14s %16s %16s %16s" % (
+        "students", "pickled bytes", "packed bytes",
+        "unpickle ms", "unpack ms", "unpack+1 get ms")
+
+    for num_students in (1, 50, 500):
+        students = [synthetic_dicts(num_exercises, rand) for _ in xrange(num_students)]
+        pickled = [pickle.dumps(dicts) for dicts in students]
+        packed = [PackedUserExerciseDicts(dicts).to_packed() for dicts in students]
+
+        unpickle_secs = timed(pickle.loads, pickled)
+        unpack_secs = timed(PackedUserExerciseDicts.from_packed, packed)
+        lookup_secs = timed(
+                lambda blob: PackedUserExerciseDicts.from_packed(blob).get("exercise_name_0"),
+                packed)
+
+        print "%8d %14d %14d %16.2f %16.2f %16.2f" % (
+            num_students,
+            sum(len(blob) for blob in pickled),
+            sum(len(blob) for blob in packed),
+            1000 * unpickle_secs, 1000 * unpack_secs, 1000 * lookup_secs)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 60)
@@ -0,0 +1,70 @@
+import datetime
+import pickle
+import unittest
+
+from packed_user_exercise_dicts import PackedUserExerciseDicts, is_packed
+
+
+def user_exercise_dict(streak, last_done, proficient_date=None):
+    return {
+        "streak": streak,
+        "longest_streak": streak + 2,
+        "progress": 0.75,
+        "struggling": False,
+        "total_done": streak + 4,
+        "last_done": last_done,
+        "last_review": datetime.datetime.min,
+        "review_interval_secs": 60 * 60 * 24 * 7,
+        "proficient_date": proficient_date,
+    }
+
+
+class PackedUserExerciseDictsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dicts = {
+            "addition_1": user_exercise_dict(3, datetime.datetime(2012, 3, 4, 5, 6, 7),
+                                             datetime.datetime(2012, 3, 1, 12, 0, 0)),
+            "subtraction_1": user_exercise_dict(0, None),
+        }
+
+    def test_round_trip(self):
+        data = PackedUserExerciseDicts(self.dicts).to_packed()
+        self.assertTrue(is_packed(data))
+
+        packed = PackedUserExerciseDicts.from_packed(data)
+        self.assertEqual(len(packed), 2)
+        self.assertEqual(sorted(packed.keys()), sorted(self.dicts.keys()))
+        for name, expected in self.dicts.iteritems():
+            self.assertEqual(packed[name], expected)
+
+        self.assertTrue("addition_1" in packed)
+        self.assertFalse("addition_2" in packed)
+        self.assertEqual(packed.get("addition_2"), None)
+
+    def test_timestamps_drop_microseconds(self):
+        self.dicts["addition_1"]["last_done"] = datetime.datetime(2012, 3, 4, 5, 6, 7, 890)
+        packed = PackedUserExerciseDicts.from_packed(
+                PackedUserExerciseDicts(self.dicts).to_packed())
+        self.assertEqual(packed["addition_1"]["last_done"],
+                         datetime.datetime(2012, 3, 4, 5, 6, 7))
+
+    def test_update_and_repack(self):
+        packed = PackedUserExerciseDicts.from_packed(
+                PackedUserExerciseDicts(self.dicts).to_packed())
+
+        packed["multiplication_1"] = user_exercise_dict(1, datetime.datetime(2012, 5, 1))
+        packed["subtraction_1"] = user_exercise_dict(7, datetime.datetime(2012, 5, 2))
+
+        repacked = PackedUserExerciseDicts.from_packed(packed.to_packed())
+        self.assertEqual(len(repacked), 3)
+        self.assertEqual(repacked["subtraction_1"]["streak"], 7)
+        self.assertEqual(repacked["multiplication_1"]["streak"], 1)
+        self.assertEqual(repacked["addition_1"], self.dicts["addition_1"])
+
+    def test_pickled_dicts_are_not_packed(self):
+        self.assertFalse(is_packed(pickle.dumps(self.dicts)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -94,7 +94,6 @@ def class_progress_report_graph_context(user_data, list_students, days=31):
     for (student, student_email_pair, escapejsed_student_email, user_exercise_graph) in izip(list_students, student_email_pairs, emails_escapejsed, user_exercise_graphs):
 
         student_email = student.email
-        student_review_exercise_names = user_exercise_graph.review_exercise_names()
         progress_data[student_email] = student_data = {
             'email': student.email,
             'nickname': student.nickname,
@@ -111,7 +110,7 @@ def class_progress_report_graph_context(user_data, list_students, days=31):
             status_name = ""
 
             if graph_dict["proficient"]:
-                if exercise_name in student_review_exercise_names:
+                if user_exercise_graph.is_reviewing(exercise_name):
                     status_name = "review"
                 else:
                     if not graph_dict["explicitly_proficient"]:
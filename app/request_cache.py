@@ -1,5 +1,8 @@
 import logging
 import inspect
+import time
+
+import cache_key_stats
 
 # request_cache is similar to layer_cache, except it only memoizes results
 # for each individual request. If you need to cache results for longer than
@@ -50,6 +53,7 @@ def request_cache_check_set_return(
         **kwargs):
 
     key = key_fxn(*args, **kwargs)
+    stats_family = cache_key_stats.family(target)
 
     bust_cache = False
     if "bust_cache" in kwargs:
@@ -60,9 +64,15 @@ def request_cache_check_set_return(
 
     if not bust_cache:
         if has(key):
+            cache_key_stats.record_hit(stats_family, cache_key_stats.REQUEST_LAYER)
             return get(key)
+        cache_key_stats.record_miss(stats_family)
+    else:
+        cache_key_stats.record_bust(stats_family)
 
+    recompute_start = time.time()
     result = target(*args, **kwargs)
+    cache_key_stats.record_recompute(stats_family, time.time() - recompute_start)
 
     # In case the key's value has been changed by target's execution
     key = key_fxn(*args, **kwargs)
@@ -100,4 +110,9 @@ class RequestCacheMiddleware(object):
         # environment is single-threaded per instance, each individual request
         # is guaranteed to start w/ a unique, empty CACHE dict.
         flush()
-        return self.app(environ, start_response)
+        cache_key_stats.start_request()
+        try:
+            for value in self.app(environ, start_response):
+                yield value
+        finally:
+            cache_key_stats.end_request()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Measures the overhead of gae_mini_profiler's sampling profiler on a
+CPU-bound workload with a reasonably deep stack, at several sample rates.
+
+"legacy" is the previous sampler, kept here for comparison: it ran
+traceback.extract_stack (which reads every frame's source line through
+linecache) and kept an object per sample, then formatted every frame of
+every sample for its results. The current sampler counts stacks of
+(code object id, line) pairs and only looks up source for its results.
+
+Wall clock overhead is noisy on busy machines, so the time a single
+sample takes is measured too. "sampling %" is the share of each second
+the sampler spends taking samples at its rate, which is the overhead it
+adds to the request thread.
+
+Usage: python sampling_profiler_benchmark.py [REPEATS]
+
+The App Engine SDK has to be importable (e.g. on PYTHONPATH).
+"""
+
+from collections import defaultdict
+import json
+import os
+import sys
+import time
+import traceback
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+# Sample the calling thread like in production, rather than like the dev server
+os.environ["SERVER_SOFTWARE"] = "Benchmark"
+
+from gae_mini_profiler import sampling_profiler
+
+
+# The previous implementation, kept here for comparison
+class LegacyProfileSample(object):
+    def __init__(self, stack):
+        self.stack_trace = traceback.extract_stack(stack)
+
+class LegacyProfile(sampling_profiler.Profile):
+    def __init__(self, samples_per_second):
+        super(LegacyProfile, self).__init__(samples_per_second)
+        self.samples = []
+
+    def record_stack(self, frame):
+        self.samples.append(LegacyProfileSample(frame))
+        self.total_samples += 1
+
+    def results(self):
+        aggregated_calls = defaultdict(int)
+        for sample in self.samples:
+            for filename, line_num, function_name, src in sample.stack_trace:
+                aggregated_calls["%s\n\n%s:%s (%s)" %
+                        (src, filename, line_num, function_name)] += 1
+        return sorted(aggregated_calls.items(), key=lambda item: item[1], reverse=True)
+
+
+def nested(depth, payload):
+    if depth:
+        return nested(depth - 1, payload)
+    return len(json.dumps(json.loads(json.dumps(payload))))
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+def workload():
+    payload = [{"id": i, "title": "Video %d" % i, "tags": ["a", "b", "c"]}
+               for i in xrange(200)]
+    total = 0
+    for _ in xrange(200):
+        total += nested(30, payload) + fib(14)
+    return total
+
+
+def cost_per_sample(profile_class, count=2000):
+    """Seconds one sample of a 30 frame deep stack takes"""
+    profile = profile_class(samples_per_second=1)
+
+    def sample(depth):
+        if depth:
+            return sample(depth - 1)
+        frame = sys._getframe()
+        start = time.time()
+        for _ in xrange(count):
+            profile.record_stack(frame)
+        return (time.time() - start) / count
+
+    return sample(30)
+
+
+def main(repeats):
+    configurations = [("none", None, 0), ("legacy", LegacyProfile, 250)]
+    configurations += [("current", sampling_profiler.Profile, rate)
+                       for rate in (10, 50, 250, 1000)]
+
+    # Run every configuration once per round, and keep each one's fastest
+    # run, so that the machine's noise affects them all alike
+    best = {}
+    profiles = {}
+    for _ in xrange(repeats):
+        for name, profile_class, rate in configurations:
+            profile = profiles.get((name, rate))
+            if profile is None and profile_class:
+                profile = profiles[(name, rate)] = profile_class(samples_per_second=rate)
+
+            start = time.time()
+            if profile:
+                profile.run(workload)
+            else:
+                workload()
+            secs = time.time() - start
+
+            best[(name, rate)] = min(secs, best.get((name, rate), secs))
+
+    baseline = best[("none", 0)]
+
+    print "repeats: %d, workload: %.1f ms" % (repeats, 1000 * baseline)
+    print "%-8s %6s %10s %10s %10s %12s %12s %12s" % ("sampler", "Hz", "ms", "overhead",
+                                                      "samples", "us/sample", "sampling %",
+                                                      "results ms")
+
+    for name, profile_class, rate in configurations[1:]:
+        profile = profiles[(name, rate)]
+
+        start = time.time()
+        profile.results()
+        results_secs = time.time() - start
+
+        secs = best[(name, rate)]
+        sample_secs = cost_per_sample(profile_class)
+        print "%-8s %6d %10.1f %9.1f%% %10d %12.1f %11.2f%% %12.1f" % (
+            name, rate, 1000 * secs, 100 * (secs - baseline) / baseline,
+            profile.total_samples, 1000000 * sample_secs,
+            100 * rate * sample_secs, 1000 * results_secs)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
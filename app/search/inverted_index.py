@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""An in-memory, ranked full text index.
+
+Unlike Searchable, which keeps one index entity per searchable entity and
+answers a search with a datastore query per keyword, InvertedIndex keeps the
+postings of a whole corpus in a few flat arrays. It's built in one go,
+serialized to a compact string for storage, and loaded into memory to answer
+queries without touching the datastore.
+
+Documents are (key, kind, title, fields) where fields is a list of
+(text, weight). A word's term frequency in a document is the sum of the
+weights of the fields it appears in, so titles can count for more than
+descriptions. Words are stemmed with Porter2, or indexed along with their
+unprefixed forms if they're Hebrew (see search.text.terms). Adjacent words
+(skipping stop words) in fields weighted at least PHRASE_MIN_WEIGHT are also
+indexed as phrase terms.
+
+Each posting holds the document's BM25 score for the term, computed when
+the index is built, and every term's postings are sorted best first. A
+search walks down the query's posting lists only until the best results are
+certain, so common words cost about as little as rare ones. Documents
+matching all of the query's words come first, then those matching some,
+each ranked by their total score, with matching phrases adding PHRASE_WEIGHT
+times their own score.
+"""
+
+import array
+import cPickle
+import heapq
+import itertools
+import math
+
+import search
+from search import text
+
+HEBREW_STOP_WORDS = frozenset(
+    u"של את על עם אל או גם זה זו זאת כי אם לא הוא היא הם הן".split())
+
+STOP_WORDS = search.STOP_WORDS | HEBREW_STOP_WORDS
+
+class InvertedIndex(object):
+    """Ranked full text index over a fixed set of documents."""
+
+    FORMAT_VERSION = 1
+
+    # BM25 parameters
+    K1 = 1.2
+    B = 0.75
+
+    # Weight of a query word's unprefixed Hebrew forms, relative to the word
+    VARIANT_WEIGHT = 0.5
+
+    # Weight of a matched phrase, relative to a matched word
+    PHRASE_WEIGHT = 2.0
+
+    # Only fields at least this heavy (titles and keywords, not
+    # descriptions) are indexed for phrases, which would otherwise
+    # outnumber every other term
+    PHRASE_MIN_WEIGHT = 2
+
+    def __init__(self, docs, terms, offsets, posting_docs, posting_scores):
+        """ Use build() or loads() rather than calling this directly.
+
+        docs is a list of (key, kind, title). The postings of terms[i] are
+        posting_docs and posting_scores from offsets[i] to offsets[i + 1].
+        """
+        self.docs = docs
+        self.terms = terms
+        self.term_ids = dict((term, i) for i, term in enumerate(terms))
+        self.offsets = offsets
+        self.posting_docs = posting_docs
+        self.posting_scores = posting_scores
+
+        self.kind_docs = {}
+        for doc, (key, kind, title) in enumerate(docs):
+            self.kind_docs.setdefault(kind, set()).add(doc)
+
+        self.size = (posting_docs.itemsize * len(posting_docs) +
+                     posting_scores.itemsize * len(posting_scores) +
+                     offsets.itemsize * len(offsets) +
+                     sum(100 + 2 * len(term) for term in terms) +
+                     sum(250 + len(key) + 2 * len(title or u"")
+                         for key, kind, title in docs))
+
+    @staticmethod
+    def words(text_value):
+        """ Returns the normalized words of text_value worth indexing """
+        return [word for word in text.words(text_value or u"")
+                if len(word) >= search.SEARCH_PHRASE_MIN_LENGTH and
+                word not in STOP_WORDS]
+
+    @classmethod
+    def build(cls, documents):
+        """ Builds an index of an iterable of (key, kind, title, fields) """
+        docs = []
+        lengths = []
+        postings = {}
+
+        for doc, (key, kind, title, fields) in enumerate(documents):
+            docs.append((key, kind, title))
+
+            length = 0
+            frequencies = {}
+            for field_text, weight in fields:
+                previous = None
+                for word in cls.words(field_text):
+                    length += weight
+                    word_terms = text.terms(word)
+                    for term in word_terms:
+                        frequencies[term] = frequencies.get(term, 0) + weight
+                    if weight >= cls.PHRASE_MIN_WEIGHT:
+                        if previous is not None:
+                            phrase = previous + u" " + word_terms[0]
+                            frequencies[phrase] = frequencies.get(phrase, 0) + weight
+                        previous = word_terms[0]
+            lengths.append(length)
+
+            for term, frequency in frequencies.iteritems():
+                if term in postings:
+                    postings[term].append((doc, frequency))
+                else:
+                    postings[term] = [(doc, frequency)]
+
+        total_length = sum(lengths)
+        average_length = float(total_length) / len(lengths) if total_length else 1.0
+        length_norms = [cls.K1 * (1 - cls.B + cls.B * length / average_length)
+                        for length in lengths]
+
+        terms = sorted(postings)
+        offsets = array.array("I", [0])
+        posting_docs = array.array("I")
+        posting_scores = array.array("f")
+        for term in terms:
+            term_postings = postings[term]
+            idf = math.log(1.0 + (len(docs) - len(term_postings) + 0.5) /
+                                 (len(term_postings) + 0.5))
+            scored = sorted((-idf * frequency * (cls.K1 + 1) /
+                             (frequency + length_norms[doc]), doc)
+                            for doc, frequency in term_postings)
+            for negative_score, doc in scored:
+                posting_docs.append(doc)
+                posting_scores.append(-negative_score)
+            offsets.append(len(posting_docs))
+
+        return cls(docs, terms, offsets, posting_docs, posting_scores)
+
+    def dumps(self):
+        """ Returns the index serialized as a string, for loads() """
+        return cPickle.dumps((
+            self.FORMAT_VERSION,
+            self.docs,
+            u"\n".join(self.terms).encode("utf-8"),
+            self.offsets.tostring(),
+            self.posting_docs.tostring(),
+            self.posting_scores.tostring(),
+        ), cPickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def loads(cls, data):
+        """ Returns the index serialized by dumps() """
+        (format_version, docs, terms, offsets, posting_docs,
+            posting_scores) = cPickle.loads(data)
+        if format_version != cls.FORMAT_VERSION:
+            raise ValueError("Unknown InvertedIndex format %s" % format_version)
+
+        def unpack(typecode, packed):
+            unpacked = array.array(typecode)
+            unpacked.fromstring(packed)
+            return unpacked
+
+        return cls(docs, terms.decode("utf-8").split(u"\n") if terms else [],
+                   unpack("I", offsets), unpack("I", posting_docs),
+                   unpack("f", posting_scores))
+
+    def search(self, query, limit=10, kind=None):
+        """ Returns up to limit (key, title) of the documents best matching
+        query, restricted to documents of kind if given. """
+        query_words = self.words(query)
+        if not query_words or limit < 1:
+            return []
+
+        word_postings = [self._word_postings(word) for word in query_words]
+
+        primary_terms = [text.terms(word)[0] for word in query_words]
+        phrase_postings = [self._postings(first + u" " + second)
+                           for first, second in zip(primary_terms, primary_terms[1:])]
+
+        postings = ([(docs, scores, 1.0) for docs, scores in word_postings] +
+                    [(docs, scores, self.PHRASE_WEIGHT)
+                     for docs, scores in phrase_postings if docs])
+
+        allowed = self.kind_docs.get(kind, set()) if kind else None
+        if len(postings) == 1:
+            if allowed is None:
+                return self._results(postings[0][0][:limit])
+            return self._results(self._top(postings, None, limit,
+                                           lambda doc: doc in allowed))
+
+        lookups = [dict(itertools.izip(docs, scores)) for docs, scores, weight in postings]
+        word_lookups = lookups[:len(word_postings)]
+
+        def matches_all(doc):
+            for lookup in word_lookups:
+                if doc not in lookup:
+                    return False
+            return True
+
+        def accept_all(doc):
+            return (allowed is None or doc in allowed) and matches_all(doc)
+
+        best = self._top(postings, lookups, limit, accept_all)
+
+        if len(best) < limit and len(word_postings) > 1:
+            # Every document matching all the words is in already, so fill
+            # up with those matching some of them
+            def accept_some(doc):
+                return (allowed is None or doc in allowed) and not matches_all(doc)
+
+            best.extend(self._top(postings, lookups, limit - len(best), accept_some))
+
+        return self._results(best)
+
+    def _results(self, docs):
+        return [(self.docs[doc][0], self.docs[doc][2]) for doc in docs]
+
+    def _top(self, postings, lookups, limit, accept):
+        """ Returns the limit accepted docs with the highest total score,
+        best first.
+
+        postings are (docs, scores, weight), sorted by descending score, and
+        lookups the matching doc -> score dicts (or None if there's only one
+        posting list). Walks down all the lists at once, and stops when no
+        doc it hasn't seen could beat the ones it has: the sum of the scores
+        at the current depth is an upper bound of their totals (the
+        "threshold algorithm").
+        """
+        heap = []
+        seen = set()
+        weights = [weight for docs, scores, weight in postings]
+        depth = 0
+        longest = max(len(docs) for docs, scores, weight in postings)
+
+        while depth < longest:
+            threshold = 0.0
+            for docs, scores, weight in postings:
+                if depth >= len(docs):
+                    continue
+
+                threshold += weight * scores[depth]
+                doc = docs[depth]
+                if doc in seen:
+                    continue
+                seen.add(doc)
+                if not accept(doc):
+                    continue
+
+                if lookups is None:
+                    total = weight * scores[depth]
+                else:
+                    total = 0.0
+                    for lookup_weight, lookup in itertools.izip(weights, lookups):
+                        total += lookup_weight * lookup.get(doc, 0.0)
+
+                entry = (total, -doc)
+                if len(heap) < limit:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+
+            if len(heap) == limit and heap[0][0] >= threshold:
+                break
+            depth += 1
+
+        return [-negative_doc for total, negative_doc in sorted(heap, reverse=True)]
+
+    def _postings(self, term):
+        """ Returns the docs containing term and their scores, best first """
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return (), ()
+
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.posting_docs[start:end], self.posting_scores[start:end]
+
+    def _word_postings(self, word):
+        """ Returns the docs matching word and their scores, by its best
+        scoring term, best first """
+        word_terms = text.terms(word)
+        docs, scores = self._postings(word_terms[0])
+        if len(word_terms) == 1:
+            return docs, scores
+
+        best = dict(itertools.izip(docs, scores))
+        for term in word_terms[1:]:
+            for doc, score in itertools.izip(*self._postings(term)):
+                score *= self.VARIANT_WEIGHT
+                if score > best.get(doc, 0.0):
+                    best[doc] = score
+
+        ranked = sorted(best.iteritems(), key=lambda (doc, score): (-score, doc))
+        return [doc for doc, score in ranked], [score for doc, score in ranked]
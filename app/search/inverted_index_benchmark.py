@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures search.inverted_index.InvertedIndex on a synthetic catalog shaped
+like the topic tree: short titles, a few keywords and a sentence or two of
+description per item, a tenth of them in Hebrew. Words are drawn from a 5000
+word vocabulary with Zipf-like frequencies, math words being the commonest.
+
+Reports how long building, serializing and loading the index take, how big
+the serialized index is before and after the zlib compression the Blobstore
+layer applies, and per-query latency.
+
+Usage: python inverted_index_benchmark.py [NUM_DOCUMENTS] [REPEATS]
+
+The App Engine SDK has to be importable (e.g. on PYTHONPATH).
+"""
+
+import bisect
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from search.inverted_index import InvertedIndex
+
+WORDS = (u"adding subtracting multiplying dividing fractions decimals "
+         u"integers exponents radicals linear quadratic equations "
+         u"inequalities functions graphing slope intercept polynomials "
+         u"factoring trigonometry sine cosine derivatives integrals limits "
+         u"probability statistics mean median variance vectors matrices "
+         u"chemistry atoms bonds physics motion energy biology cells "
+         u"history economics introduction example word problems the of "
+         u"and with to how solve find using").split()
+
+HEBREW_WORDS = (u"שברים חיבור חיסור כפל חילוק משוואות ומשוואות "
+                u"פונקציות גאומטריה הסתברות מבוא דוגמה של את עם "
+                u"בעיות מילוליות").split()
+
+QUERIES = [u"fractions", u"adding fractions", u"quadratic equations example",
+           u"solving linear equations with fractions", u"derivative",
+           u"משוואות", u"חיבור שברים", u"zebra"]
+
+
+def vocabulary(rand, words, size):
+    """ words plus made-up words up to size, most common first """
+    made_up = set()
+    while len(made_up) < size - len(words):
+        made_up.add(u"".join(rand.choice(u"abcdefghilmnoprstu")
+                             for _ in xrange(rand.randint(4, 10))))
+    return words + sorted(made_up)
+
+
+def zipf_sampler(rand, words):
+    """ Returns a function sampling words with frequency ~ 1 / rank """
+    cumulative = []
+    total = 0.0
+    for rank in xrange(1, len(words) + 1):
+        total += 1.0 / rank
+        cumulative.append(total)
+
+    def sample():
+        return words[bisect.bisect(cumulative, rand.random() * total)]
+    return sample
+
+
+def catalog(num_documents):
+    rand = random.Random(42)
+    english = zipf_sampler(rand, vocabulary(rand, WORDS, 5000))
+    hebrew = zipf_sampler(rand, HEBREW_WORDS)
+
+    def sentence(sample, low, high):
+        return u" ".join(sample() for _ in xrange(rand.randint(low, high)))
+
+    kinds = ["Video"] * 8 + ["Exercise", "Topic"]
+    for i in xrange(num_documents):
+        sample = english if i % 10 else hebrew
+        title = u"%s %d" % (sentence(sample, 2, 5), rand.randint(1, 9))
+        yield ("key-%d" % i, kinds[i % 10], title, [
+            (title, 3),
+            (u", ".join(sample() for _ in xrange(4)), 2),
+            (u"%s. %s." % (sentence(sample, 8, 20), sentence(sample, 8, 20)), 1),
+        ])
+
+
+def timed(fxn, *args):
+    start = time.time()
+    result = fxn(*args)
+    return result, 1000 * (time.time() - start)
+
+
+def main(num_documents, repeats):
+    index, build_ms = timed(InvertedIndex.build, catalog(num_documents))
+    data, dumps_ms = timed(index.dumps)
+    compressed = zlib.compress(data, 6)
+    loaded, loads_ms = timed(InvertedIndex.loads, data)
+
+    print "documents: %d, terms: %d, postings: %d" % (
+        num_documents, len(index.terms), len(index.posting_docs))
+    print "build %.0f ms, dumps %.0f ms, loads %.0f ms" % (build_ms, dumps_ms, loads_ms)
+    print "serialized %.1f KB, compressed %.1f KB, in memory about %.1f KB" % (
+        len(data) / 1024.0, len(compressed) / 1024.0, loaded.size / 1024.0)
+
+    print "%-42s %8s %10s %10s" % ("query", "results", "mean ms", "max ms")
+    for query in QUERIES:
+        timings = []
+        for _ in xrange(repeats):
+            results, ms = timed(loaded.search, query, 50)
+            timings.append(ms)
+        print "%-42s %8d %10.2f %10.2f" % (
+            query.encode("utf-8"), len(results),
+            sum(timings) / len(timings), max(timings))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 20)
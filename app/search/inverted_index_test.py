@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from search.inverted_index import InvertedIndex
+
+
+def build(*documents):
+    return InvertedIndex.build(
+        ("key-%d" % i, kind, title, [(title, 3), (description, 1)])
+        for i, (kind, title, description) in enumerate(documents))
+
+
+def keys(results):
+    return [key for key, title in results]
+
+
+class InvertedIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = build(
+            ("Video", "Adding fractions", "Adding fractions with like denominators"),
+            ("Video", "Multiplying fractions", "Fractions times fractions"),
+            ("Topic", "Fractions", "Everything about fractions and decimals"),
+            ("Video", "Equations of lines", "Slope intercept form of linear equations"),
+            ("Exercise", "Adding decimals", "Practice adding decimals"),
+        )
+
+    def test_stemmed_words_match(self):
+        self.assertEqual(set(keys(self.index.search("equation"))), set(["key-3"]))
+        self.assertEqual(set(keys(self.index.search("added"))),
+                         set(["key-0", "key-4"]))
+        self.assertEqual(self.index.search("the of and"), [])
+        self.assertEqual(self.index.search("trigonometry"), [])
+
+    def test_titles_outrank_descriptions(self):
+        self.assertEqual(keys(self.index.search("decimals"))[0], "key-4")
+
+    def test_documents_matching_more_words_come_first(self):
+        results = keys(self.index.search("adding fractions"))
+        self.assertEqual(results[0], "key-0")
+        self.assertEqual(set(results), set(["key-0", "key-1", "key-2", "key-4"]))
+
+    def test_phrases_are_boosted(self):
+        index = build(
+            ("Video", "Linear equations", "Slope of a line"),
+            ("Video", "Equations that are linear", "Slope of a line"),
+        )
+        self.assertEqual(keys(index.search("linear equations")), ["key-0", "key-1"])
+        self.assertEqual(keys(index.search("equations linear")), ["key-1", "key-0"])
+
+    def test_limit_and_kind(self):
+        self.assertEqual(len(self.index.search("fractions", limit=2)), 2)
+        self.assertEqual(self.index.search("fractions", kind="Topic"),
+                         [("key-2", "Fractions")])
+        self.assertEqual(keys(self.index.search("adding fractions", kind="Video")),
+                         ["key-0", "key-1"])
+
+    def test_hebrew_prefixes_and_niqqud(self):
+        index = build(
+            ("Video", u"פתרון משוואות", u"משוואות ממעלה ראשונה"),
+            ("Video", u"וּמִשְׁוָואוֹת", u""),
+            ("Video", u"שברים", u"חיבור שברים"),
+        )
+        self.assertEqual(set(keys(index.search(u"משוואות"))),
+                         set(["key-0", "key-1"]))
+        self.assertEqual(set(keys(index.search(u"המשוואות"))),
+                         set(["key-0", "key-1"]))
+        self.assertEqual(keys(index.search(u"בשברים")), ["key-2"])
+
+    def test_serialization_round_trips(self):
+        loaded = InvertedIndex.loads(self.index.dumps())
+        for query in ["adding fractions", "equations", "decimals"]:
+            self.assertEqual(loaded.search(query), self.index.search(query))
+
+        empty = InvertedIndex.loads(InvertedIndex.build([]).dumps())
+        self.assertEqual(empty.search("fractions"), [])
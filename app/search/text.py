@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Text normalization and tokenization shared by autocomplete and the
+in-memory search index.
+
+Text is lowercased, combining marks (accents, Hebrew niqqud and cantillation)
+are dropped and Hebrew final letters are folded into their regular forms, so
+that "שָׁלוֹם", "שלום" and a half-typed "שלומ" all look alike.
+"""
+
+import re
+import string
+import unicodedata
+
+from search.pyporter2 import Stemmer
+
+# Hebrew final letters, folded into their regular forms so that a query
+# typed mid-word (e.g. "שלומ") still matches "שלום"
+HEBREW_FINAL_FORMS = {
+    u"ך": u"כ", # kaf
+    u"ם": u"מ", # mem
+    u"ן": u"נ", # nun
+    u"ף": u"פ", # pe
+    u"ץ": u"צ", # tsadi
+}
+
+# Hebrew punctuation, mapped to what people type on a keyboard
+HEBREW_PUNCTUATION = {
+    u"־": u"-", # maqaf
+    u"׳": u"'", # geresh
+    u"״": u'"', # gershayim
+}
+
+# unicode.translate table dropping combining marks (accents, niqqud,
+# cantillation) and folding Hebrew final letters and punctuation. Marks past
+# U+3000 belong to scripts our titles aren't written in.
+NORMALIZE_TRANSLATION = dict(
+    (code_point, None) for code_point in xrange(0x3000)
+    if unicodedata.category(unichr(code_point)) == "Mn")
+NORMALIZE_TRANSLATION.update((ord(char), folded) for char, folded
+    in HEBREW_FINAL_FORMS.items() + HEBREW_PUNCTUATION.items())
+
+HEBREW_LETTERS = re.compile(u"[א-ת]")
+
+# Single-letter prefixes (and, the, in, to, from, that, as) Hebrew attaches
+# to words, and the pairs they're commonly stacked in
+HEBREW_PREFIXES = [u"ו" + prefix for prefix in
+                   u"ה ב ל מ ש כ".split()] + \
+                  [u"ש" + prefix for prefix in
+                   u"ה ב ל מ כ".split()] + \
+                  u"ו ה ב ל מ ש כ".split()
+
+# A word left shorter than this by stripping a prefix was probably never
+# prefixed
+HEBREW_MIN_STEM_LENGTH = 3
+
+WORD_SEPARATORS = re.compile(u"[\\s%s]+" % re.escape(string.punctuation),
+                             re.UNICODE)
+
+# Porter2 is pure python and slow, so stems are remembered
+STEMMER = Stemmer.Stemmer('english')
+STEMS = {}
+MAX_STEMS = 100000
+
+def normalize(text):
+    """ Returns text lowercased, with combining marks removed, Hebrew final
+    letters and punctuation folded and whitespace collapsed. """
+    if not isinstance(text, unicode):
+        text = text.decode("utf-8", "replace")
+
+    text = unicodedata.normalize("NFKD", text.lower())
+    return u" ".join(text.translate(NORMALIZE_TRANSLATION).split())
+
+def words(text):
+    """ Returns the normalized words of text, split at whitespace and
+    punctuation. """
+    return [word for word in WORD_SEPARATORS.split(normalize(text)) if word]
+
+def terms(word):
+    """ Returns the index terms of a normalized word: its Porter2 stem if
+    it's English, or the word itself followed by every way of stripping
+    prefixes off it if it's Hebrew, since which letters are prefixes is
+    ambiguous (e.g. "ומשוואות" is "and equations"). """
+    if HEBREW_LETTERS.match(word):
+        word_terms = [word]
+        for prefix in HEBREW_PREFIXES:
+            if (word.startswith(prefix) and
+                    len(word) - len(prefix) >= HEBREW_MIN_STEM_LENGTH):
+                word_terms.append(word[len(prefix):])
+        return word_terms
+
+    stemmed = STEMS.get(word)
+    if stemmed is None:
+        if len(STEMS) >= MAX_STEMS:
+            STEMS.clear()
+        stemmed = STEMS[word] = STEMMER.stemWord(word)
+    return [stemmed]
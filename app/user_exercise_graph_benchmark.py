@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+Times UserExerciseGraph generation, per-attempt updates and the state
+lookups done by coach reports on a synthetic exercise catalog.
+
+Usage: python user_exercise_graph_benchmark.py [NUM_EXERCISES]
+
+The App Engine SDK has to be importable (e.g. on PYTHONPATH), since models
+imports it.
+"""
+
+import datetime
+import random
+import sys
+import time
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+import models
+
+
+def synthetic_exercise_dicts(num_exercises, seed=0):
+    """ A layered catalog: each exercise covers and requires a few exercises
+    from earlier layers, like the real knowledge map.
+    """
+    rand = random.Random(seed)
+    layer_width = 20
+
+    exercise_dicts = []
+    for i in xrange(num_exercises):
+        earlier = ["ex_%d" % j for j in xrange(max(0, i - 3 * layer_width), i - i % layer_width)]
+        exercise_dicts.append({
+            "id": i,
+            "name": "ex_%d" % i,
+            "display_name": "Exercise %d" % i,
+            "h_position": i // layer_width,
+            "v_position": i % layer_width,
+            "summative": False,
+            "num_milestones": 0,
+            "proficient": None,
+            "explicitly_proficient": None,
+            "suggested": None,
+            "covers": rand.sample(earlier, min(2, len(earlier))),
+            "prerequisites": rand.sample(earlier, min(2, len(earlier))),
+        })
+    return exercise_dicts
+
+
+class SyntheticUserData(object):
+    def __init__(self, proficient_exercises):
+        self.proficient_exercises = proficient_exercises
+
+
+class SyntheticCache(object):
+    """ Stands in for UserExerciseCache, which needs the datastore. """
+
+    def __init__(self, dicts):
+        self.dicts = dicts
+
+    def user_exercise_dict(self, exercise_name):
+        return (self.dicts.get(exercise_name) or
+                models.UserExerciseCache.dict_from_user_exercise(None))
+
+    def update_dict(self, exercise_name, **kwargs):
+        user_exercise_dict = dict(self.user_exercise_dict(exercise_name))
+        user_exercise_dict.update(kwargs)
+        self.dicts[exercise_name] = user_exercise_dict
+
+
+def synthetic_user(exercise_dicts, seed=0):
+    rand = random.Random(seed)
+    now = datetime.datetime.now()
+
+    dicts = {}
+    proficient_exercises = []
+    for exercise_dict in exercise_dicts[:len(exercise_dicts) // 2]:
+        total_done = rand.randint(1, 30)
+        streak = rand.randint(0, total_done)
+        dicts[exercise_dict["name"]] = {
+            "streak": streak,
+            "longest_streak": streak,
+            "progress": rand.random(),
+            "struggling": False,
+            "total_done": total_done,
+            "last_done": now - datetime.timedelta(days=rand.randint(0, 60)),
+            "last_review": now - datetime.timedelta(days=rand.randint(0, 60)),
+            "review_interval_secs": 60 * 60 * 24 * rand.randint(1, 30),
+            "proficient_date": None,
+        }
+        if rand.random() < 0.5:
+            proficient_exercises.append(exercise_dict["name"])
+
+    return SyntheticUserData(proficient_exercises), SyntheticCache(dicts)
+
+
+def main(num_exercises):
+    exercise_dicts = synthetic_exercise_dicts(num_exercises)
+    user_data, cache = synthetic_user(exercise_dicts)
+    names = [exercise_dict["name"] for exercise_dict in exercise_dicts]
+    attempts = 200
+
+    start = time.time()
+    index = models.ExerciseGraphIndex(exercise_dicts)
+    index_secs = time.time() - start
+
+    rand = random.Random(1)
+    start = time.time()
+    for _ in xrange(attempts):
+        cache.update_dict(rand.choice(names), streak=1, total_done=5)
+        models.UserExerciseGraph.generate(user_data, cache, index)
+    generate_secs = time.time() - start
+
+    graph = models.UserExerciseGraph.generate(user_data, cache, index)
+    rand = random.Random(1)
+    start = time.time()
+    for _ in xrange(attempts):
+        name = rand.choice(names)
+        cache.update_dict(name, streak=1, total_done=5)
+        graph.update(user_data, name, index)
+    update_secs = time.time() - start
+
+    # states() for every exercise, as serializing /api/v1/user/exercises
+    # does. Invalidating the memoized views before each call reproduces the
+    # old per-call recomputation.
+    def all_states(invalidate):
+        for name in names:
+            if invalidate:
+                graph._invalidate_views()
+            graph.states(name)
+
+    start = time.time()
+    all_states(invalidate=True)
+    states_uncached_secs = time.time() - start
+
+    graph._invalidate_views()
+    start = time.time()
+    all_states(invalidate=False)
+    states_secs = time.time() - start
+
+    print "exercises:             %d" % num_exercises
+    print "index build (once):    %.2f ms" % (1000 * index_secs)
+    print "generate per attempt:  %.2f ms" % (1000 * generate_secs / attempts)
+    print "update per attempt:    %.2f ms" % (1000 * update_secs / attempts)
+    print "states(), all exercises, recomputed views: %.2f ms" % (1000 * states_uncached_secs)
+    print "states(), all exercises, memoized views:   %.2f ms" % (1000 * states_secs)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)